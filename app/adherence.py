@@ -0,0 +1,224 @@
+# asthma-backend/adherence.py
+"""
+Materialized medication adherence.
+
+Every MedicationStatusHistory row that means a dose was taken or missed is
+folded, as it is written, into two tables:
+
+* `medication_adherence_daily`: taken/missed counts per medication per day,
+  maintained with a single SQLite upsert, and
+* `medication_adherence`: running totals and the day streak per medication.
+
+A day extends the streak when a dose was taken and nothing was missed; a
+missed dose resets it. The stored streak only changes when a dose is logged,
+so readers go through `summaries`, which treats a streak whose last day is
+before yesterday as broken. `backfill` rebuilds both tables from history.
+"""
+import datetime
+
+from sqlalchemy import case, func, select, delete
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from app import models
+
+BACKFILL_CHUNK_SIZE = 200  # patients per transaction
+
+TAKEN_STATUSES = ("taken",)
+MISSED_STATUSES = ("not taken", "missed", "skipped")
+
+
+def classify(status: str):
+    """Map a status string to "taken", "missed" or None (no adherence signal)."""
+    status = (status or "").strip().lower()
+    if status in TAKEN_STATUSES:
+        return "taken"
+    if status in MISSED_STATUSES:
+        return "missed"
+    return None
+
+
+def advance(summary: models.MedicationAdherence, kind: str, at: datetime.datetime):
+    """Fold one taken/missed event into a MedicationAdherence row (in place)."""
+    day = at.date()
+    if kind == "missed":
+        summary.missed_count = (summary.missed_count or 0) + 1
+        summary.current_streak = 0
+        summary.streak_day = None
+        summary.last_missed_day = day
+    else:
+        summary.taken_count = (summary.taken_count or 0) + 1
+        summary.last_taken_at = at
+        # a day already counted, or one with a missed dose, does not extend the streak
+        if summary.streak_day != day and summary.last_missed_day != day:
+            if summary.streak_day is not None and summary.streak_day == day - datetime.timedelta(days=1):
+                summary.current_streak = (summary.current_streak or 0) + 1
+            else:
+                summary.current_streak = 1
+            summary.streak_day = day
+            summary.longest_streak = max(summary.longest_streak or 0, summary.current_streak)
+    summary.updated_at = datetime.datetime.utcnow()
+
+
+def record_status(db: Session, medication: models.Medication, status: str, at: datetime.datetime = None):
+    """Fold one status change into the adherence tables (does not commit)."""
+    kind = classify(status)
+    if kind is None:
+        return
+    at = at or datetime.datetime.utcnow()
+
+    table = models.MedicationAdherenceDaily.__table__
+    column = "taken_count" if kind == "taken" else "missed_count"
+    values = {"medication_id": medication.id, "owner_id": medication.owner_id, "day": at.date(),
+              "taken_count": 0, "missed_count": 0}
+    values[column] = 1
+    db.execute(insert(table).values(**values).on_conflict_do_update(
+        index_elements=["medication_id", "day"],
+        set_={column: table.c[column] + 1},
+    ))
+
+    _upsert_summary(db, medication, kind, at)
+
+
+def _upsert_summary(db: Session, medication: models.Medication, kind: str, at: datetime.datetime):
+    """`advance` as a single upsert on the MedicationAdherence row, so concurrent first writes can't collide."""
+    table = models.MedicationAdherence.__table__
+    c = table.c
+    day = at.date()
+    now = datetime.datetime.utcnow()
+    values = {"medication_id": medication.id, "owner_id": medication.owner_id, "taken_count": 0, "missed_count": 0,
+              "current_streak": 0, "longest_streak": 0, "updated_at": now}
+    if kind == "missed":
+        values.update(missed_count=1, last_missed_day=day)
+        set_ = {"missed_count": c.missed_count + 1, "current_streak": 0, "streak_day": None,
+                "last_missed_day": day, "updated_at": now}
+    else:
+        values.update(taken_count=1, current_streak=1, longest_streak=1, streak_day=day, last_taken_at=at)
+        # a day already counted, or one with a missed dose, does not extend the streak
+        extends = (func.coalesce(c.streak_day != day, True)) & (func.coalesce(c.last_missed_day != day, True))
+        streak = case(
+            (~extends, c.current_streak),
+            (c.streak_day == day - datetime.timedelta(days=1), c.current_streak + 1),
+            else_=1,
+        )
+        set_ = {"taken_count": c.taken_count + 1, "last_taken_at": at, "current_streak": streak,
+                "streak_day": case((extends, day), else_=c.streak_day),
+                "longest_streak": func.max(c.longest_streak, streak), "updated_at": now}
+    db.execute(insert(table).values(**values).on_conflict_do_update(index_elements=["medication_id"], set_=set_))
+
+
+def delete_for_medication(db: Session, medication_id: int):
+    db.query(models.MedicationAdherenceDaily).filter(models.MedicationAdherenceDaily.medication_id == medication_id).delete()
+    db.query(models.MedicationAdherence).filter(models.MedicationAdherence.medication_id == medication_id).delete()
+
+
+def delete_for_prescriber(db: Session, doctor_id: int):
+    """Drop adherence rows of every medication a doctor prescribed (their patients own them)."""
+    prescribed = select(models.Medication.id).where(models.Medication.prescribed_by == doctor_id)
+    db.execute(delete(models.MedicationAdherenceDaily).where(models.MedicationAdherenceDaily.medication_id.in_(prescribed)))
+    db.execute(delete(models.MedicationAdherence).where(models.MedicationAdherence.medication_id.in_(prescribed)))
+
+
+def live_streak(summary: models.MedicationAdherence, today: datetime.date = None) -> int:
+    """The stored streak, or 0 once a whole day has passed without a dose."""
+    today = today or datetime.datetime.utcnow().date()
+    if summary.streak_day is None or summary.streak_day < today - datetime.timedelta(days=1):
+        return 0
+    return summary.current_streak
+
+
+def summaries(db: Session, owner_id: int):
+    """A patient's MedicationAdherence rows as dicts, with the streak as of today."""
+    today = datetime.datetime.utcnow().date()
+    rows = db.query(models.MedicationAdherence).filter(
+        models.MedicationAdherence.owner_id == owner_id
+    ).order_by(models.MedicationAdherence.medication_id).all()
+    return [{
+        "medication_id": row.medication_id,
+        "owner_id": row.owner_id,
+        "taken_count": row.taken_count,
+        "missed_count": row.missed_count,
+        "current_streak": live_streak(row, today),
+        "longest_streak": row.longest_streak,
+        "last_taken_at": row.last_taken_at,
+    } for row in rows]
+
+
+def _rebuild_chunk(db: Session, owner_ids):
+    history, med = models.MedicationStatusHistory, models.Medication
+    db.execute(delete(models.MedicationAdherenceDaily).where(models.MedicationAdherenceDaily.owner_id.in_(owner_ids)))
+    db.execute(delete(models.MedicationAdherence).where(models.MedicationAdherence.owner_id.in_(owner_ids)))
+
+    rows = db.execute(
+        select(med.id, med.owner_id, history.status, history.changed_at)
+        .join(history, history.medication_id == med.id)
+        .where(med.owner_id.in_(owner_ids), history.changed_at.isnot(None))
+        .order_by(med.id, history.changed_at, history.id)
+    ).all()
+
+    daily = {}
+    summaries = {}
+    for medication_id, owner_id, status, changed_at in rows:
+        kind = classify(status)
+        if kind is None:
+            continue
+        counts = daily.setdefault((medication_id, changed_at.date()), {
+            "medication_id": medication_id, "owner_id": owner_id, "day": changed_at.date(),
+            "taken_count": 0, "missed_count": 0,
+        })
+        counts["taken_count" if kind == "taken" else "missed_count"] += 1
+
+        summary = summaries.get(medication_id)
+        if summary is None:
+            summary = summaries[medication_id] = models.MedicationAdherence(
+                medication_id=medication_id, owner_id=owner_id,
+                taken_count=0, missed_count=0, current_streak=0, longest_streak=0)
+        advance(summary, kind, changed_at)
+
+    if daily:
+        db.execute(models.MedicationAdherenceDaily.__table__.insert(), list(daily.values()))
+    db.add_all(summaries.values())
+    return len(rows)
+
+
+def backfill(db: Session, owner_ids=None, chunk_size: int = BACKFILL_CHUNK_SIZE) -> int:
+    """Rebuild adherence tables from MedicationStatusHistory; returns the number of patients processed."""
+    if owner_ids is None:
+        owner_ids = [row[0] for row in db.query(models.Medication.owner_id).filter(
+            models.Medication.owner_id.isnot(None)
+        ).distinct().order_by(models.Medication.owner_id).all()]
+    else:
+        owner_ids = list(owner_ids)
+
+    for i in range(0, len(owner_ids), chunk_size):
+        _rebuild_chunk(db, owner_ids[i:i + chunk_size])
+        db.commit()
+    return len(owner_ids)
+
+
+def count_missed(db: Session, owner_id: int, since: datetime.date) -> int:
+    daily = models.MedicationAdherenceDaily
+    return db.query(func.coalesce(func.sum(daily.missed_count), 0)).filter(
+        daily.owner_id == owner_id,
+        daily.day >= since
+    ).scalar() or 0
+
+
+def doctor_summary(db: Session, doctor_id: int, since: datetime.date):
+    """Taken/missed totals per linked patient since `since`, in one grouped query."""
+    daily, link, user = models.MedicationAdherenceDaily, models.DoctorPatient, models.User
+    taken = func.coalesce(func.sum(daily.taken_count), 0)
+    missed = func.coalesce(func.sum(daily.missed_count), 0)
+    return db.query(
+        user.id.label("patient_id"),
+        user.name,
+        taken.label("taken_count"),
+        missed.label("missed_count"),
+        func.count(func.distinct(daily.day)).label("active_days"),
+    ).select_from(link).join(
+        user, user.id == link.patient_id
+    ).outerjoin(
+        daily, (daily.owner_id == link.patient_id) & (daily.day >= since)
+    ).filter(
+        link.doctor_id == doctor_id
+    ).group_by(user.id, user.name).order_by(user.id).all()
@@ -64,11 +64,17 @@ def get_user(db: Session, email: EmailStr):
     return db.query(models.User).filter(models.User.email == email).first()
 
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
+    return user_from_token(db, token)
+
+def user_from_token(db: Session, token: Optional[str]):
+    """Resolve a raw JWT to its user, raising 401 like get_current_user (for non-header transports)."""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    if not token:
+        raise credentials_exception
     token_data = verify_token(token, credentials_exception)
     user = get_user(db, email=token_data.email)
     if user is None:
@@ -0,0 +1,62 @@
+# asthma-backend/early_warning.py
+"""
+Streaming early-warning detector for PEFR deterioration.
+
+Each reading's percent-of-baseline feeds two O(1) statistics kept in the
+patient's PEFR state:
+
+* an EWMA of the percentage, which catches a sustained low level, and
+* a lower one-sided CUSUM, which accumulates how far readings fall below
+  the expected level and catches a gradual drift well before Red.
+
+When either crosses its threshold a `PEFR_DETERIORATION` AlertLog is raised,
+at most once per debounce period. Thresholds are configurable through env.
+"""
+import datetime
+import os
+
+ALERT_TYPE = "PEFR_DETERIORATION"
+
+EWMA_ALPHA = float(os.getenv("PEFR_EWMA_ALPHA", "0.3"))
+# alert when the smoothed percent-of-baseline drops below this
+EWMA_THRESHOLD = float(os.getenv("PEFR_EWMA_THRESHOLD", "70"))
+# CUSUM: expected level, allowed slack below it, and decision threshold
+CUSUM_TARGET = float(os.getenv("PEFR_CUSUM_TARGET", "85"))
+CUSUM_SLACK = float(os.getenv("PEFR_CUSUM_SLACK", "5"))
+CUSUM_THRESHOLD = float(os.getenv("PEFR_CUSUM_THRESHOLD", "40"))
+DEBOUNCE = datetime.timedelta(hours=float(os.getenv("PEFR_WARNING_DEBOUNCE_HOURS", "24")))
+
+
+def update_statistics(ewma, cusum, percentage):
+    """Fold one percent-of-baseline value into (ewma, cusum)."""
+    ewma = percentage if ewma is None else EWMA_ALPHA * percentage + (1 - EWMA_ALPHA) * ewma
+    cusum = max(0.0, (cusum or 0.0) + (CUSUM_TARGET - CUSUM_SLACK - percentage))
+    return ewma, cusum
+
+
+def is_triggered(ewma, cusum) -> bool:
+    return cusum >= CUSUM_THRESHOLD or (ewma is not None and ewma < EWMA_THRESHOLD)
+
+
+def step(previous, new, percentage, recorded_at: datetime.datetime) -> bool:
+    """Advance the detector from `previous` into `new` (PatientState objects).
+
+    `percentage` is None when the reading could not be zoned (no baseline yet),
+    in which case the statistics carry over unchanged. Returns True when an
+    alert should be raised for this reading.
+    """
+    new.last_warning_at = previous.last_warning_at
+    if percentage is None:
+        new.ewma_percent, new.cusum = previous.ewma_percent, previous.cusum
+        return False
+
+    new.ewma_percent, new.cusum = update_statistics(previous.ewma_percent, previous.cusum, percentage)
+    if not is_triggered(new.ewma_percent, new.cusum):
+        return False
+    if previous.last_warning_at is not None and recorded_at - previous.last_warning_at < DEBOUNCE:
+        return False
+
+    new.last_warning_at = recorded_at
+    # restart the CUSUM so the next alert needs fresh evidence
+    new.cusum = 0.0
+    return True
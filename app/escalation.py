@@ -0,0 +1,305 @@
+# asthma-backend/escalation.py
+"""
+Escalation of unresolved Red-zone alerts.
+
+`open_alert` (used by log_alert) keeps at most one unresolved AlertLog per
+patient and alert type: a repeat bumps `occurrences` / `last_seen_at` on the
+open row instead of adding a new one. A unique partial index backs this up
+when two requests open the same alert at once. Alerts of an escalating type get a
+`next_escalation_at`, and a background worker polls
+
+    SELECT ... FROM alert_logs WHERE resolved = 0 AND next_escalation_at <= now
+
+through a partial index, applying the configured tiers in order:
+
+    doctor    notification + push to the patient's linked doctors
+    contacts  message to the patient's emergency contacts through the gateway
+
+Tiers come from ESCALATION_TIERS as "action:minutes" pairs measured from
+when the alert opened, e.g. "doctor:10,contacts:15". Linked doctors are
+already pushed the Red reading itself by record_pefr, so a doctor tier is
+only useful as a later reminder and the default is "contacts:15". Each tier
+is claimed with a conditional UPDATE, so an alert is never escalated twice,
+and the polling loop only runs in the worker holding the "escalation"
+lease (see leases.py). `resolve_for_patient` closes a patient's open alerts
+when they return to the Green zone.
+
+The SMS/email gateway is pluggable: ESCALATION_GATEWAY names a
+"module:attribute" factory, and the default StubGateway only logs.
+"""
+import datetime
+import importlib
+import os
+import threading
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app import models, notifications, leases
+from app.database import SessionLocal
+
+ESCALATION_ENABLED = os.getenv("ESCALATION_WORKER_ENABLED", "1").lower() in ("1", "true", "yes")
+POLL_SECONDS = float(os.getenv("ESCALATION_POLL_SECONDS", "0.5"))
+BATCH_SIZE = 500
+ESCALATING_TYPES = tuple(
+    t.strip() for t in os.getenv("ESCALATION_ALERT_TYPES", "RED_ZONE_TRIGGERED").split(",") if t.strip()
+)
+# alert types closed automatically by a Green reading
+PEFR_ALERT_TYPES = ("RED_ZONE_TRIGGERED", "PEFR_DETERIORATION")
+
+
+def parse_tiers(value: str):
+    """Parse "doctor:10,contacts:15" into [("doctor", timedelta(minutes=10)), ("contacts", timedelta(minutes=15))]."""
+    tiers = []
+    for part in (value or "").split(","):
+        if not part.strip():
+            continue
+        action, _, minutes = part.partition(":")
+        action = action.strip().lower()
+        if action not in ("doctor", "contacts"):
+            raise ValueError(f"Unknown escalation action {action!r}")
+        tiers.append((action, datetime.timedelta(minutes=float(minutes or 0))))
+    return sorted(tiers, key=lambda tier: tier[1])
+
+
+TIERS = parse_tiers(os.getenv("ESCALATION_TIERS", "contacts:15"))
+LEASE_NAME = "escalation"
+
+
+# ---------------------------------------------------------------
+# gateways
+
+class StubGateway:
+    """Logs outgoing messages instead of sending them (local development)."""
+
+    def __init__(self):
+        self.sent = []
+
+    def send_sms(self, phone_number: str, message: str) -> bool:
+        print(f"[escalation] SMS to {phone_number}: {message}")
+        self.sent.append(("sms", phone_number, message))
+        return True
+
+    def send_email(self, email: str, subject: str, message: str) -> bool:
+        print(f"[escalation] Email to {email}: {subject} - {message}")
+        self.sent.append(("email", email, message))
+        return True
+
+
+def load_gateway(spec: str = None):
+    """Instantiate the gateway named by `spec` ("package.module:factory"), or the stub."""
+    spec = spec if spec is not None else os.getenv("ESCALATION_GATEWAY", "")
+    if not spec:
+        return StubGateway()
+    module_name, _, attribute = spec.partition(":")
+    factory = getattr(importlib.import_module(module_name), attribute or "Gateway")
+    return factory()
+
+
+# ---------------------------------------------------------------
+# alert bookkeeping (called from request handlers; none of these commit)
+
+def _find_open(db: Session, user_id: int, alert_type: str):
+    return db.query(models.AlertLog).filter(
+        models.AlertLog.user_id == user_id,
+        models.AlertLog.alert_type == alert_type,
+        models.AlertLog.resolved == False
+    ).order_by(models.AlertLog.id).first()
+
+
+def open_alert(db: Session, user_id: int, alert_type: str, now: datetime.datetime = None) -> models.AlertLog:
+    """Create an alert, or fold it into the patient's open alert of the same type."""
+    now = now or datetime.datetime.utcnow()
+    existing = _find_open(db, user_id, alert_type)
+    if existing is None:
+        alert = models.AlertLog(user_id=user_id, alert_type=alert_type, timestamp=now, last_seen_at=now,
+                                occurrences=1, escalation_tier=0)
+        if alert_type in ESCALATING_TYPES and TIERS:
+            alert.next_escalation_at = now + TIERS[0][1]
+        try:
+            with db.begin_nested():
+                db.add(alert)
+            return alert
+        except IntegrityError:
+            # another request opened it between our check and insert
+            existing = _find_open(db, user_id, alert_type)
+            if existing is None:
+                raise
+
+    existing.occurrences = (existing.occurrences or 1) + 1
+    existing.last_seen_at = now
+    return existing
+
+
+def resolve_for_patient(db: Session, user_id: int, alert_types=PEFR_ALERT_TYPES, now: datetime.datetime = None) -> int:
+    """Close a patient's open alerts of `alert_types`; returns how many were closed."""
+    table = models.AlertLog.__table__
+    result = db.execute(update(table).where(
+        table.c.user_id == user_id,
+        table.c.resolved == False,
+        table.c.alert_type.in_(alert_types)
+    ).values(resolved=True, resolved_at=now or datetime.datetime.utcnow(), next_escalation_at=None))
+    return result.rowcount
+
+
+# ---------------------------------------------------------------
+# worker
+
+class EscalationWorker:
+    def __init__(self, session_factory=SessionLocal, tiers=None, gateway=None):
+        self.session_factory = session_factory
+        self.tiers = TIERS if tiers is None else tiers
+        self.gateway = gateway
+        self.escalated = 0
+        self.holder = leases.new_holder()
+        self._lease_until = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _claim(self, db: Session, alerts, now: datetime.datetime):
+        """Advance each alert one tier if nobody else did; returns the claimed (alert, action) pairs."""
+        table = models.AlertLog.__table__
+        claimed, exhausted = [], []
+        for alert_id, user_id, tier, opened_at in alerts:
+            if tier >= len(self.tiers):
+                # past the last configured tier (e.g. ESCALATION_TIERS got shorter): stop polling it
+                exhausted.append(alert_id)
+                continue
+            following = opened_at + self.tiers[tier + 1][1] if tier + 1 < len(self.tiers) else None
+            result = db.execute(update(table).where(
+                table.c.id == alert_id,
+                table.c.resolved == False,
+                table.c.escalation_tier == tier
+            ).values(escalation_tier=tier + 1, last_escalated_at=now, next_escalation_at=following))
+            if result.rowcount == 1:
+                claimed.append((alert_id, user_id, self.tiers[tier][0]))
+        if exhausted:
+            db.execute(update(table).where(
+                table.c.id.in_(exhausted),
+                table.c.escalation_tier >= len(self.tiers)
+            ).values(next_escalation_at=None))
+        db.commit()
+        return claimed
+
+    def run_pending(self, now: datetime.datetime = None) -> int:
+        """Escalate every alert whose next tier is due; returns the number of escalations."""
+        now = now or datetime.datetime.utcnow()
+        db = self.session_factory()
+        total = 0
+        try:
+            while True:
+                alert = models.AlertLog
+                due = db.query(alert.id, alert.user_id, alert.escalation_tier, alert.timestamp).filter(
+                    alert.resolved == False,
+                    alert.next_escalation_at <= now
+                ).order_by(alert.next_escalation_at).limit(BATCH_SIZE).all()
+                if not due:
+                    break
+                claimed = self._claim(db, [(a, u, t or 0, ts) for a, u, t, ts in due], now)
+                self._escalate_to_doctors(db, [user_id for _, user_id, action in claimed if action == "doctor"], now)
+                self._escalate_to_contacts(db, [user_id for _, user_id, action in claimed if action == "contacts"])
+                total += len(claimed)
+                if len(due) < BATCH_SIZE or not claimed:
+                    break
+        except Exception as e:
+            db.rollback()
+            print("Escalation run failed:", e)
+        finally:
+            db.close()
+        self.escalated += total
+        return total
+
+    def _escalate_to_doctors(self, db: Session, patient_ids, now: datetime.datetime):
+        if not patient_ids:
+            return
+        patient_ids = sorted(set(patient_ids))
+        names = dict(db.query(models.User.id, models.User.name).filter(models.User.id.in_(patient_ids)).all())
+        doctors_by_patient = {}
+        for patient_id, doctor_id in db.query(models.DoctorPatient.patient_id, models.DoctorPatient.doctor_id).filter(
+            models.DoctorPatient.patient_id.in_(patient_ids)
+        ).all():
+            doctors_by_patient.setdefault(patient_id, set()).add(doctor_id)
+
+        messages = {p: f"URGENT: Patient {names.get(p, p)} is in the Red zone and has not recovered." for p in patient_ids}
+        notifications.add_notifications(db, [
+            {"owner_id": doctor_id, "message": messages[p], "link": f"/patient/{p}/pefr", "created_at": now}
+            for p, doctors in doctors_by_patient.items() for doctor_id in doctors
+        ])
+        db.commit()
+        tokens = notifications.active_tokens(db, {d for doctors in doctors_by_patient.values() for d in doctors})
+        for p, doctors in doctors_by_patient.items():
+            if any(d in tokens for d in doctors):
+                notifications.push_to_owners(db, doctors, "Red Zone Escalation", messages[p],
+                                             {"link": f"/patient/{p}/pefr", "patient_id": str(p)}, tokens_by_owner=tokens)
+
+    def _escalate_to_contacts(self, db: Session, patient_ids):
+        if not patient_ids:
+            return
+        if self.gateway is None:
+            self.gateway = load_gateway()
+        patient_ids = sorted(set(patient_ids))
+        names = dict(db.query(models.User.id, models.User.name).filter(models.User.id.in_(patient_ids)).all())
+        contacts = db.query(models.EmergencyContact.owner_id, models.EmergencyContact.phone_number).filter(
+            models.EmergencyContact.owner_id.in_(patient_ids)
+        ).all()
+        for owner_id, phone_number in contacts:
+            message = (f"{names.get(owner_id, 'A patient')} has reported a Red-zone asthma reading and has not "
+                       f"recovered. Please check on them or call emergency services.")
+            try:
+                self.gateway.send_sms(phone_number, message)
+            except Exception as e:
+                print(f"Escalation SMS to {phone_number} failed: {e}")
+
+    def wake(self):
+        self._wake.set()
+
+    def is_leader(self, now: datetime.datetime = None) -> bool:
+        """Hold the escalation lease, renewing it once half of it has run out."""
+        now = now or datetime.datetime.utcnow()
+        renew_at = self._lease_until - datetime.timedelta(seconds=leases.LEASE_SECONDS / 2) if self._lease_until else None
+        if renew_at is None or now >= renew_at:
+            db = self.session_factory()
+            try:
+                held = leases.acquire(db, LEASE_NAME, self.holder, now=now)
+            except Exception as e:
+                held = False
+                print("Escalation lease check failed:", e)
+            finally:
+                db.close()
+            self._lease_until = now + datetime.timedelta(seconds=leases.LEASE_SECONDS) if held else None
+        return self._lease_until is not None
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self.is_leader():
+                self.run_pending()
+            self._wake.wait(POLL_SECONDS)
+            self._wake.clear()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="alert-escalation", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._lease_until is not None:
+            db = self.session_factory()
+            try:
+                leases.release(db, LEASE_NAME, self.holder)
+            except Exception as e:
+                print("Escalation lease release failed:", e)
+            finally:
+                db.close()
+            self._lease_until = None
+
+
+worker = EscalationWorker()
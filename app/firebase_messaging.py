@@ -30,7 +30,17 @@ def initialize():
         print("Failed to initialize Firebase Admin:", e)
 
 
-def send_message_to_token(token: str, title: str, body: str, data: dict = None) -> bool:
+def _collapse_configs(collapse_key: str = None) -> dict:
+    """Platform options so a newer push with the same key replaces the older one on the device."""
+    if not collapse_key:
+        return {}
+    return {
+        "android": messaging.AndroidConfig(collapse_key=collapse_key),
+        "apns": messaging.APNSConfig(headers={"apns-collapse-id": collapse_key[:64]}),
+    }
+
+
+def send_message_to_token(token: str, title: str, body: str, data: dict = None, collapse_key: str = None) -> bool:
     if not token:
         return False
     if messaging is None:
@@ -42,7 +52,8 @@ def send_message_to_token(token: str, title: str, body: str, data: dict = None)
         message = messaging.Message(
             notification=messaging.Notification(title=title, body=body),
             token=token,
-            data=(data or {})
+            data=(data or {}),
+            **_collapse_configs(collapse_key)
         )
         res = messaging.send(message)
         print("FCM sent: ", res)
@@ -52,7 +63,7 @@ def send_message_to_token(token: str, title: str, body: str, data: dict = None)
         return False
 
 
-def send_messages_to_tokens(tokens: list, title: str, body: str, data: dict = None) -> dict:
+def send_messages_to_tokens(tokens: list, title: str, body: str, data: dict = None, collapse_key: str = None) -> dict:
     """Send to multiple tokens using multicast. Returns dict with successes and failures."""
     if not tokens:
         return {"success": 0, "failure": 0, "responses": []}
@@ -66,7 +77,8 @@ def send_messages_to_tokens(tokens: list, title: str, body: str, data: dict = No
         message = _messaging.MulticastMessage(
             notification=_messaging.Notification(title=title, body=body),
             tokens=tokens,
-            data=(data or {})
+            data=(data or {}),
+            **_collapse_configs(collapse_key)
         )
         resp = _messaging.send_each_for_multicast(message)
         results = []
@@ -0,0 +1,51 @@
+# asthma-backend/leases.py
+"""
+Leader leases for background workers.
+
+A lease is one `worker_leases` row per worker name. `acquire` takes it over
+with a single upsert when it is free or expired, and renews it when the
+caller already holds it, so among several API workers exactly one runs a
+given background loop; another takes over within LEASE_SECONDS if the
+holder dies.
+"""
+import datetime
+import os
+import socket
+import uuid
+
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from app import models
+
+LEASE_SECONDS = float(os.getenv("WORKER_LEASE_SECONDS", "30"))
+
+
+def new_holder() -> str:
+    """Identifier for one worker instance (host, process and a random suffix)."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def acquire(db: Session, name: str, holder: str, ttl: float = LEASE_SECONDS, now: datetime.datetime = None) -> bool:
+    """Take or renew the lease `name` for `holder`; returns True while `holder` owns it (commits)."""
+    now = now or datetime.datetime.utcnow()
+    table = models.WorkerLease.__table__
+    expires_at = now + datetime.timedelta(seconds=ttl)
+    stmt = insert(table).values(name=name, holder=holder, expires_at=expires_at)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["name"],
+        set_={"holder": holder, "expires_at": expires_at},
+        where=(table.c.holder == holder) | (table.c.expires_at < now),
+    ))
+    db.commit()
+    current = db.query(models.WorkerLease.holder).filter(models.WorkerLease.name == name).scalar()
+    return current == holder
+
+
+def release(db: Session, name: str, holder: str):
+    """Give the lease up early (e.g. on shutdown) so another worker can take over at once (commits)."""
+    db.query(models.WorkerLease).filter(
+        models.WorkerLease.name == name,
+        models.WorkerLease.holder == holder
+    ).delete(synchronize_session=False)
+    db.commit()
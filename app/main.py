@@ -1,13 +1,16 @@
 # asthma-backend/main.py
-from fastapi import FastAPI, Depends, HTTPException, status, Query, Form
+from fastapi import FastAPI, Depends, HTTPException, status, Query, Form, Request
 from fastapi.security import OAuth2PasswordRequestForm
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from sqlalchemy import select, desc, text, inspect
-from typing import List, Optional
+from sqlalchemy import select, desc, text, inspect, func
+from typing import List, Optional, Union
 
 import os
+import asyncio
 import datetime
+import numpy as np
 
 from . import auth, database, models, schemas
 from .database import engine
@@ -19,8 +22,22 @@ from .otp_service import (
     send_otp_email
 )
 
-from ml.predictor import get_predictor
+from ml.predictor import get_predictor, current_predictor, features_to_rows, MAX_BATCH_ROWS
+from ml import prediction_cache, registry, inference_executor
+from ml.inference_executor import InferenceBusy
 from . import firebase_messaging
+from . import timeseries
+from . import pefr_analytics
+from . import rollups
+from . import pefr_state
+from . import early_warning
+from . import risk
+from . import adherence
+from . import reminder_scheduler as reminders
+from . import escalation
+from . import realtime
+from . import notifications
+from . import ml_service
 from fastapi import BackgroundTasks
 
 # Create all database tables on startup
@@ -79,11 +96,392 @@ def ensure_user_columns():
                 print("Added column fcm_token to users table")
             except Exception as e:
                 print(f"Could not add column fcm_token: {e}")
+        if 'timezone' not in existing_cols:
+            try:
+                conn.execute(text("ALTER TABLE users ADD COLUMN timezone TEXT"))
+                print("Added column timezone to users table")
+            except Exception as e:
+                print(f"Could not add column timezone: {e}")
+        if 'notification_digest' not in existing_cols:
+            try:
+                conn.execute(text("ALTER TABLE users ADD COLUMN notification_digest BOOLEAN DEFAULT 0"))
+                print("Added column notification_digest to users table")
+            except Exception as e:
+                print(f"Could not add column notification_digest: {e}")
         conn.close()
     except Exception as e:
         print("Startup user migration check failed:", e)
 
 
+@app.on_event("startup")
+def ensure_reminder_columns():
+    """Add scheduler bookkeeping columns to reminders for databases created before them."""
+    try:
+        insp = inspect(engine)
+        if 'reminders' not in insp.get_table_names():
+            return
+
+        conn = engine.connect()
+        res = conn.execute(text("PRAGMA table_info('reminders')")).fetchall()
+        existing_cols = [r[1] for r in res]
+        for col in ('last_fired_at', 'last_acknowledged_at', 'updated_at'):
+            if col not in existing_cols:
+                try:
+                    conn.execute(text(f"ALTER TABLE reminders ADD COLUMN {col} DATETIME"))
+                    print(f"Added column {col} to reminders table")
+                except Exception as e:
+                    print(f"Could not add column {col}: {e}")
+        conn.close()
+    except Exception as e:
+        print("Startup reminder migration check failed:", e)
+
+
+@app.on_event("startup")
+def ensure_pefr_state_columns():
+    """Add early-warning and zone-definition columns to patient_pefr_state for databases created before them."""
+    try:
+        insp = inspect(engine)
+        if 'patient_pefr_state' not in insp.get_table_names():
+            return
+
+        conn = engine.connect()
+        res = conn.execute(text("PRAGMA table_info('patient_pefr_state')")).fetchall()
+        existing_cols = [r[1] for r in res]
+        additions = {
+            'ewma_percent': 'FLOAT',
+            'cusum': 'FLOAT NOT NULL DEFAULT 0',
+            'last_warning_at': 'DATETIME',
+            'zones_window_weeks': 'INTEGER'
+        }
+        for col, ddl in additions.items():
+            if col not in existing_cols:
+                try:
+                    conn.execute(text(f"ALTER TABLE patient_pefr_state ADD COLUMN {col} {ddl}"))
+                    print(f"Added column {col} to patient_pefr_state table")
+                except Exception as e:
+                    print(f"Could not add column {col}: {e}")
+        conn.close()
+    except Exception as e:
+        print("Startup PEFR state migration check failed:", e)
+
+
+@app.on_event("startup")
+def ensure_baseline_columns():
+    """Add manual-baseline columns to baseline_pefr, filled from the baseline audit log."""
+    try:
+        insp = inspect(engine)
+        if 'baseline_pefr' not in insp.get_table_names():
+            return
+
+        with engine.begin() as conn:
+            res = conn.execute(text("PRAGMA table_info('baseline_pefr')")).fetchall()
+            existing_cols = [r[1] for r in res]
+            additions = {
+                'manual_value': 'INTEGER',
+                'manual_set_at': 'DATETIME'
+            }
+            added = False
+            for col, ddl in additions.items():
+                if col not in existing_cols:
+                    try:
+                        conn.execute(text(f"ALTER TABLE baseline_pefr ADD COLUMN {col} {ddl}"))
+                        print(f"Added column {col} to baseline_pefr table")
+                        added = True
+                    except Exception as e:
+                        print(f"Could not add column {col}: {e}")
+            if added:
+                # POST /patient/baseline logs "Value: <n>"; the latest entry per patient is the manual baseline
+                rows = conn.execute(text(
+                    "SELECT user_id, details, timestamp FROM audit_logs "
+                    "WHERE action IN ('CREATE_BASELINE', 'UPDATE_BASELINE') ORDER BY id"
+                )).fetchall()
+                latest = {}
+                for user_id, details, timestamp in rows:
+                    try:
+                        latest[user_id] = (int((details or "").split("Value:")[1]), timestamp)
+                    except (IndexError, ValueError):
+                        continue
+                for user_id, (value, timestamp) in latest.items():
+                    conn.execute(text(
+                        "UPDATE baseline_pefr SET manual_value = :value, manual_set_at = :set_at WHERE owner_id = :owner"
+                    ), {"value": value, "set_at": timestamp, "owner": user_id})
+    except Exception as e:
+        print("Startup baseline migration check failed:", e)
+
+
+@app.on_event("startup")
+def ensure_medication_forecast_columns():
+    """Add refill-cycle columns to medication_forecasts for databases created before them."""
+    try:
+        insp = inspect(engine)
+        if 'medication_forecasts' not in insp.get_table_names():
+            return
+
+        conn = engine.connect()
+        res = conn.execute(text("PRAGMA table_info('medication_forecasts')")).fetchall()
+        existing_cols = [r[1] for r in res]
+        additions = {
+            'doses_remaining': 'INTEGER',
+            'refill_cycle': 'INTEGER NOT NULL DEFAULT 0',
+            'notified_refill_cycle': 'INTEGER'
+        }
+        for col, ddl in additions.items():
+            if col not in existing_cols:
+                try:
+                    conn.execute(text(f"ALTER TABLE medication_forecasts ADD COLUMN {col} {ddl}"))
+                    print(f"Added column {col} to medication_forecasts table")
+                except Exception as e:
+                    print(f"Could not add column {col}: {e}")
+        conn.close()
+    except Exception as e:
+        print("Startup medication forecast migration check failed:", e)
+
+
+@app.on_event("startup")
+def ensure_doctor_patient_columns():
+    """Add risk score columns to doctor_patient_map for databases created before them."""
+    try:
+        insp = inspect(engine)
+        if 'doctor_patient_map' not in insp.get_table_names():
+            return
+
+        conn = engine.connect()
+        res = conn.execute(text("PRAGMA table_info('doctor_patient_map')")).fetchall()
+        existing_cols = [r[1] for r in res]
+        additions = {
+            'risk_score': 'FLOAT NOT NULL DEFAULT 0',
+            'risk_updated_at': 'DATETIME',
+            'risk_stale_since': 'DATETIME'
+        }
+        for col, ddl in additions.items():
+            if col not in existing_cols:
+                try:
+                    conn.execute(text(f"ALTER TABLE doctor_patient_map ADD COLUMN {col} {ddl}"))
+                    print(f"Added column {col} to doctor_patient_map table")
+                except Exception as e:
+                    print(f"Could not add column {col}: {e}")
+        conn.close()
+    except Exception as e:
+        print("Startup doctor-patient migration check failed:", e)
+
+
+@app.on_event("startup")
+def ensure_notification_columns():
+    """Add collapsing columns to notifications for databases created before them."""
+    try:
+        insp = inspect(engine)
+        if 'notifications' not in insp.get_table_names():
+            return
+
+        conn = engine.connect()
+        res = conn.execute(text("PRAGMA table_info('notifications')")).fetchall()
+        existing_cols = [r[1] for r in res]
+        additions = {
+            'collapse_key': 'TEXT',
+            'event_count': 'INTEGER DEFAULT 1',
+            'updated_at': 'DATETIME',
+            'pushed_at': 'DATETIME'
+        }
+        for col, ddl in additions.items():
+            if col not in existing_cols:
+                try:
+                    conn.execute(text(f"ALTER TABLE notifications ADD COLUMN {col} {ddl}"))
+                    print(f"Added column {col} to notifications table")
+                except Exception as e:
+                    print(f"Could not add column {col}: {e}")
+        conn.close()
+    except Exception as e:
+        print("Startup notification migration check failed:", e)
+
+
+@app.on_event("startup")
+def ensure_alert_columns():
+    """Add dedupe/escalation columns to alert_logs and schedule alerts that were already open."""
+    try:
+        insp = inspect(engine)
+        if 'alert_logs' not in insp.get_table_names():
+            return
+
+        with engine.begin() as conn:
+            res = conn.execute(text("PRAGMA table_info('alert_logs')")).fetchall()
+            existing_cols = [r[1] for r in res]
+            additions = {
+                'occurrences': 'INTEGER DEFAULT 1',
+                'last_seen_at': 'DATETIME',
+                'escalation_tier': 'INTEGER DEFAULT 0',
+                'last_escalated_at': 'DATETIME',
+                'next_escalation_at': 'DATETIME',
+                'resolved_at': 'DATETIME'
+            }
+            added = False
+            for col, ddl in additions.items():
+                if col not in existing_cols:
+                    try:
+                        conn.execute(text(f"ALTER TABLE alert_logs ADD COLUMN {col} {ddl}"))
+                        print(f"Added column {col} to alert_logs table")
+                        added = True
+                    except Exception as e:
+                        print(f"Could not add column {col}: {e}")
+            if added:
+                conn.execute(text("UPDATE alert_logs SET resolved = 0 WHERE resolved IS NULL"))
+                if escalation.TIERS:
+                    # Legacy rows were never resolved, so only alerts opened within the last tier's
+                    # delay are still worth escalating; older ones are closed rather than left open,
+                    # where they would swallow new Red alerts (open_alert folds into them).
+                    now = datetime.datetime.utcnow()
+                    params = {
+                        "now": now,
+                        "cutoff": now - escalation.TIERS[-1][1],
+                        "first_delay": f"+{escalation.TIERS[0][1].total_seconds():.0f} seconds",
+                    }
+                    for alert_type in escalation.ESCALATING_TYPES:
+                        conn.execute(text(
+                            "UPDATE alert_logs SET resolved = 1, resolved_at = :now "
+                            "WHERE resolved = 0 AND alert_type = :alert_type AND timestamp < :cutoff"
+                        ), dict(params, alert_type=alert_type))
+                        conn.execute(text(
+                            "UPDATE alert_logs "
+                            "SET next_escalation_at = strftime('%Y-%m-%d %H:%M:%f', timestamp, :first_delay) "
+                            "WHERE resolved = 0 AND next_escalation_at IS NULL AND alert_type = :alert_type"
+                        ), dict(params, alert_type=alert_type))
+    except Exception as e:
+        print("Startup alert migration check failed:", e)
+
+
+@app.on_event("startup")
+def ensure_symptom_rollup_columns():
+    """Add min/sum/count columns to symptom_daily_rollups; old rows are dropped and rebuilt lazily."""
+    try:
+        insp = inspect(engine)
+        if 'symptom_daily_rollups' not in insp.get_table_names():
+            return
+
+        with engine.begin() as conn:
+            res = conn.execute(text("PRAGMA table_info('symptom_daily_rollups')")).fetchall()
+            existing_cols = [r[1] for r in res]
+            additions = {
+                'min_wheeze': 'INTEGER',
+                'sum_wheeze': 'INTEGER NOT NULL DEFAULT 0',
+                'wheeze_count': 'INTEGER NOT NULL DEFAULT 0',
+                'min_cough': 'INTEGER',
+                'sum_cough': 'INTEGER NOT NULL DEFAULT 0',
+                'cough_count': 'INTEGER NOT NULL DEFAULT 0'
+            }
+            added = False
+            for col, ddl in additions.items():
+                if col not in existing_cols:
+                    try:
+                        conn.execute(text(f"ALTER TABLE symptom_daily_rollups ADD COLUMN {col} {ddl}"))
+                        print(f"Added column {col} to symptom_daily_rollups table")
+                        added = True
+                    except Exception as e:
+                        print(f"Could not add column {col}: {e}")
+            if added:
+                # existing rows lack the new aggregates; rollups.ensure_symptom_rollups rebuilds them on read
+                conn.execute(text("DELETE FROM symptom_daily_rollups"))
+    except Exception as e:
+        print("Startup symptom rollup migration check failed:", e)
+
+
+@app.on_event("startup")
+def ensure_indexes():
+    """Create indexes added after the tables were first created (create_all skips existing tables)."""
+    indexes = {
+        'ix_pefr_records_owner_recorded': 'pefr_records (owner_id, recorded_at)',
+        'ix_symptoms_owner_recorded': 'symptoms (owner_id, recorded_at)',
+        'ix_doctor_patient_map_doctor_risk': 'doctor_patient_map (doctor_id, risk_score)',
+        'ix_doctor_patient_map_risk_stale': 'doctor_patient_map (doctor_id) WHERE risk_stale_since IS NOT NULL',
+        'ix_notifications_owner_read': 'notifications (owner_id, read)',
+        'ix_notifications_owner_collapse': 'notifications (owner_id, collapse_key)',
+        'ix_alert_logs_open_due': 'alert_logs (next_escalation_at) WHERE resolved = 0',
+    }
+    unique_indexes = {
+        'uq_alert_logs_open_user': 'alert_logs (user_id, alert_type) WHERE resolved = 0',
+    }
+    try:
+        with engine.begin() as conn:
+            for name, target in indexes.items():
+                try:
+                    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {target}"))
+                except Exception as e:
+                    print(f"Could not create index {name}: {e}")
+    except Exception as e:
+        print("Startup index check failed:", e)
+    try:
+        with engine.begin() as conn:
+            if 'alert_logs' in inspect(engine).get_table_names():
+                # fold duplicate open alerts (from before the unique index) into the oldest
+                conn.execute(text(
+                    "UPDATE alert_logs SET resolved = 1, resolved_at = CURRENT_TIMESTAMP, next_escalation_at = NULL "
+                    "WHERE resolved = 0 AND id NOT IN "
+                    "(SELECT MIN(id) FROM alert_logs WHERE resolved = 0 GROUP BY user_id, alert_type)"
+                ))
+                conn.execute(text("DROP INDEX IF EXISTS ix_alert_logs_open_user"))
+            for name, target in unique_indexes.items():
+                try:
+                    conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS {name} ON {target}"))
+                except Exception as e:
+                    print(f"Could not create index {name}: {e}")
+    except Exception as e:
+        print("Startup unique index check failed:", e)
+
+
+@app.on_event("startup")
+def start_reminder_scheduler():
+    if not reminders.SCHEDULER_ENABLED:
+        print("Reminder scheduler disabled on this node (REMINDER_SCHEDULER_ENABLED=0)")
+        return
+    reminders.scheduler.start()
+
+
+@app.on_event("shutdown")
+def stop_reminder_scheduler():
+    reminders.scheduler.stop()
+
+
+@app.on_event("startup")
+def start_escalation_worker():
+    if not escalation.ESCALATION_ENABLED:
+        print("Alert escalation disabled on this node (ESCALATION_WORKER_ENABLED=0)")
+        return
+    escalation.worker.start()
+
+
+@app.on_event("shutdown")
+def stop_escalation_worker():
+    escalation.worker.stop()
+
+
+@app.on_event("startup")
+def start_model_registry_watcher():
+    registry.watcher.start()
+
+
+@app.on_event("shutdown")
+def stop_model_registry_watcher():
+    registry.watcher.stop()
+
+
+@app.on_event("startup")
+def start_model_warmup():
+    ml_service.warmup.start()
+
+
+@app.on_event("shutdown")
+def stop_model_warmup():
+    ml_service.warmup.stop()
+
+
+@app.on_event("startup")
+def start_inference_executor():
+    inference_executor.executor.start()
+
+
+@app.on_event("shutdown")
+def stop_inference_executor():
+    inference_executor.executor.stop()
+
+
 # ------------------------------------------------------------
 # Utility Functions
 # ------------------------------------------------------------
@@ -102,28 +500,24 @@ def calculate_zone(baseline: int, current_pefr: int):
         return ("Red", "Medical emergency. Seek immediate help.", percentage)
 
 
-def get_pefr_trend(db: Session, owner_id: int, current_pefr: int):
-    last_record = db.query(models.PEFRRecord).filter(
-        models.PEFRRecord.owner_id == owner_id
-    ).order_by(desc(models.PEFRRecord.recorded_at)).first()
-
-    if not last_record:
-        return "stable"
-    if current_pefr > last_record.pefr_value:
-        return "improving"
-    elif current_pefr < last_record.pefr_value:
-        return "worsening"
-    return "stable"
-
-
 def log_audit(db: Session, user_id: int, action: str, details: str = None):
     db_log = models.AuditLog(user_id=user_id, action=action, details=details)
     db.add(db_log)
 
 
 def log_alert(db: Session, user_id: int, alert_type: str):
-    db_alert = models.AlertLog(user_id=user_id, alert_type=alert_type)
-    db.add(db_alert)
+    # repeats of an open alert are folded into it (see escalation.open_alert)
+    return escalation.open_alert(db, user_id, alert_type)
+
+
+def filter_time_range(query, column, start: Optional[datetime.datetime], end: Optional[datetime.datetime]):
+    start = timeseries.to_naive_utc(start)
+    end = timeseries.to_naive_utc(end)
+    if start:
+        query = query.filter(column >= start)
+    if end:
+        query = query.filter(column < end)
+    return query
 
 # ------------------------------------------------------------
 # Root
@@ -429,6 +823,18 @@ def update_my_profile(
     current_user.gender = profile_update.gender
     current_user.contact_number = profile_update.contact_number
     current_user.address = profile_update.address
+
+    timezone_changed = None
+    if profile_update.timezone is not None and profile_update.timezone != current_user.timezone:
+        if profile_update.timezone and not reminders.is_valid_timezone(profile_update.timezone):
+            raise HTTPException(status_code=400, detail="Unknown time zone")
+        current_user.timezone = profile_update.timezone or None
+        timezone_changed = datetime.datetime.utcnow()
+        db.query(models.Reminder).filter(models.Reminder.owner_id == current_user.id).update(
+            {"updated_at": timezone_changed}, synchronize_session=False
+        )
+    if profile_update.notification_digest is not None:
+        current_user.notification_digest = profile_update.notification_digest
     
     if profile_update.password:
         current_user.hashed_password = auth.get_password_hash(profile_update.password)
@@ -437,6 +843,8 @@ def update_my_profile(
     db.refresh(current_user)
     log_audit(db, current_user.id, "UPDATE_PROFILE")
     db.commit()
+    if timezone_changed:
+        reminders.scheduler.set_timezone(current_user.id, current_user.timezone, updated_at=timezone_changed)
     return current_user
 
 
@@ -507,10 +915,25 @@ def delete_my_account(
     # Delete symptom records
     db.query(models.Symptom).filter(models.Symptom.owner_id == current_user.id).delete()
     
-    # Delete baseline
+    # Delete daily rollups
+    db.query(models.PEFRDailyRollup).filter(models.PEFRDailyRollup.owner_id == current_user.id).delete()
+    db.query(models.SymptomDailyRollup).filter(models.SymptomDailyRollup.owner_id == current_user.id).delete()
+
+    # Delete baseline and cached PEFR state
     db.query(models.BaselinePEFR).filter(models.BaselinePEFR.owner_id == current_user.id).delete()
+    db.query(models.PatientPEFRState).filter(models.PatientPEFRState.owner_id == current_user.id).delete()
     
-    # Delete medications (both prescribed and owned)
+    # Delete adherence rollups and refill forecasts
+    db.query(models.MedicationForecast).filter(models.MedicationForecast.owner_id == current_user.id).delete()
+    db.query(models.MedicationAdherenceDaily).filter(models.MedicationAdherenceDaily.owner_id == current_user.id).delete()
+    db.query(models.MedicationAdherence).filter(models.MedicationAdherence.owner_id == current_user.id).delete()
+
+    # Delete medications (both prescribed and owned), with the patients' adherence
+    # and forecasts for the prescribed ones
+    adherence.delete_for_prescriber(db, current_user.id)
+    db.query(models.MedicationForecast).filter(models.MedicationForecast.medication_id.in_(
+        db.query(models.Medication.id).filter(models.Medication.prescribed_by == current_user.id)
+    )).delete(synchronize_session=False)
     db.query(models.Medication).filter(models.Medication.owner_id == current_user.id).delete()
     db.query(models.Medication).filter(models.Medication.prescribed_by == current_user.id).delete()
     
@@ -520,6 +943,9 @@ def delete_my_account(
     # Delete notifications
     db.query(models.Notification).filter(models.Notification.owner_id == current_user.id).delete()
     
+    # Delete reminders
+    db.query(models.Reminder).filter(models.Reminder.owner_id == current_user.id).delete()
+    
     # Delete emergency contacts
     db.query(models.EmergencyContact).filter(models.EmergencyContact.owner_id == current_user.id).delete()
     
@@ -544,6 +970,11 @@ def delete_my_account(
     # Finally delete the user
     db.delete(current_user)
     db.commit()
+
+    timeseries.chart_cache.invalidate(current_user.id)
+    pefr_analytics.invalidate(current_user.id)
+    pefr_state.state_cache.evict(current_user.id)
+    reminders.scheduler.remove_owner(current_user.id)
     
     return {"message": "Account deleted successfully"}
 
@@ -562,11 +993,16 @@ def set_baseline(
     
     if db_baseline:
         db_baseline.baseline_value = baseline.baseline_value
+        db_baseline.manual_value = baseline.baseline_value
+        db_baseline.manual_set_at = datetime.datetime.utcnow()
         log_audit(db, current_user.id, "UPDATE_BASELINE", f"Value: {baseline.baseline_value}")
     else:
-        db_baseline = models.BaselinePEFR(**baseline.dict(), owner_id=current_user.id)
+        db_baseline = models.BaselinePEFR(**baseline.dict(), owner_id=current_user.id,
+                                          manual_value=baseline.baseline_value,
+                                          manual_set_at=datetime.datetime.utcnow())
         db.add(db_baseline)
         log_audit(db, current_user.id, "CREATE_BASELINE", f"Value: {baseline.baseline_value}")
+    pefr_state.state_cache.set_baseline(db, current_user.id, baseline.baseline_value)
     
     db.commit()
     db.refresh(db_baseline)
@@ -581,14 +1017,25 @@ def record_pefr(
     if current_user.role != models.UserRole.PATIENT:
         raise HTTPException(status_code=403, detail="Only patients can record PEFR.")
 
-    baseline = db.query(models.BaselinePEFR).filter(models.BaselinePEFR.owner_id == current_user.id).first()
-    
-    baseline_value = 0
-    if baseline:
-        baseline_value = baseline.baseline_value
+    recorded_at = datetime.datetime.utcnow()
 
-    zone, guidance, percentage = calculate_zone(baseline_value, pefr.pefr_value)
-    trend = get_pefr_trend(db, current_user.id, pefr.pefr_value)
+    # Advance the cached per-patient state; the versioned UPDATE fails if another
+    # worker wrote since we cached it, in which case we retry on fresh state.
+    for _ in range(pefr_state.MAX_WRITE_ATTEMPTS):
+        state = pefr_state.state_cache.get(db, current_user.id)
+        zone, guidance, percentage = calculate_zone(state.baseline_for(recorded_at) or 0, pefr.pefr_value)
+        new_state = state.advance(pefr.pefr_value, recorded_at)
+        early_warning_triggered = early_warning.step(state, new_state, percentage if zone != "Unknown" else None, recorded_at)
+        try:
+            pefr_state.state_cache.write(db, state, new_state)
+            break
+        except pefr_state.StaleStateError:
+            continue
+    else:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="PEFR was updated concurrently, please retry.")
+
+    trend = state.trend(pefr.pefr_value)
     
     db_record = models.PEFRRecord(
         pefr_value=pefr.pefr_value,
@@ -596,67 +1043,65 @@ def record_pefr(
         owner_id=current_user.id,
         percentage=percentage,
         trend=trend,
-        source=pefr.source
+        source=pefr.source,
+        recorded_at=recorded_at
     )
     db.add(db_record)
+    rollups.apply_pefr_reading(db, current_user.id, recorded_at, pefr.pefr_value, zone)
     
-    # Update baseline PEFR if this PEFR value is higher than current baseline
-    if baseline:
-        if pefr.pefr_value > baseline.baseline_value:
-            baseline.baseline_value = pefr.pefr_value
-            log_audit(db, current_user.id, "UPDATE_BASELINE_AUTO", f"Updated to highest PEFR: {pefr.pefr_value}")
-    else:
-        # For new users, set baseline to the first PEFR value
-        new_baseline = models.BaselinePEFR(baseline_value=pefr.pefr_value, owner_id=current_user.id)
-        db.add(new_baseline)
-        log_audit(db, current_user.id, "CREATE_BASELINE_AUTO", f"Set initial baseline to PEFR: {pefr.pefr_value}")
+    # Mirror the baseline into BaselinePEFR only when this reading changed it
+    if new_state.baseline_value != state.baseline_value:
+        if state.baseline_value is not None:
+            db.query(models.BaselinePEFR).filter(models.BaselinePEFR.owner_id == current_user.id).update(
+                {"baseline_value": new_state.baseline_value}, synchronize_session=False
+            )
+            log_audit(db, current_user.id, "UPDATE_BASELINE_AUTO", f"Updated to personal best: {new_state.baseline_value}")
+        else:
+            # For new users, set baseline to the first PEFR value
+            new_baseline = models.BaselinePEFR(baseline_value=pefr.pefr_value, owner_id=current_user.id)
+            db.add(new_baseline)
+            log_audit(db, current_user.id, "CREATE_BASELINE_AUTO", f"Set initial baseline to PEFR: {pefr.pefr_value}")
     
     if zone == "Red":
         log_alert(db, current_user.id, "RED_ZONE_TRIGGERED")
+    if early_warning_triggered:
+        log_alert(db, current_user.id, early_warning.ALERT_TYPE)
+    if zone == "Green":
+        escalation.resolve_for_patient(db, current_user.id)
     
     log_audit(db, current_user.id, "RECORD_PEFR", f"Value: {pefr.pefr_value}, Zone: {zone}")
+    risk.mark_stale(db, current_user.id)
+    doctor_ids = [row[0] for row in db.query(models.DoctorPatient.doctor_id).filter(
+        models.DoctorPatient.patient_id == current_user.id
+    ).all()]
+    realtime.queue_event(db, doctor_ids, {
+        "type": "patient_state",
+        "patient_id": current_user.id,
+        "pefr_value": pefr.pefr_value,
+        "zone": zone,
+        "percentage": percentage,
+        "trend": trend,
+        "recorded_at": recorded_at.isoformat(),
+    })
     
     db.commit()
+    pefr_state.state_cache.committed(new_state)
     db.refresh(db_record)
+    pefr_analytics.invalidate(current_user.id)
+    if zone == "Red":
+        escalation.worker.wake()
     
-    # Send notification to linked doctors
+    # Notify linked doctors (collapsed per patient; Red readings always push)
     try:
-        # Find all doctors linked to this patient
-        doctor_links = db.query(models.DoctorPatient).filter(models.DoctorPatient.patient_id == current_user.id).all()
-        doctor_ids = [link.doctor_id for link in doctor_links]
-        
         if doctor_ids:
             notif_msg = f"Patient {current_user.name} recorded PEFR: {pefr.pefr_value} L/min (Zone: {zone}, {percentage:.1f}%)"
             notif_link = f"/patient/{current_user.id}/pefr"
-            
-            # Create notifications for all linked doctors
-            for doctor_id in doctor_ids:
-                notification = models.Notification(owner_id=doctor_id, message=notif_msg, link=notif_link)
-                db.add(notification)
+            push_to = notifications.notify_collapsed(db, doctor_ids, "pefr", current_user.id, notif_msg, notif_link,
+                                                     urgent=(zone == "Red"))
             db.commit()
-            
-            # Send push notifications to all linked doctors
-            for doctor_id in doctor_ids:
-                try:
-                    # Get all active device tokens for this doctor
-                    devices = db.query(models.Device).filter(models.Device.owner_id == doctor_id, models.Device.active == True).all()
-                    tokens = [d.token for d in devices]
-                    if tokens:
-                        res = firebase_messaging.send_messages_to_tokens(tokens, title="Patient PEFR Update", body=notif_msg, data={"link": notif_link, "patient_id": str(current_user.id)})
-                        # Record push logs
-                        for r in (res.get('responses') or []):
-                            log = models.PushLog(owner_id=doctor_id, token=r.get('token'), success=bool(r.get('success')), response=str(r.get('response')) if r.get('response') else None, error=str(r.get('error')) if r.get('error') else None)
-                            db.add(log)
-                        db.commit()
-                        # Deactivate tokens that failed with invalid registration
-                        for r in (res.get('responses') or []):
-                            if not r.get('success'):
-                                tkn = r.get('token')
-                                db.query(models.Device).filter(models.Device.token == tkn).update({"active": False})
-                        db.commit()
-                except Exception as e:
-                    print(f"Failed to send FCM to doctor {doctor_id}: {e}")
-                    db.rollback()
+            notifications.push_to_owners(db, push_to, "Patient PEFR Update", notif_msg,
+                                         {"link": notif_link, "patient_id": str(current_user.id)},
+                                         collapse_key=notifications.collapse_key("pefr", current_user.id))
     except Exception as e:
         # Non-fatal: if notification fails, proceed to return PEFR record
         print(f"Failed to create/send PEFR notifications: {e}")
@@ -681,9 +1126,11 @@ def record_symptom(
         
     db_symptom = models.Symptom(
         **symptom.dict(),
-        owner_id=current_user.id
+        owner_id=current_user.id,
+        recorded_at=datetime.datetime.utcnow()
     )
     db.add(db_symptom)
+    rollups.apply_symptom(db, db_symptom)
     log_audit(db, current_user.id, "RECORD_SYMPTOM")
     db.commit()
     db.refresh(db_symptom)
@@ -693,9 +1140,63 @@ def record_symptom(
 # -----------------------------
 # ML Prediction Endpoint
 # -----------------------------
+def served_predictor():
+    """The predictor to use, or an immediate 503 while this worker is not warmed up."""
+    warmup = ml_service.warmup
+    if warmup.enabled and not warmup.ready:
+        raise HTTPException(status_code=503, detail=warmup.public_error or "ML models are still loading.",
+                            headers={"Retry-After": "5"})
+    try:
+        return get_predictor()
+    except (FileNotFoundError, registry.RegistryError) as e:
+        print("ML model load failed:", e)
+        raise HTTPException(status_code=503, detail="ML models are unavailable.")
+
+
+@app.get("/ml/ready", response_model=schemas.MLReadiness)
+def ml_ready():
+    """Readiness probe for ML traffic: 200 once the models are loaded and warmed, 503 before."""
+    warmup = ml_service.warmup
+    serving = current_predictor()
+    ready = warmup.ready or not warmup.enabled
+    body = schemas.MLReadiness(
+        ready=ready,
+        status=warmup.status,
+        model_version=serving.version if serving is not None else None,
+        backend=serving.backend if serving is not None else None,
+        error=warmup.public_error,
+        warm_seconds=warmup.warm_seconds,
+    )
+    if not ready:
+        return JSONResponse(status_code=503, content=body.dict())
+    return body
+
+
+async def served_predictor_async():
+    """served_predictor for async endpoints: a cold model load happens off the event loop."""
+    if current_predictor() is None:
+        return await run_in_threadpool(served_predictor)
+    return served_predictor()
+
+
+async def run_inference(submit, *args):
+    """Queue work on the inference executor and await it without blocking the event loop."""
+    try:
+        future = submit(*args)
+    except InferenceBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    return await asyncio.wrap_future(future)
+
+
+def _log_and_commit(db: Session, user_id: int, action: str, details: str):
+    log_audit(db, user_id, action, details)
+    db.commit()
+
+
 @app.post("/ml/predict", response_model=schemas.MLPrediction)
-def ml_predict(
+async def ml_predict(
     payload: schemas.MLInput,
+    intervals: bool = Query(False, description="Also return days / cure probability intervals from the trees' spread"),
     db: Session = Depends(database.get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
@@ -703,19 +1204,95 @@ def ml_predict(
     if current_user.role != models.UserRole.PATIENT:
         raise HTTPException(status_code=403, detail="Only patients can request ML predictions.")
 
-    try:
-        predictor = get_predictor()
-    except FileNotFoundError as e:
-        raise HTTPException(status_code=503, detail=str(e))
+    predictor = await served_predictor_async()
 
     features = payload.dict()
-    result = predictor.predict(features)
+    result = await run_inference(inference_executor.executor.submit, predictor, features, intervals)
 
-    # Log the usage for audit
-    log_audit(db, current_user.id, "ML_PREDICT", f"Input: {features}, Output: {result}")
-    db.commit()
+    # Log the usage for audit (sessions are blocking, so off the event loop)
+    await run_in_threadpool(_log_and_commit, db, current_user.id, "ML_PREDICT", f"Input: {features}, Output: {result}")
+
+    return schemas.MLPrediction(**result, model_version=predictor.version)
+
+
+@app.get("/ml/cache/stats", response_model=schemas.MLCacheStats)
+def ml_cache_stats(current_user: models.User = Depends(auth.get_current_user)):
+    """Hit-rate metrics of the prediction memo."""
+    if current_user.role != models.UserRole.DOCTOR:
+        raise HTTPException(status_code=403, detail="Only doctors can view ML metrics.")
+    return schemas.MLCacheStats(**prediction_cache.cache.stats())
+
+
+@app.get("/ml/inference/stats", response_model=schemas.MLInferenceStats)
+def ml_inference_stats(current_user: models.User = Depends(auth.get_current_user)):
+    """Queue, micro-batching and timing metrics of the inference executor."""
+    if current_user.role != models.UserRole.DOCTOR:
+        raise HTTPException(status_code=403, detail="Only doctors can view ML metrics.")
+    return schemas.MLInferenceStats(**inference_executor.executor.stats())
+
+
+@app.post("/ml/predict/batch", response_model=schemas.MLBatchPrediction)
+async def ml_predict_batch(
+    payload: schemas.MLBatchInput,
+    intervals: bool = Query(False, description="Also return days / cure probability intervals from the trees' spread"),
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """Predictions for many feature rows at once (doctors screening their panel)."""
+    if current_user.role != models.UserRole.DOCTOR:
+        raise HTTPException(status_code=403, detail="Only doctors can request batch ML predictions.")
+    if len(payload.rows) > MAX_BATCH_ROWS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_ROWS} rows per batch.")
+
+    predictor = await served_predictor_async()
+
+    rows = features_to_rows([row.dict() for row in payload.rows])
+    results = await run_inference(inference_executor.executor.submit_batch, predictor, rows, intervals)
 
-    return schemas.MLPrediction(**result)
+    await run_in_threadpool(_log_and_commit, db, current_user.id, "ML_PREDICT_BATCH", f"Rows: {len(results)}")
+
+    return schemas.MLBatchPrediction(
+        model_version=predictor.version,
+        predictions=[schemas.MLPrediction(**r, model_version=predictor.version) for r in results]
+    )
+
+
+@app.get("/ml/models", response_model=schemas.MLModelRegistry)
+def list_ml_models(current_user: models.User = Depends(auth.get_current_user)):
+    """Registered model versions, the active one and the one this worker is serving."""
+    if not ml_service.is_ml_admin(current_user):
+        raise HTTPException(status_code=403, detail="Only ML administrators can manage models.")
+    serving = current_predictor()
+    return schemas.MLModelRegistry(
+        active=registry.active_version(),
+        serving=serving.version if serving is not None else None,
+        versions=[schemas.MLModelVersion(version=m["version"], created_at=m.get("created_at"), env=m.get("env") or {})
+                  for m in registry.list_versions()]
+    )
+
+
+@app.post("/ml/models/reload", response_model=schemas.MLModelRegistry)
+def reload_ml_model(
+    payload: schemas.MLReloadRequest,
+    current_user: models.User = Depends(auth.get_current_user),
+    db: Session = Depends(database.get_db)
+):
+    """Activate a version (or re-read the active one) and swap it in; in-flight requests finish on the old model."""
+    if not ml_service.is_ml_admin(current_user):
+        raise HTTPException(status_code=403, detail="Only ML administrators can manage models.")
+    try:
+        predictor = registry.reload(payload.version)
+    except (FileNotFoundError, registry.RegistryError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"Model reload failed: {e!r}")
+        raise HTTPException(status_code=500, detail="Model reload failed; the previous model is still serving.")
+
+    log_audit(db, current_user.id, "ML_MODEL_RELOAD", f"Version: {predictor.version}")
+    db.commit()
+    ml_service.warm_cache(db, predictor)
+    ml_service.warmup.mark_ready(predictor)
+    return list_ml_models(current_user)
 
 
 # --- PATIENT-VIEW ENDPOINTS ---
@@ -748,6 +1325,83 @@ def get_my_symptom_records(
     return records
 
 
+def build_pefr_chart(db: Session, owner_id: int, start: Optional[datetime.datetime], end: Optional[datetime.datetime], points: int):
+    """Load a patient's PEFR window and downsample it with LTTB for plotting."""
+    start = timeseries.to_naive_utc(start)
+    end = timeseries.to_naive_utc(end)
+    cache_key = (owner_id, start, end, points)
+    closed = timeseries.is_closed_window(end)
+    if closed:
+        # the stored version moves when any worker records a reading or recomputes zones
+        version = pefr_state.stored_version(db, owner_id)
+        cached = timeseries.chart_cache.get(cache_key, version)
+        if cached is not None:
+            return cached
+
+    query = db.query(
+        models.PEFRRecord.recorded_at,
+        models.PEFRRecord.pefr_value,
+        models.PEFRRecord.zone,
+        models.PEFRRecord.percentage
+    ).filter(models.PEFRRecord.owner_id == owner_id)
+    query = filter_time_range(query, models.PEFRRecord.recorded_at, start, end)
+    rows = query.order_by(models.PEFRRecord.recorded_at.asc()).all()
+
+    if rows:
+        x = np.fromiter((timeseries.utc_timestamp(r.recorded_at) for r in rows), dtype=float, count=len(rows))
+        y = np.fromiter((r.pefr_value for r in rows), dtype=float, count=len(rows))
+        keep = timeseries.lttb(x, y, points)
+    else:
+        keep = []
+
+    series = schemas.PEFRChartSeries(
+        points=[
+            schemas.PEFRChartPoint(
+                recorded_at=rows[i].recorded_at,
+                pefr_value=rows[i].pefr_value,
+                zone=rows[i].zone,
+                percentage=rows[i].percentage
+            )
+            for i in keep
+        ],
+        total_points=len(rows),
+        downsampled=len(keep) < len(rows)
+    )
+    if closed:
+        timeseries.chart_cache.put(cache_key, series, version)
+    return series
+
+
+@app.get("/pefr/chart", response_model=schemas.PEFRChartSeries)
+def get_my_pefr_chart(
+    from_: Optional[datetime.datetime] = Query(None, alias="from", description="Window start (inclusive)"),
+    to: Optional[datetime.datetime] = Query(None, description="Window end (exclusive)"),
+    points: int = Query(300, ge=3, le=2000, description="Maximum number of points to return"),
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    if current_user.role != models.UserRole.PATIENT:
+        raise HTTPException(status_code=403, detail="Only patients can view this data.")
+
+    return build_pefr_chart(db, current_user.id, from_, to, points)
+
+
+@app.get("/pefr/daily", response_model=List[schemas.PEFRBucket])
+def get_my_pefr_daily(
+    from_: Optional[datetime.datetime] = Query(None, alias="from", description="Window start (inclusive)"),
+    to: Optional[datetime.datetime] = Query(None, description="Window end (exclusive)"),
+    group: str = Query("day", pattern="^(day|week)$"),
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    if current_user.role != models.UserRole.PATIENT:
+        raise HTTPException(status_code=403, detail="Only patients can view this data.")
+
+    first_day, last_day = rollups.day_bounds(timeseries.to_naive_utc(from_), timeseries.to_naive_utc(to))
+    rows = rollups.query_pefr_buckets(db, current_user.id, first_day, last_day, group)
+    return [schemas.PEFRBucket(**r) for r in rows]
+
+
 # --- DOCTOR LINKING ---
 
 @app.post("/patient/link-doctor", response_model=schemas.DoctorPatientLink)
@@ -782,7 +1436,8 @@ def link_patient_to_doctor(
 
     db_link = models.DoctorPatient(
         doctor_id=user_with_email.id,
-        patient_id=current_user.id
+        patient_id=current_user.id,
+        risk_stale_since=datetime.datetime.utcnow()
     )
     db.add(db_link)
     db.commit()
@@ -824,6 +1479,15 @@ def get_my_medications(
 ):
     return db.query(models.Medication).filter(models.Medication.owner_id == current_user.id).all()
 
+@app.get("/medications/forecasts", response_model=List[schemas.MedicationForecast])
+def get_my_medication_forecasts(
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    return db.query(models.MedicationForecast).filter(
+        models.MedicationForecast.owner_id == current_user.id
+    ).order_by(models.MedicationForecast.run_out_date).all()
+
 # --- UPDATE MEDICATION STATUS (PATIENT) ---
 
 @app.patch("/medications/{med_id}/status")
@@ -852,8 +1516,10 @@ def update_medication_status(
         changed_by_user_id = current_user.id
     )
     db.add(history)
+    adherence.record_status(db, med, update.status)
 
     log_audit(db, current_user.id, "UPDATE_MEDICATION_STATUS", f"Medication {med.id} -> {update.status}")
+    risk.mark_stale(db, med.owner_id)
     db.commit()
     # Notify prescribing doctor (or linked doctor) about the status update
     try:
@@ -864,24 +1530,11 @@ def update_medication_status(
 
         if doctor_id and doctor_id != current_user.id:
             msg = f"Patient {current_user.name} updated status for {med.name} to {update.status}."
-            notif = models.Notification(owner_id=doctor_id, message=msg, link=f"/medications/{med.id}")
-            db.add(notif)
+            push_to = notifications.notify_collapsed(db, [doctor_id], "medication", med.owner_id, msg,
+                                                     f"/medications/{med.id}")
             db.commit()
-            try:
-                devices = db.query(models.Device).filter(models.Device.owner_id == doctor_id, models.Device.active == True).all()
-                tokens = [d.token for d in devices]
-                if tokens:
-                    res = firebase_messaging.send_messages_to_tokens(tokens, title="Medication Status Updated", body=msg, data={"link": f"/medications/{med.id}"})
-                    for r in (res.get('responses') or []):
-                        log = models.PushLog(owner_id=doctor_id, token=r.get('token'), success=bool(r.get('success')), response=str(r.get('response')) if r.get('response') else None, error=str(r.get('error')) if r.get('error') else None)
-                        db.add(log)
-                    db.commit()
-                    for r in (res.get('responses') or []):
-                        if not r.get('success'):
-                            db.query(models.Device).filter(models.Device.token == r.get('token')).update({"active": False})
-                    db.commit()
-            except Exception:
-                db.rollback()
+            notifications.push_to_owners(db, push_to, "Medication Status Updated", msg, {"link": f"/medications/{med.id}"},
+                                         collapse_key=notifications.collapse_key("medication", med.owner_id))
     except Exception:
         db.rollback()
     return {"message": "Status updated"}
@@ -942,8 +1595,10 @@ def take_medication(
         changed_by_user_id = current_user.id
     )
     db.add(history)
+    adherence.record_status(db, med, 'taken')
 
     log_audit(db, current_user.id, "MEDICATION_TAKEN", f"Medication {med.id} taken, doses={doses}")
+    risk.mark_stale(db, med.owner_id)
     db.commit()
     db.refresh(med)
 
@@ -956,24 +1611,11 @@ def take_medication(
 
         if doctor_id and doctor_id != current_user.id:
             msg = f"Patient {current_user.name} marked {med.name} as taken."
-            notif = models.Notification(owner_id=doctor_id, message=msg, link=f"/medications/{med.id}")
-            db.add(notif)
+            push_to = notifications.notify_collapsed(db, [doctor_id], "medication", med.owner_id, msg,
+                                                     f"/medications/{med.id}")
             db.commit()
-            try:
-                devices = db.query(models.Device).filter(models.Device.owner_id == doctor_id, models.Device.active == True).all()
-                tokens = [d.token for d in devices]
-                if tokens:
-                    res = firebase_messaging.send_messages_to_tokens(tokens, title="Medication Taken", body=msg, data={"link": f"/medications/{med.id}"})
-                    for r in (res.get('responses') or []):
-                        log = models.PushLog(owner_id=doctor_id, token=r.get('token'), success=bool(r.get('success')), response=str(r.get('response')) if r.get('response') else None, error=str(r.get('error')) if r.get('error') else None)
-                        db.add(log)
-                    db.commit()
-                    for r in (res.get('responses') or []):
-                        if not r.get('success'):
-                            db.query(models.Device).filter(models.Device.token == r.get('token')).update({"active": False})
-                    db.commit()
-            except Exception:
-                db.rollback()
+            notifications.push_to_owners(db, push_to, "Medication Taken", msg, {"link": f"/medications/{med.id}"},
+                                         collapse_key=notifications.collapse_key("medication", med.owner_id))
     except Exception:
         db.rollback()
 
@@ -1016,6 +1658,101 @@ def get_patient_medication_history(
     return result
 
 
+@app.get("/doctor/patient/{patient_id}/medications/forecasts", response_model=List[schemas.MedicationForecast])
+def get_patient_medication_forecasts(
+    patient_id: int,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    if current_user.role != models.UserRole.DOCTOR:
+        raise HTTPException(status_code=403, detail="Only doctors can access this endpoint")
+
+    return db.query(models.MedicationForecast).filter(
+        models.MedicationForecast.owner_id == patient_id
+    ).order_by(models.MedicationForecast.run_out_date).all()
+
+
+# --- MEDICATION ADHERENCE (DOCTOR) ---
+
+@app.get("/doctor/adherence", response_model=List[schemas.PatientAdherence])
+def get_doctor_adherence(
+    days: int = Query(30, ge=1, le=365, description="Look-back window in days"),
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    if current_user.role != models.UserRole.DOCTOR:
+        raise HTTPException(status_code=403, detail="Only doctors can access this endpoint")
+
+    since = datetime.datetime.utcnow().date() - datetime.timedelta(days=days - 1)
+    result = []
+    for row in adherence.doctor_summary(db, current_user.id, since):
+        total = row.taken_count + row.missed_count
+        result.append(schemas.PatientAdherence(
+            **row._asdict(),
+            adherence_rate=round(row.taken_count / total, 4) if total else None
+        ))
+    return result
+
+
+@app.get("/doctor/patient/{patient_id}/adherence", response_model=List[schemas.MedicationAdherence])
+def get_patient_adherence(
+    patient_id: int,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    if current_user.role != models.UserRole.DOCTOR:
+        raise HTTPException(status_code=403, detail="Only doctors can access this endpoint")
+
+    return adherence.summaries(db, patient_id)
+
+
+# --- ALERTS (DOCTOR) ---
+
+@app.get("/doctor/alerts", response_model=List[schemas.AlertLog])
+def get_open_alerts(
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    if current_user.role != models.UserRole.DOCTOR:
+        raise HTTPException(status_code=403, detail="Only doctors can access this endpoint")
+
+    return db.query(models.AlertLog).join(
+        models.DoctorPatient, models.DoctorPatient.patient_id == models.AlertLog.user_id
+    ).filter(
+        models.DoctorPatient.doctor_id == current_user.id,
+        models.AlertLog.resolved == False
+    ).order_by(desc(models.AlertLog.timestamp)).all()
+
+
+@app.patch("/doctor/alerts/{alert_id}/resolve", response_model=schemas.AlertLog)
+def resolve_alert(
+    alert_id: int,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    if current_user.role != models.UserRole.DOCTOR:
+        raise HTTPException(status_code=403, detail="Only doctors can resolve alerts")
+
+    alert = db.query(models.AlertLog).join(
+        models.DoctorPatient, models.DoctorPatient.patient_id == models.AlertLog.user_id
+    ).filter(
+        models.AlertLog.id == alert_id,
+        models.DoctorPatient.doctor_id == current_user.id
+    ).first()
+    if not alert:
+        raise HTTPException(status_code=404, detail="Alert not found")
+
+    if not alert.resolved:
+        alert.resolved = True
+        alert.resolved_at = datetime.datetime.utcnow()
+        alert.next_escalation_at = None
+        log_audit(db, current_user.id, "RESOLVE_ALERT", f"Alert {alert.id} for patient {alert.user_id}")
+        risk.mark_stale(db, alert.user_id)
+        db.commit()
+        db.refresh(alert)
+    return alert
+
+
 # --- DELETE LINKED PATIENT (DOCTOR) ---
 @app.delete("/doctor/patient/{patient_id}")
 def delete_linked_patient(
@@ -1088,6 +1825,8 @@ def delete_medication(
 
     # Doctors may remove medications they prescribed
     if current_user.role == models.UserRole.DOCTOR:
+        adherence.delete_for_medication(db, med.id)
+        db.query(models.MedicationForecast).filter(models.MedicationForecast.medication_id == med.id).delete()
         db.delete(med)
         log_audit(db, current_user.id, "DELETE_MEDICATION", f"Doctor deleted medication {med_id}")
         db.commit()
@@ -1100,6 +1839,8 @@ def delete_medication(
     if not med.taken_status or med.taken_status.lower() == "not updated":
         raise HTTPException(status_code=400, detail="Please update medication status before deleting")
 
+    adherence.delete_for_medication(db, med.id)
+    db.query(models.MedicationForecast).filter(models.MedicationForecast.medication_id == med.id).delete()
     db.delete(med)
     log_audit(db, current_user.id, "DELETE_MEDICATION", f"Patient deleted medication {med_id}")
     db.commit()
@@ -1134,10 +1875,31 @@ def create_reminder(
     db: Session = Depends(database.get_db), 
     current_user: models.User = Depends(auth.get_current_user)
 ):
+    if reminders.parse_time(reminder.time) is None:
+        raise HTTPException(status_code=400, detail="Reminder time must look like HH:MM or h:MM AM/PM")
     db_reminder = models.Reminder(**reminder.dict(), owner_id=current_user.id)
     db.add(db_reminder)
     db.commit()
     db.refresh(db_reminder)
+    reminders.scheduler.upsert(db_reminder, current_user.timezone)
+    return db_reminder
+
+@app.post("/reminders/{reminder_id}/ack", response_model=schemas.Reminder)
+def acknowledge_reminder(
+    reminder_id: int,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    db_reminder = db.query(models.Reminder).filter(
+        models.Reminder.id == reminder_id,
+        models.Reminder.owner_id == current_user.id
+    ).first()
+    if not db_reminder:
+        raise HTTPException(status_code=404, detail="Reminder not found")
+
+    reminders.acknowledge(db, db_reminder)
+    db.commit()
+    db.refresh(db_reminder)
     return db_reminder
 
 @app.get("/reminders", response_model=List[schemas.Reminder])
@@ -1187,14 +1949,45 @@ def get_doctor_patients(
 
     return patients
 
+@app.get("/doctor/patients/at-risk", response_model=List[schemas.PatientRisk])
+def get_doctor_patients_at_risk(
+    limit: int = Query(10, ge=1, le=100, description="Number of highest-risk patients to return"),
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    if current_user.role != models.UserRole.DOCTOR:
+        raise HTTPException(status_code=403, detail="Only doctors can access this endpoint.")
+
+    # bring scores flagged by recent writes up to date, then take the
+    # top-k straight off the (doctor_id, risk_score) index
+    if risk.refresh_stale(db, doctor_id=current_user.id):
+        db.commit()
+    rows = db.query(
+        models.User.id.label("patient_id"),
+        models.User.name,
+        models.User.email,
+        models.DoctorPatient.risk_score,
+        models.DoctorPatient.risk_updated_at
+    ).join(
+        models.User, models.User.id == models.DoctorPatient.patient_id
+    ).filter(
+        models.DoctorPatient.doctor_id == current_user.id
+    ).order_by(desc(models.DoctorPatient.risk_score)).limit(limit).all()
+    return [schemas.PatientRisk(**r._asdict()) for r in rows]
+
 # --- DOCTOR: Patient-specific endpoints (pefr / symptoms / prescribe) ---
 
 def get_patient_by_id(db: Session, patient_id: int):
     return db.query(models.User).filter(models.User.id == patient_id, models.User.role == models.UserRole.PATIENT).first()
 
-@app.get("/patient/{patient_id}/pefr", response_model=List[schemas.PEFRRecord])
+@app.get("/patient/{patient_id}/pefr", response_model=Union[List[schemas.PEFRRecord], List[schemas.PEFRBucket]])
 def get_patient_pefr_records(
     patient_id: int,
+    from_: Optional[datetime.datetime] = Query(None, alias="from", description="Window start (inclusive)"),
+    to: Optional[datetime.datetime] = Query(None, description="Window end (exclusive)"),
+    order: str = Query("asc", pattern="^(asc|desc)$", description="Sort by recorded_at"),
+    limit: int = Query(timeseries.MAX_RANGE_ROWS, ge=1, le=timeseries.MAX_RANGE_ROWS),
+    group: Optional[str] = Query(None, pattern="^(day|week)$", description="Aggregate into day or week buckets"),
     db: Session = Depends(database.get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
@@ -1204,13 +1997,63 @@ def get_patient_pefr_records(
     patient = get_patient_by_id(db, patient_id)
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found.")
-        
-    return db.query(models.PEFRRecord).filter(models.PEFRRecord.owner_id == patient_id).all()
+
+    if group:
+        # read one rollup row per day instead of every reading
+        first_day, last_day = rollups.day_bounds(timeseries.to_naive_utc(from_), timeseries.to_naive_utc(to))
+        rows = rollups.query_pefr_buckets(db, patient_id, first_day, last_day, group, order == "desc", limit)
+        return [schemas.PEFRBucket(**r) for r in rows]
+
+    query = db.query(models.PEFRRecord).filter(models.PEFRRecord.owner_id == patient_id)
+    query = filter_time_range(query, models.PEFRRecord.recorded_at, from_, to)
+    sort = desc(models.PEFRRecord.recorded_at) if order == "desc" else models.PEFRRecord.recorded_at.asc()
+    return query.order_by(sort).limit(limit).all()
+
+
+@app.get("/patient/{patient_id}/pefr/chart", response_model=schemas.PEFRChartSeries)
+def get_patient_pefr_chart(
+    patient_id: int,
+    from_: Optional[datetime.datetime] = Query(None, alias="from", description="Window start (inclusive)"),
+    to: Optional[datetime.datetime] = Query(None, description="Window end (exclusive)"),
+    points: int = Query(300, ge=3, le=2000, description="Maximum number of points to return"),
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    if current_user.role != models.UserRole.DOCTOR:
+        raise HTTPException(status_code=403, detail="Only doctors can access this data.")
+
+    patient = get_patient_by_id(db, patient_id)
+    if not patient:
+        raise HTTPException(status_code=404, detail="Patient not found.")
+
+    return build_pefr_chart(db, patient_id, from_, to, points)
 
 
-@app.get("/patient/{patient_id}/symptoms", response_model=List[schemas.Symptom])
+@app.get("/patient/{patient_id}/pefr/analytics", response_model=schemas.PEFRAnalytics)
+def get_patient_pefr_analytics(
+    patient_id: int,
+    days: int = Query(30, ge=1, le=365, description="Number of days of daily metrics to return"),
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    if current_user.role != models.UserRole.DOCTOR:
+        raise HTTPException(status_code=403, detail="Only doctors can access this data.")
+
+    patient = get_patient_by_id(db, patient_id)
+    if not patient:
+        raise HTTPException(status_code=404, detail="Patient not found.")
+
+    return pefr_analytics.get_patient_analytics(db, patient_id, days)
+
+
+@app.get("/patient/{patient_id}/symptoms", response_model=Union[List[schemas.Symptom], List[schemas.SymptomBucket]])
 def get_patient_symptom_records(
     patient_id: int,
+    from_: Optional[datetime.datetime] = Query(None, alias="from", description="Window start (inclusive)"),
+    to: Optional[datetime.datetime] = Query(None, description="Window end (exclusive)"),
+    order: str = Query("asc", pattern="^(asc|desc)$", description="Sort by recorded_at"),
+    limit: int = Query(timeseries.MAX_RANGE_ROWS, ge=1, le=timeseries.MAX_RANGE_ROWS),
+    group: Optional[str] = Query(None, pattern="^(day|week)$", description="Aggregate into day or week buckets"),
     db: Session = Depends(database.get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
@@ -1220,8 +2063,17 @@ def get_patient_symptom_records(
     patient = get_patient_by_id(db, patient_id)
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found.")
-        
-    return db.query(models.Symptom).filter(models.Symptom.owner_id == patient_id).all()
+
+    if group:
+        # read one rollup row per day instead of every entry
+        first_day, last_day = rollups.day_bounds(timeseries.to_naive_utc(from_), timeseries.to_naive_utc(to))
+        rows = rollups.query_symptom_buckets(db, patient_id, first_day, last_day, group, order == "desc", limit)
+        return [schemas.SymptomBucket(**r) for r in rows]
+
+    query = db.query(models.Symptom).filter(models.Symptom.owner_id == patient_id)
+    query = filter_time_range(query, models.Symptom.recorded_at, from_, to)
+    sort = desc(models.Symptom.recorded_at) if order == "desc" else models.Symptom.recorded_at.asc()
+    return query.order_by(sort).limit(limit).all()
 
 @app.post("/doctor/patient/{patient_id}/medication", response_model=schemas.Medication)
 def prescribe_medication(
@@ -1290,6 +2142,50 @@ def prescribe_medication(
 
 
 # Notifications
+def _stream_user(ticket: Optional[str], token: Optional[str]):
+    db = database.SessionLocal()
+    try:
+        if ticket:
+            user_id = realtime.redeem_ticket(db, ticket)
+            if user_id is None:
+                raise HTTPException(status_code=401, detail="Invalid or expired stream ticket")
+            return user_id
+        return auth.user_from_token(db, token).id
+    finally:
+        db.close()
+
+
+@app.post("/events/ticket", response_model=schemas.StreamTicket)
+def create_stream_ticket(
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """Single-use ticket for /events/stream, for clients (EventSource) that cannot set headers."""
+    ticket = realtime.issue_ticket(db, current_user.id)
+    return {"ticket": ticket, "expires_in": realtime.TICKET_SECONDS}
+
+
+@app.get("/events/stream")
+async def stream_events(
+    request: Request,
+    ticket: Optional[str] = Query(None, description="Single-use ticket from POST /events/ticket")
+):
+    """Server-Sent Events feed of the caller's new notifications and, for doctors, linked patients' readings.
+
+    Authenticate with a ticket, or with an Authorization: Bearer header.
+    """
+    token = None
+    authorization = request.headers.get("Authorization", "")
+    if authorization.lower().startswith("bearer "):
+        token = authorization[7:]
+    user_id = await run_in_threadpool(_stream_user, ticket, token)
+    return StreamingResponse(
+        realtime.event_stream(request, user_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @app.get("/notifications", response_model=List[schemas.Notification])
 def get_my_notifications(
     db: Session = Depends(database.get_db),
@@ -1299,6 +2195,51 @@ def get_my_notifications(
     return notes
 
 
+def count_unread_notifications(db: Session, owner_id: int) -> int:
+    return db.query(func.count(models.Notification.id)).filter(
+        models.Notification.owner_id == owner_id,
+        models.Notification.read == False
+    ).scalar() or 0
+
+
+@app.get("/notifications/unread-count", response_model=schemas.UnreadCount)
+def get_unread_notification_count(
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    return schemas.UnreadCount(unread=count_unread_notifications(db, current_user.id))
+
+
+@app.post("/notifications/read-all", response_model=schemas.NotificationReadResult)
+def mark_all_notifications_read(
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    updated = db.query(models.Notification).filter(
+        models.Notification.owner_id == current_user.id,
+        models.Notification.read == False
+    ).update({"read": True}, synchronize_session=False)
+    db.commit()
+    return schemas.NotificationReadResult(updated=updated, unread=0)
+
+
+@app.post("/notifications/read", response_model=schemas.NotificationReadResult)
+def mark_notifications_read(
+    request: schemas.NotificationReadRequest,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    updated = 0
+    if request.ids:
+        updated = db.query(models.Notification).filter(
+            models.Notification.owner_id == current_user.id,
+            models.Notification.id.in_(request.ids),
+            models.Notification.read == False
+        ).update({"read": True}, synchronize_session=False)
+        db.commit()
+    return schemas.NotificationReadResult(updated=updated, unread=count_unread_notifications(db, current_user.id))
+
+
 @app.patch("/notifications/{notif_id}/read", response_model=schemas.Notification)
 def mark_notification_read(
     notif_id: int,
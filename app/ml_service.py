@@ -0,0 +1,165 @@
+# asthma-backend/ml_service.py
+"""
+Serving helpers for the ML endpoints.
+
+`warm_cache` precomputes the most common sanitized inputs seen in the
+ML_PREDICT audit log into the prediction memo (ml.prediction_cache), so
+the first requests after a start or a model change are served from it.
+Enable with ML_CACHE_WARM_TOP (number of distinct inputs, 0 = off);
+ML_CACHE_WARM_SCAN bounds how many recent audit rows are read.
+
+Model management endpoints (/ml/models) are limited to the accounts listed
+in ML_ADMIN_EMAILS (comma-separated).
+
+`ModelWarmup` loads the models in a background thread at startup, runs
+synthetic predictions to warm them and then the memo; until it finishes
+the ML endpoints answer 503 straight away and GET /ml/ready reports the
+status, so load balancers only send ML traffic to warmed workers. If the
+models are missing or fail to load it retries every
+ML_WARMUP_RETRY_SECONDS instead of retrying on every request.
+ML_WARMUP_ENABLED=0 restores loading on first request.
+"""
+import ast
+import datetime
+import os
+import re
+import threading
+import time
+from collections import Counter
+
+from sqlalchemy.orm import Session
+
+from app import models
+from app.database import SessionLocal
+from ml.predictor import FEATURES, sanitize_features, get_predictor, warm_up
+
+CACHE_WARM_TOP = int(os.getenv("ML_CACHE_WARM_TOP", "0"))
+CACHE_WARM_SCAN = int(os.getenv("ML_CACHE_WARM_SCAN", "20000"))
+WARMUP_ENABLED = os.getenv("ML_WARMUP_ENABLED", "1").lower() in ("1", "true", "yes")
+WARMUP_RETRY_SECONDS = float(os.getenv("ML_WARMUP_RETRY_SECONDS", "30"))
+
+# what clients see for a warm-up status; the underlying error is only logged
+PUBLIC_ERRORS = {
+    "missing": "ML models are not installed on this server.",
+    "failed": "ML models failed to load.",
+}
+ADMIN_EMAILS = {e.strip().lower() for e in os.getenv("ML_ADMIN_EMAILS", "").split(",") if e.strip()}
+
+# log_audit(..., "ML_PREDICT", f"Input: {features}, Output: {result}")
+_AUDIT_INPUT = re.compile(r"^Input: (\{.*?\}), Output: ")
+
+
+def is_ml_admin(user: models.User) -> bool:
+    return bool(user.email) and user.email.lower() in ADMIN_EMAILS
+
+
+def common_inputs(db: Session, top: int, scan: int = CACHE_WARM_SCAN):
+    """The `top` most frequent sanitized feature rows among the last `scan` predictions."""
+    details = db.query(models.AuditLog.details).filter(
+        models.AuditLog.action == "ML_PREDICT"
+    ).order_by(models.AuditLog.id.desc()).limit(scan).all()
+
+    counts = Counter()
+    for (detail,) in details:
+        match = _AUDIT_INPUT.match(detail or "")
+        if not match:
+            continue
+        try:
+            features = ast.literal_eval(match.group(1))
+        except (ValueError, SyntaxError):
+            continue
+        row = sanitize_features(features)
+        counts[tuple(row[k] for k in FEATURES)] += 1
+    return [row for row, _ in counts.most_common(top)]
+
+
+def warm_cache(db: Session, predictor, top: int = CACHE_WARM_TOP) -> int:
+    """Fill the predictor's memo with the most common recent inputs; returns entries added."""
+    if top <= 0 or predictor.cache is None:
+        return 0
+    return predictor.cache.warm(predictor, common_inputs(db, top))
+
+
+class ModelWarmup:
+    """Background model load + warm-up, and the readiness state the ML endpoints check."""
+
+    def __init__(self, enabled: bool = WARMUP_ENABLED, retry_seconds: float = WARMUP_RETRY_SECONDS,
+                 session_factory=SessionLocal):
+        self.enabled = enabled
+        self.retry_seconds = retry_seconds
+        self.session_factory = session_factory
+        self.status = "loading" if enabled else "disabled"
+        self.error = None
+        self.model_version = None
+        self.warm_seconds = None
+        self.ready_at = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    @property
+    def public_error(self):
+        """Client-safe summary of `error` (which may hold file paths; it is only logged)."""
+        if self.error is None:
+            return None
+        return PUBLIC_ERRORS.get(self.status, "ML models are unavailable.")
+
+    def mark_ready(self, predictor, warm_seconds: float = None):
+        self.model_version = predictor.version
+        self.warm_seconds = warm_seconds
+        self.error = None
+        self.ready_at = datetime.datetime.utcnow()
+        self.status = "ready"
+
+    def run_once(self) -> bool:
+        started = time.perf_counter()
+        try:
+            predictor = get_predictor()
+            warm_up(predictor)
+        except FileNotFoundError as e:
+            self.status, self.error = "missing", str(e)
+            print("Model files not found:", e)
+            return False
+        except Exception as e:
+            self.status, self.error = "failed", str(e)
+            print("Model warm-up failed:", e)
+            return False
+
+        db = self.session_factory()
+        try:
+            warmed = warm_cache(db, predictor)
+            if warmed:
+                print(f"Prediction cache warmed with {warmed} common inputs")
+        except Exception as e:
+            print("Prediction cache warm-up failed:", e)
+        finally:
+            db.close()
+
+        self.mark_ready(predictor, time.perf_counter() - started)
+        print(f"Model {predictor.version} ready after {self.warm_seconds:.2f}s warm-up")
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self.run_once():
+                return
+            self._stop.wait(self.retry_seconds)
+
+    def start(self):
+        if not self.enabled or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="model-warmup", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+warmup = ModelWarmup()
@@ -1,6 +1,6 @@
 # asthma-backend/models.py
 
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Float, DateTime, Enum as SAEnum
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Float, Date, DateTime, Index, UniqueConstraint, Enum as SAEnum, text
 from sqlalchemy.orm import relationship
 from app.database import Base
 import datetime
@@ -27,6 +27,10 @@ class User(Base):
     address = Column(String, nullable=True)
     # FCM device token for push notifications
     fcm_token = Column(String, nullable=True)
+    # IANA time zone name (e.g. "Asia/Kolkata") used to fire reminders; UTC when unset
+    timezone = Column(String, nullable=True)
+    # Doctors: replace per-event pushes with an hourly summary
+    notification_digest = Column(Boolean, default=False)
 
     # Relationships
     baseline = relationship("BaselinePEFR", back_populates="owner", uselist=False)
@@ -77,6 +81,9 @@ class BaselinePEFR(Base):
     id = Column(Integer, primary_key=True, index=True)
     baseline_value = Column(Integer, nullable=False)
     owner_id = Column(Integer, ForeignKey("users.id"))
+    # last value entered by hand (POST /patient/baseline); readings may raise baseline_value above it
+    manual_value = Column(Integer, nullable=True)
+    manual_set_at = Column(DateTime, nullable=True)
 
     owner = relationship("User", back_populates="baseline")
 
@@ -97,6 +104,11 @@ class PEFRRecord(Base):
 
     owner = relationship("User", back_populates="pefr_records")
 
+    # Per-patient time-range queries (charts, doctor views)
+    __table_args__ = (
+        Index("ix_pefr_records_owner_recorded", "owner_id", "recorded_at"),
+    )
+
 
 class Symptom(Base):
     __tablename__ = "symptoms"
@@ -119,6 +131,82 @@ class Symptom(Base):
 
     owner = relationship("User", back_populates="symptoms")
 
+    __table_args__ = (
+        Index("ix_symptoms_owner_recorded", "owner_id", "recorded_at"),
+    )
+
+
+class PatientPEFRState(Base):
+    """Latest PEFR state per patient, mirrored by the in-process cache in pefr_state.py.
+
+    `version` is bumped on every write so workers can detect a stale cached copy.
+    """
+    __tablename__ = "patient_pefr_state"
+
+    owner_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    last_value = Column(Integer, nullable=True)
+    last_recorded_at = Column(DateTime, nullable=True)
+    baseline_value = Column(Integer, nullable=True)
+    # running stats (Welford) over every reading
+    reading_count = Column(Integer, nullable=False, default=0)
+    mean_value = Column(Float, nullable=False, default=0.0)
+    m2_value = Column(Float, nullable=False, default=0.0)
+    # early-warning detector state (see early_warning.py)
+    ewma_percent = Column(Float, nullable=True)
+    cusum = Column(Float, nullable=False, default=0.0)
+    last_warning_at = Column(DateTime, nullable=True)
+    # baseline window (weeks) every stored zone was computed with; -1 = mixed, NULL = tracked before (all-time)
+    zones_window_weeks = Column(Integer, nullable=True)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+
+class PEFRDailyRollup(Base):
+    """One row per patient per UTC day, maintained incrementally by record_pefr."""
+    __tablename__ = "pefr_daily_rollups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    day = Column(Date, nullable=False)
+    reading_count = Column(Integer, nullable=False, default=0)
+    min_pefr = Column(Integer, nullable=True)
+    max_pefr = Column(Integer, nullable=True)
+    sum_pefr = Column(Integer, nullable=False, default=0)
+    mean_pefr = Column(Float, nullable=True)
+    green_count = Column(Integer, nullable=False, default=0)
+    yellow_count = Column(Integer, nullable=False, default=0)
+    red_count = Column(Integer, nullable=False, default=0)
+    unknown_count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint("owner_id", "day", name="uq_pefr_daily_rollups_owner_day"),
+    )
+
+
+class SymptomDailyRollup(Base):
+    """One row per patient per UTC day, maintained incrementally by record_symptom."""
+    __tablename__ = "symptom_daily_rollups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    day = Column(Date, nullable=False)
+    symptom_count = Column(Integer, nullable=False, default=0)
+    # min / sum / count of the rated entries, so day and week means can be served from here
+    min_wheeze = Column(Integer, nullable=True)
+    max_wheeze = Column(Integer, nullable=True)
+    sum_wheeze = Column(Integer, nullable=False, default=0)
+    wheeze_count = Column(Integer, nullable=False, default=0)
+    min_cough = Column(Integer, nullable=True)
+    max_cough = Column(Integer, nullable=True)
+    sum_cough = Column(Integer, nullable=False, default=0)
+    cough_count = Column(Integer, nullable=False, default=0)
+    max_dyspnea = Column(Integer, nullable=True)
+    max_night_symptoms = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("owner_id", "day", name="uq_symptom_daily_rollups_owner_day"),
+    )
+
 
 class DoctorPatient(Base):
     __tablename__ = "doctor_patient_map"
@@ -127,6 +215,17 @@ class DoctorPatient(Base):
     doctor_id = Column(Integer, ForeignKey("users.id"))
     patient_id = Column(Integer, ForeignKey("users.id"))
 
+    # Maintained by risk.refresh_patient_risk; writes only set risk_stale_since
+    # and the score is recomputed on the next read (or by refresh_risk_scores)
+    risk_score = Column(Float, nullable=False, default=0.0)
+    risk_updated_at = Column(DateTime, nullable=True)
+    risk_stale_since = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_doctor_patient_map_doctor_risk", "doctor_id", "risk_score"),
+        Index("ix_doctor_patient_map_risk_stale", "doctor_id", sqlite_where=text("risk_stale_since IS NOT NULL")),
+    )
+
 
 # -------------------------------------------------------------------
 # ----------------------  NEW MEDICATION CHANGES  --------------------
@@ -176,6 +275,61 @@ class MedicationStatusHistory(Base):
     changed_by_user = relationship("User", back_populates="medication_status_changes")
 
 
+class MedicationAdherence(Base):
+    """Running taken/missed totals and streaks per medication (see adherence.py)."""
+    __tablename__ = "medication_adherence"
+
+    medication_id = Column(Integer, ForeignKey("medications.id"), primary_key=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), index=True)
+    taken_count = Column(Integer, nullable=False, default=0)
+    missed_count = Column(Integer, nullable=False, default=0)
+    # consecutive days with a dose taken and nothing missed
+    current_streak = Column(Integer, nullable=False, default=0)
+    longest_streak = Column(Integer, nullable=False, default=0)
+    streak_day = Column(Date, nullable=True)
+    last_missed_day = Column(Date, nullable=True)
+    last_taken_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+
+class MedicationAdherenceDaily(Base):
+    """Taken/missed counts per medication per day (UTC)."""
+    __tablename__ = "medication_adherence_daily"
+
+    id = Column(Integer, primary_key=True, index=True)
+    medication_id = Column(Integer, ForeignKey("medications.id"), nullable=False)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    day = Column(Date, nullable=False)
+    taken_count = Column(Integer, nullable=False, default=0)
+    missed_count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint("medication_id", "day", name="uq_medication_adherence_daily_med_day"),
+        Index("ix_medication_adherence_daily_owner_day", "owner_id", "day"),
+    )
+
+
+class MedicationForecast(Base):
+    """Latest run-out forecast per active medication (see refill_forecast.py)."""
+    __tablename__ = "medication_forecasts"
+
+    medication_id = Column(Integer, ForeignKey("medications.id"), primary_key=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), index=True)
+    scheduled_doses_per_day = Column(Float, nullable=True)
+    observed_doses_per_day = Column(Float, nullable=True)
+    # rate the forecast is based on: observed when there is enough history, else scheduled
+    doses_per_day = Column(Float, nullable=True)
+    run_out_date = Column(Date, nullable=True)
+    course_end_date = Column(Date, nullable=True)
+    refill_due = Column(Boolean, default=False)
+    # supply seen by the last run; a rise means the medication was refilled and
+    # starts a new refill cycle, which is notified at most once
+    doses_remaining = Column(Integer, nullable=True)
+    refill_cycle = Column(Integer, nullable=False, default=0)
+    notified_refill_cycle = Column(Integer, nullable=True)
+    computed_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+
 # -------------------------------------------------------------------
 # ---------------------- OTHER EXISTING TABLES ----------------------
 # -------------------------------------------------------------------
@@ -202,6 +356,12 @@ class Reminder(Base):
     compliance_count = Column(Integer, default=0)
     missed_count = Column(Integer, default=0)
     owner_id = Column(Integer, ForeignKey("users.id"))
+    # Set by the reminder scheduler / POST /reminders/{id}/ack
+    last_fired_at = Column(DateTime, nullable=True)
+    last_acknowledged_at = Column(DateTime, nullable=True)
+    # Bumped on creation and on changes that move firings (e.g. the owner's time
+    # zone) so schedulers in other workers reload the row
+    updated_at = Column(DateTime, nullable=True, default=datetime.datetime.utcnow)
 
     owner = relationship("User", back_populates="reminders")
 
@@ -216,8 +376,20 @@ class Notification(Base):
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     read = Column(Boolean, default=False)
 
+    # Collapsing (see notifications.notify_collapsed); NULL collapse_key = never merged
+    collapse_key = Column(String, nullable=True)
+    event_count = Column(Integer, default=1)
+    updated_at = Column(DateTime, nullable=True)
+    pushed_at = Column(DateTime, nullable=True)
+
     owner = relationship("User", back_populates="notifications")
 
+    __table_args__ = (
+        # unread badge count: COUNT(*) WHERE owner_id = ? AND read = 0 is answered from the index
+        Index("ix_notifications_owner_read", "owner_id", "read"),
+        Index("ix_notifications_owner_collapse", "owner_id", "collapse_key"),
+    )
+
 
 class AuditLog(Base):
     __tablename__ = "audit_logs"
@@ -240,8 +412,22 @@ class AlertLog(Base):
     alert_type = Column(String, nullable=False)
     resolved = Column(Boolean, default=False)
 
+    # Dedupe and escalation bookkeeping (see escalation.py)
+    occurrences = Column(Integer, default=1)
+    last_seen_at = Column(DateTime, nullable=True)
+    escalation_tier = Column(Integer, default=0)
+    last_escalated_at = Column(DateTime, nullable=True)
+    next_escalation_at = Column(DateTime, nullable=True)
+    resolved_at = Column(DateTime, nullable=True)
+
     user = relationship("User", back_populates="alert_logs")
 
+    __table_args__ = (
+        Index("ix_alert_logs_open_due", "next_escalation_at", sqlite_where=text("resolved = 0")),
+        # at most one open alert per patient and type (see escalation.open_alert)
+        Index("uq_alert_logs_open_user", "user_id", "alert_type", unique=True, sqlite_where=text("resolved = 0")),
+    )
+
 
 class EmailLog(Base):
     __tablename__ = "email_logs"
@@ -254,3 +440,21 @@ class EmailLog(Base):
     error = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
 
+
+class WorkerLease(Base):
+    """Leader lease for a background worker (see leases.py)."""
+    __tablename__ = "worker_leases"
+
+    name = Column(String, primary_key=True)
+    holder = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+
+class StreamTicket(Base):
+    """Short-lived, single-use credential for opening the SSE feed (see realtime.py)."""
+    __tablename__ = "stream_tickets"
+
+    # SHA-256 of the ticket; the ticket itself is only ever sent to the client
+    ticket_hash = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
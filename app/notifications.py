@@ -0,0 +1,178 @@
+# asthma-backend/notifications.py
+"""
+Notification helpers.
+
+Bulk helpers for jobs that notify many users at once (reminders, refill
+forecasts, escalations): one INSERT for all Notification rows, one device
+lookup per chunk of owners and one FCM multicast per chunk of tokens, with
+PushLog rows and dead-token deactivation handled the same way as the
+endpoints do.
+
+Collapsing for high-frequency doctor updates (PEFR readings, medication
+taps): `notify_collapsed` merges events per (doctor, patient, event type)
+into one unread notification for COLLAPSE_MINUTES, counting them in
+`event_count`. A merged update is only pushed again after
+PUSH_INTERVAL_MINUTES, and pushes carry an FCM collapse key so the device
+shows one entry per patient and type. Doctors who opt in to digests
+(`users.notification_digest`) get no per-event pushes except urgent ones;
+`send_digests` sends them one summary push per hour instead.
+"""
+import datetime
+import os
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app import models, firebase_messaging, realtime
+
+CHUNK_SIZE = 500  # owners per IN (...) and tokens per FCM multicast
+
+COLLAPSE_MINUTES = float(os.getenv("NOTIFICATION_COLLAPSE_MINUTES", "60"))
+PUSH_INTERVAL_MINUTES = float(os.getenv("NOTIFICATION_PUSH_INTERVAL_MINUTES", "15"))
+
+
+def add_notifications(db: Session, rows):
+    """Insert Notification rows given as dicts with owner_id, message and link (does not commit)."""
+    if not rows:
+        return
+    now = datetime.datetime.utcnow()
+    values = [
+        {"owner_id": r["owner_id"], "message": r["message"], "link": r.get("link"),
+         "created_at": r.get("created_at", now), "read": False}
+        for r in rows
+    ]
+    table = models.Notification.__table__
+    ids = db.execute(table.insert().returning(table.c.id, sort_by_parameter_order=True), values).scalars().all()
+    # bulk inserts bypass the ORM hooks, so queue the live-feed events here
+    for notification_id, v in zip(ids, values):
+        realtime.queue_event(db, [v["owner_id"]], realtime.notification_event(
+            notification_id, v["owner_id"], v["message"], v["link"], v["created_at"]))
+
+
+def active_tokens(db: Session, owner_ids) -> dict:
+    """Map owner id -> list of active device tokens."""
+    owner_ids = list(owner_ids)
+    tokens = {}
+    for i in range(0, len(owner_ids), CHUNK_SIZE):
+        for owner_id, token in db.query(models.Device.owner_id, models.Device.token).filter(
+            models.Device.owner_id.in_(owner_ids[i:i + CHUNK_SIZE]),
+            models.Device.active == True
+        ).all():
+            tokens.setdefault(owner_id, []).append(token)
+    return tokens
+
+
+def push_to_owners(db: Session, owner_ids, title: str, body: str, data: dict = None, tokens_by_owner: dict = None,
+                   collapse_key: str = None) -> int:
+    """Send one push to every active device of `owner_ids`; commits the push logs. Returns tokens targeted.
+
+    Pass `tokens_by_owner` (from active_tokens) when pushing several messages to overlapping owners.
+    """
+    if tokens_by_owner is None:
+        tokens_by_owner = active_tokens(db, owner_ids)
+    owner_by_token = {}
+    for owner_id in owner_ids:
+        for token in tokens_by_owner.get(owner_id, []):
+            owner_by_token[token] = owner_id
+    tokens = list(owner_by_token)
+    for i in range(0, len(tokens), CHUNK_SIZE):
+        chunk = tokens[i:i + CHUNK_SIZE]
+        try:
+            res = firebase_messaging.send_messages_to_tokens(chunk, title=title, body=body, data=data,
+                                                             collapse_key=collapse_key)
+            responses = res.get('responses') or []
+            if responses:
+                db.execute(models.PushLog.__table__.insert(), [
+                    {"owner_id": owner_by_token.get(r.get('token')), "token": r.get('token'),
+                     "success": bool(r.get('success')),
+                     "response": str(r.get('response')) if r.get('response') else None,
+                     "error": str(r.get('error')) if r.get('error') else None}
+                    for r in responses
+                ])
+            failed = [r.get('token') for r in responses if not r.get('success')]
+            if failed:
+                db.query(models.Device).filter(models.Device.token.in_(failed)).update({"active": False}, synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print("Batched push failed:", e)
+    return len(tokens)
+
+
+# ---------------------------------------------------------------
+# collapsing
+
+def collapse_key(event_type: str, subject_id) -> str:
+    return f"{event_type}:{subject_id}"
+
+
+def notify_collapsed(db: Session, owner_ids, event_type: str, subject_id, message: str, link: str = None,
+                     urgent: bool = False, now: datetime.datetime = None):
+    """Create or merge one notification per owner; returns the owners to push to now (does not commit).
+
+    `urgent` events are always pushed, even to digest subscribers.
+    """
+    owner_ids = sorted(set(owner_ids))
+    if not owner_ids:
+        return []
+    now = now or datetime.datetime.utcnow()
+    key = collapse_key(event_type, subject_id)
+    cutoff = now - datetime.timedelta(minutes=COLLAPSE_MINUTES)
+    push_before = now - datetime.timedelta(minutes=PUSH_INTERVAL_MINUTES)
+
+    open_rows = {n.owner_id: n for n in db.query(models.Notification).filter(
+        models.Notification.owner_id.in_(owner_ids),
+        models.Notification.collapse_key == key,
+        models.Notification.read == False,
+        models.Notification.created_at >= cutoff
+    ).all()}
+    digest = {row[0] for row in db.query(models.User.id).filter(
+        models.User.id.in_(owner_ids),
+        models.User.notification_digest == True
+    ).all()}
+
+    push_to = []
+    for owner_id in owner_ids:
+        notif = open_rows.get(owner_id)
+        if notif is None:
+            notif = models.Notification(owner_id=owner_id, message=message, link=link, created_at=now,
+                                        collapse_key=key, event_count=1, updated_at=now)
+            db.add(notif)
+            due = True
+        else:
+            notif.event_count = (notif.event_count or 1) + 1
+            notif.message = f"{message} ({notif.event_count} updates)"
+            notif.link = link
+            notif.updated_at = now
+            due = notif.pushed_at is None or notif.pushed_at <= push_before
+            db.flush([notif])
+            realtime.queue_event(db, [owner_id], {
+                **realtime.notification_event(notif.id, owner_id, notif.message, link, notif.created_at),
+                "event_count": notif.event_count, "updated_at": now.isoformat(),
+            })
+        if urgent or (due and owner_id not in digest):
+            notif.pushed_at = now
+            push_to.append(owner_id)
+    return push_to
+
+
+def send_digests(db: Session, now: datetime.datetime = None, period_minutes: float = 60) -> int:
+    """One summary push per digest subscriber with unread collapsed updates in the last period."""
+    now = now or datetime.datetime.utcnow()
+    since = now - datetime.timedelta(minutes=period_minutes)
+    notif = models.Notification
+    rows = db.query(
+        notif.owner_id, func.count(notif.id), func.coalesce(func.sum(notif.event_count), 0)
+    ).join(models.User, models.User.id == notif.owner_id).filter(
+        models.User.notification_digest == True,
+        notif.collapse_key.isnot(None),
+        notif.read == False,
+        notif.updated_at >= since
+    ).group_by(notif.owner_id).all()
+
+    tokens = active_tokens(db, [owner_id for owner_id, _, _ in rows])
+    for owner_id, threads, events in rows:
+        push_to_owners(db, [owner_id], "Hourly Summary",
+                       f"{int(events)} updates across {threads} conversations since your last summary.",
+                       {"link": "/notifications"}, tokens_by_owner=tokens, collapse_key="digest")
+    return len(rows)
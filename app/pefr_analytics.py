@@ -0,0 +1,147 @@
+# asthma-backend/pefr_analytics.py
+"""
+PEFR variability analytics.
+
+Computes the metrics used to judge asthma control from a patient's raw
+readings: diurnal variability ((day max - day min) / mean of the two),
+7-day rolling means and percent of personal best. Everything is vectorized
+with pandas over the requested window; results are cached per patient and
+dropped as soon as a newer reading exists or the patient's PEFR state
+version moves (baseline change or zone recompute in any worker).
+"""
+import datetime
+import threading
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app import models, pefr_state
+
+ROLLING_DAYS = 7
+
+# patient_id -> {(days, today): ((latest_record_id, state_version), result)}
+_cache = {}
+_lock = threading.Lock()
+
+
+def _none_if_nan(value):
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return float(value)
+
+
+def compute_daily_metrics(readings: pd.DataFrame, start: datetime.date, end: datetime.date, personal_best: float) -> pd.DataFrame:
+    """Aggregate raw readings (`recorded_at`, `pefr_value`) into one row per calendar day.
+
+    Days without readings are kept (count 0) so rolling windows are calendar based.
+    """
+    index = pd.date_range(start, end, freq="D")
+    if readings.empty:
+        daily = pd.DataFrame(index=index, columns=["count", "min", "max", "sum"], dtype="float64")
+        daily["count"] = 0.0
+    else:
+        day = readings["recorded_at"].dt.normalize()
+        daily = readings.groupby(day)["pefr_value"].agg(["count", "min", "max", "sum"]).astype("float64")
+        daily = daily.reindex(index)
+        daily["count"] = daily["count"].fillna(0.0)
+
+    daily["mean"] = daily["sum"] / daily["count"].where(daily["count"] > 0)
+    # amplitude as a percentage of the day's mean; needs a morning and evening reading
+    amplitude = daily["max"] - daily["min"]
+    daily["diurnal_variability"] = (amplitude / ((daily["max"] + daily["min"]) / 2) * 100).where(daily["count"] >= 2)
+
+    rolling_sum = daily["sum"].fillna(0.0).rolling(ROLLING_DAYS, min_periods=1).sum()
+    rolling_count = daily["count"].rolling(ROLLING_DAYS, min_periods=1).sum()
+    daily["rolling_mean_7d"] = rolling_sum / rolling_count.where(rolling_count > 0)
+
+    if personal_best:
+        daily["percent_of_best"] = daily["mean"] / personal_best * 100
+    else:
+        daily["percent_of_best"] = np.nan
+    return daily
+
+
+def compute_patient_analytics(db: Session, patient_id: int, days: int) -> dict:
+    today = datetime.datetime.utcnow().date()
+    start = today - datetime.timedelta(days=days - 1)
+    # load a week more than requested so the first rolling means are complete
+    load_from = start - datetime.timedelta(days=ROLLING_DAYS - 1)
+
+    personal_best = db.query(func.max(models.PEFRRecord.pefr_value)).filter(
+        models.PEFRRecord.owner_id == patient_id
+    ).scalar()
+    baseline = db.query(models.BaselinePEFR.baseline_value).filter(
+        models.BaselinePEFR.owner_id == patient_id
+    ).scalar()
+
+    rows = db.query(models.PEFRRecord.recorded_at, models.PEFRRecord.pefr_value).filter(
+        models.PEFRRecord.owner_id == patient_id,
+        models.PEFRRecord.recorded_at >= datetime.datetime.combine(load_from, datetime.time.min)
+    ).order_by(models.PEFRRecord.recorded_at.asc()).all()
+
+    readings = pd.DataFrame(rows, columns=["recorded_at", "pefr_value"])
+    if not readings.empty:
+        readings["recorded_at"] = pd.to_datetime(readings["recorded_at"])
+        readings["pefr_value"] = readings["pefr_value"].astype("float64")
+
+    daily = compute_daily_metrics(readings, load_from, today, personal_best)
+    window = daily.loc[pd.Timestamp(start):]
+
+    latest = readings.iloc[-1] if not readings.empty else None
+    latest_pefr = int(latest["pefr_value"]) if latest is not None else None
+    last_week = window.tail(ROLLING_DAYS)
+
+    return {
+        "patient_id": patient_id,
+        "days": days,
+        "personal_best": personal_best,
+        "baseline": baseline,
+        "latest_pefr": latest_pefr,
+        "latest_percent_of_best": (latest_pefr / personal_best * 100) if latest_pefr is not None and personal_best else None,
+        "mean_diurnal_variability_7d": _none_if_nan(last_week["diurnal_variability"].mean()),
+        "rolling_mean_7d": _none_if_nan(window["rolling_mean_7d"].iloc[-1]),
+        "daily": [
+            {
+                "date": ts.date(),
+                "readings": int(row["count"]),
+                "min_pefr": _none_if_nan(row["min"]),
+                "max_pefr": _none_if_nan(row["max"]),
+                "mean_pefr": _none_if_nan(row["mean"]),
+                "diurnal_variability": _none_if_nan(row["diurnal_variability"]),
+                "rolling_mean_7d": _none_if_nan(row["rolling_mean_7d"]),
+                "percent_of_best": _none_if_nan(row["percent_of_best"]),
+            }
+            for ts, row in window.iterrows()
+        ],
+    }
+
+
+def get_patient_analytics(db: Session, patient_id: int, days: int = 30) -> dict:
+    """Return cached analytics, recomputing only if the patient has a newer reading."""
+    # cheap index-only lookup; also keeps other workers' caches honest
+    latest_id = db.query(func.max(models.PEFRRecord.id)).filter(
+        models.PEFRRecord.owner_id == patient_id
+    ).scalar()
+    stamp = (latest_id, pefr_state.stored_version(db, patient_id))
+    key = (days, datetime.datetime.utcnow().date())
+
+    with _lock:
+        entry = _cache.get(patient_id, {}).get(key)
+    if entry is not None and entry[0] == stamp:
+        return entry[1]
+
+    result = compute_patient_analytics(db, patient_id, days)
+    with _lock:
+        # entries for previous days are stale, keep only the current date
+        per_patient = {k: v for k, v in _cache.get(patient_id, {}).items() if k[1] == key[1]}
+        per_patient[key] = (stamp, result)
+        _cache[patient_id] = per_patient
+    return result
+
+
+def invalidate(patient_id: int):
+    """Drop cached analytics for a patient (called when a new reading is stored)."""
+    with _lock:
+        _cache.pop(patient_id, None)
@@ -0,0 +1,293 @@
+# asthma-backend/pefr_state.py
+"""
+Per-patient PEFR state cache.
+
+Keeps the last reading, the baseline and running statistics for each
+patient in process memory, written through to the `patient_pefr_state`
+table. A PEFR write reads nothing from the database: it advances the cached
+state and persists it with `UPDATE ... WHERE version = <cached version>`.
+If another worker wrote in between, the update matches no row, the cached
+copy is dropped and the write is retried against fresh state.
+
+The baseline is either the all-time personal best (default) or, when
+PEFR_BASELINE_WINDOW_WEEKS is set, the best reading of the last N weeks,
+tracked with a monotonic deque of (recorded_at, value) per patient. The deque
+is rebuilt from recent readings whenever a patient's state is (re)loaded.
+A manually set baseline is a floor for the rolling best: low readings
+inside the window never pull the baseline below it.
+"""
+import datetime
+import math
+import os
+import threading
+from collections import OrderedDict, deque
+
+from sqlalchemy import func, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from app import models
+
+STATE_CACHE_SIZE = 10000
+MAX_WRITE_ATTEMPTS = 3
+
+# 0 keeps the all-time personal best; N uses the best reading of the last N weeks
+BASELINE_WINDOW_WEEKS = int(os.getenv("PEFR_BASELINE_WINDOW_WEEKS", "0"))
+
+
+def baseline_window(weeks: int = None):
+    weeks = BASELINE_WINDOW_WEEKS if weeks is None else weeks
+    return datetime.timedelta(weeks=weeks) if weeks > 0 else None
+
+
+class PatientState:
+    __slots__ = ("owner_id", "version", "last_value", "last_recorded_at", "baseline_value",
+                 "reading_count", "mean_value", "m2_value", "ewma_percent", "cusum", "last_warning_at",
+                 "zones_window_weeks", "window", "manual_baseline")
+
+    # persisted columns; `window` and `manual_baseline` (from BaselinePEFR) only live in memory
+    COLUMNS = __slots__[:-2]
+
+    def __init__(self, owner_id, version=0, last_value=None, last_recorded_at=None, baseline_value=None,
+                 reading_count=0, mean_value=0.0, m2_value=0.0, ewma_percent=None, cusum=0.0,
+                 last_warning_at=None, zones_window_weeks=None, window=None, manual_baseline=None):
+        self.owner_id = owner_id
+        self.version = version
+        self.last_value = last_value
+        self.last_recorded_at = last_recorded_at
+        self.baseline_value = baseline_value
+        self.reading_count = reading_count
+        self.mean_value = mean_value
+        self.m2_value = m2_value
+        self.ewma_percent = ewma_percent
+        self.cusum = cusum
+        self.last_warning_at = last_warning_at
+        self.zones_window_weeks = zones_window_weeks
+        self.window = window if window is not None else deque()
+        self.manual_baseline = manual_baseline
+
+    @classmethod
+    def from_row(cls, row: models.PatientPEFRState):
+        return cls(row.owner_id, row.version, row.last_value, row.last_recorded_at, row.baseline_value,
+                   row.reading_count, row.mean_value, row.m2_value, row.ewma_percent, row.cusum or 0.0,
+                   row.last_warning_at, row.zones_window_weeks)
+
+    def as_values(self) -> dict:
+        return {name: getattr(self, name) for name in self.COLUMNS}
+
+    @property
+    def std_value(self) -> float:
+        if self.reading_count < 2:
+            return 0.0
+        return math.sqrt(self.m2_value / (self.reading_count - 1))
+
+    def trend(self, current_pefr: int) -> str:
+        if self.last_value is None:
+            return "stable"
+        if current_pefr > self.last_value:
+            return "improving"
+        elif current_pefr < self.last_value:
+            return "worsening"
+        return "stable"
+
+    def _window_at(self, recorded_at: datetime.datetime, span: datetime.timedelta) -> deque:
+        window = deque(self.window)
+        cutoff = recorded_at - span
+        while window and window[0][0] < cutoff:
+            window.popleft()
+        return window
+
+    def _floored(self, value: int) -> int:
+        if self.manual_baseline is None:
+            return value
+        return max(value, self.manual_baseline)
+
+    def baseline_for(self, recorded_at: datetime.datetime, window_weeks: int = None):
+        """Baseline a reading taken at `recorded_at` is zoned against."""
+        span = baseline_window(window_weeks)
+        if span is not None:
+            window = self._window_at(recorded_at, span)
+            if window:
+                return self._floored(window[0][1])
+        return self.baseline_value
+
+    def advance(self, pefr_value: int, recorded_at: datetime.datetime, window_weeks: int = None) -> "PatientState":
+        """Return the state after one more reading.
+
+        The baseline becomes the highest reading ever seen, or the highest of
+        the rolling window (but never below the manual baseline) when one is
+        configured.
+        """
+        count = self.reading_count + 1
+        delta = pefr_value - self.mean_value
+        mean = self.mean_value + delta / count
+        m2 = self.m2_value + delta * (pefr_value - mean)
+
+        weeks = BASELINE_WINDOW_WEEKS if window_weeks is None else window_weeks
+        # remember whether every stored zone still follows one baseline definition
+        previous = weeks if self.reading_count == 0 else (self.zones_window_weeks or 0)
+        zones_window_weeks = weeks if previous == weeks else -1
+
+        span = baseline_window(window_weeks)
+        if span is not None:
+            window = self._window_at(recorded_at, span)
+            # values behind the front only matter while they are larger than newer ones
+            while window and window[-1][1] <= pefr_value:
+                window.pop()
+            window.append((recorded_at, pefr_value))
+            baseline = self._floored(window[0][1])
+        else:
+            window = None
+            baseline = self.baseline_value
+            if baseline is None or pefr_value > baseline:
+                baseline = pefr_value
+        # detector fields carry over until early_warning.step() advances them
+        return PatientState(self.owner_id, self.version + 1, pefr_value, recorded_at, baseline, count, mean, m2,
+                            self.ewma_percent, self.cusum, self.last_warning_at, zones_window_weeks, window,
+                            self.manual_baseline)
+
+
+class StaleStateError(Exception):
+    """Raised when the persisted state moved on since it was cached (another worker wrote)."""
+
+
+class PatientStateCache:
+    def __init__(self, maxsize: int = STATE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, state: PatientState):
+        with self._lock:
+            self._data[state.owner_id] = state
+            self._data.move_to_end(state.owner_id)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def evict(self, owner_id: int):
+        with self._lock:
+            self._data.pop(owner_id, None)
+
+    def get(self, db: Session, owner_id: int) -> PatientState:
+        with self._lock:
+            state = self._data.get(owner_id)
+        if state is not None:
+            return state
+        state = self.load(db, owner_id)
+        self._remember(state)
+        return state
+
+    def load(self, db: Session, owner_id: int) -> PatientState:
+        """Read the persisted state, building it from raw tables the first time."""
+        row = db.get(models.PatientPEFRState, owner_id, populate_existing=True)
+        if row is None:
+            state = build_state(db, owner_id)
+            table = models.PatientPEFRState.__table__
+            # another worker may be creating the same row; keep whichever landed first
+            db.execute(insert(table).values(**state.as_values(), updated_at=datetime.datetime.utcnow())
+                       .on_conflict_do_nothing(index_elements=["owner_id"]))
+            row = db.get(models.PatientPEFRState, owner_id, populate_existing=True)
+        state = PatientState.from_row(row)
+
+        span = baseline_window()
+        if span is not None:
+            state.window = load_window(db, owner_id, datetime.datetime.utcnow() - span)
+            state.manual_baseline = db.query(models.BaselinePEFR.manual_value).filter(
+                models.BaselinePEFR.owner_id == owner_id
+            ).scalar()
+        return state
+
+    def write(self, db: Session, previous: PatientState, new: PatientState):
+        """Persist `new` if the stored version still matches `previous` (does not commit)."""
+        table = models.PatientPEFRState.__table__
+        values = new.as_values()
+        values.pop("owner_id")
+        result = db.execute(
+            update(table)
+            .where(table.c.owner_id == previous.owner_id, table.c.version == previous.version)
+            .values(**values, updated_at=datetime.datetime.utcnow())
+        )
+        if result.rowcount != 1:
+            self.evict(previous.owner_id)
+            raise StaleStateError(previous.owner_id)
+
+    def committed(self, state: PatientState):
+        """Publish a state to the cache once its transaction has committed."""
+        self._remember(state)
+
+    def set_baseline(self, db: Session, owner_id: int, baseline_value: int):
+        """Apply a manual baseline change and bump the version so other workers reload (does not commit)."""
+        self.get(db, owner_id)
+        table = models.PatientPEFRState.__table__
+        db.execute(
+            update(table)
+            .where(table.c.owner_id == owner_id)
+            .values(baseline_value=baseline_value, version=table.c.version + 1, updated_at=datetime.datetime.utcnow())
+        )
+        self.evict(owner_id)
+
+
+def stored_version(db: Session, owner_id: int):
+    """Persisted state version (None before the first load).
+
+    It changes on every reading, baseline change and zone recompute, so
+    per-worker caches of derived data compare against it to notice changes
+    made by other workers.
+    """
+    return db.query(models.PatientPEFRState.version).filter(
+        models.PatientPEFRState.owner_id == owner_id
+    ).scalar()
+
+
+def stored_state(db: Session, owner_id: int):
+    """Persisted state as last committed by any worker, without creating it (None before the first load).
+
+    The baseline window is not loaded; use it for the running statistics only.
+    """
+    row = db.get(models.PatientPEFRState, owner_id, populate_existing=True)
+    return PatientState.from_row(row) if row is not None else None
+
+
+def load_window(db: Session, owner_id: int, since: datetime.datetime) -> deque:
+    """Monotonic (decreasing value) deque of the readings recorded since `since`."""
+    window = deque()
+    rows = db.query(models.PEFRRecord.recorded_at, models.PEFRRecord.pefr_value).filter(
+        models.PEFRRecord.owner_id == owner_id,
+        models.PEFRRecord.recorded_at >= since
+    ).order_by(models.PEFRRecord.recorded_at.asc()).all()
+    for recorded_at, value in rows:
+        while window and window[-1][1] <= value:
+            window.pop()
+        window.append((recorded_at, value))
+    return window
+
+
+def build_state(db: Session, owner_id: int) -> PatientState:
+    """Reconstruct a patient's state from BaselinePEFR and PEFRRecord."""
+    baseline = db.query(models.BaselinePEFR.baseline_value).filter(
+        models.BaselinePEFR.owner_id == owner_id
+    ).scalar()
+    last = db.query(models.PEFRRecord.pefr_value, models.PEFRRecord.recorded_at).filter(
+        models.PEFRRecord.owner_id == owner_id
+    ).order_by(models.PEFRRecord.recorded_at.desc()).first()
+    count, total, total_sq = db.query(
+        func.count(models.PEFRRecord.id),
+        func.coalesce(func.sum(models.PEFRRecord.pefr_value), 0),
+        func.coalesce(func.sum(models.PEFRRecord.pefr_value * models.PEFRRecord.pefr_value), 0)
+    ).filter(models.PEFRRecord.owner_id == owner_id).one()
+
+    mean = (total / count) if count else 0.0
+    m2 = max(0.0, total_sq - total * mean) if count else 0.0
+    return PatientState(
+        owner_id,
+        version=0,
+        last_value=last.pefr_value if last else None,
+        last_recorded_at=last.recorded_at if last else None,
+        baseline_value=baseline,
+        reading_count=count,
+        mean_value=float(mean),
+        m2_value=float(m2),
+    )
+
+
+state_cache = PatientStateCache()
@@ -0,0 +1,256 @@
+# asthma-backend/realtime.py
+"""
+Real-time event feed (Server-Sent Events).
+
+Request handlers and background jobs queue events on their DB session with
+`queue_event` (new Notification rows are queued automatically by mapper
+hooks); once the session commits, the events are handed to the fan-out
+backend, and rolled-back events are dropped. The backend delivers them to
+the in-process `hub`, which keeps one small asyncio queue per open
+connection, so an idle connection costs a queue and a suspended coroutine
+and no database work at all.
+
+Backends:
+    LocalBackend   delivers straight to this worker's hub (single worker)
+    RedisBackend   publishes to a Redis channel that every worker
+                   subscribes to (set REALTIME_REDIS_URL; needs `redis`)
+
+Events are dicts with a "type" key: "notification" for new Notification
+rows, and "patient_state" for a linked patient's new reading.
+
+Browsers' EventSource cannot set headers, so instead of putting the JWT in
+the URL (where it ends up in proxy and access logs) a client first POSTs
+/events/ticket with its bearer token and opens /events/stream?ticket=...
+Tickets live in the database (hashed), expire after TICKET_SECONDS and are
+deleted by the redemption itself, so each works once on any worker.
+"""
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import secrets
+import threading
+from collections import deque
+
+from sqlalchemy import delete, event
+from sqlalchemy.orm import Session, object_session
+
+from app import models
+
+try:
+    import redis
+except Exception:
+    redis = None
+
+QUEUE_SIZE = int(os.getenv("REALTIME_QUEUE_SIZE", "100"))
+HEARTBEAT_SECONDS = float(os.getenv("REALTIME_HEARTBEAT_SECONDS", "25"))
+REDIS_URL = os.getenv("REALTIME_REDIS_URL", "")
+REDIS_CHANNEL = os.getenv("REALTIME_REDIS_CHANNEL", "pefr-realtime")
+TICKET_SECONDS = int(os.getenv("REALTIME_TICKET_SECONDS", "30"))
+
+_PENDING_KEY = "realtime_pending"
+
+
+class Hub:
+    """Per-worker registry of open connections, keyed by user id."""
+
+    def __init__(self):
+        self._subscribers = {}
+        self._loop = None
+        self._lock = threading.Lock()
+
+    @property
+    def connections(self) -> int:
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        self._loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue):
+        with self._lock:
+            queues = self._subscribers.get(user_id)
+            if queues is not None:
+                queues.discard(queue)
+                if not queues:
+                    del self._subscribers[user_id]
+
+    def _deliver(self, user_ids, payload: dict):
+        for user_id in user_ids:
+            for queue in list(self._subscribers.get(user_id, ())):
+                if queue.full():
+                    # a stalled client loses its oldest event rather than blocking everyone
+                    queue.get_nowait()
+                queue.put_nowait(payload)
+
+    def publish(self, user_ids, payload: dict):
+        """Deliver to this worker's connections; safe to call from any thread."""
+        user_ids = [u for u in user_ids if u in self._subscribers]
+        if not user_ids or self._loop is None or self._loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._deliver(user_ids, payload)
+        else:
+            self._loop.call_soon_threadsafe(self._deliver, user_ids, payload)
+
+
+hub = Hub()
+
+
+class LocalBackend:
+    def publish(self, user_ids, payload: dict):
+        hub.publish(user_ids, payload)
+
+
+class RedisBackend:
+    """Fan-out through Redis pub/sub; each worker relays the channel into its own hub."""
+
+    def __init__(self, url: str, channel: str = REDIS_CHANNEL):
+        self.client = redis.Redis.from_url(url)
+        self.channel = channel
+        self._thread = threading.Thread(target=self._listen, name="realtime-redis", daemon=True)
+        self._thread.start()
+
+    def publish(self, user_ids, payload: dict):
+        try:
+            self.client.publish(self.channel, json.dumps({"user_ids": list(user_ids), "payload": payload}, default=str))
+        except Exception as e:
+            print("Realtime publish to Redis failed; delivering locally:", e)
+            hub.publish(user_ids, payload)
+
+    def _listen(self):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+        for message in pubsub.listen():
+            try:
+                data = json.loads(message["data"])
+                hub.publish(data["user_ids"], data["payload"])
+            except Exception as e:
+                print("Bad realtime message from Redis:", e)
+
+
+def _make_backend():
+    if REDIS_URL:
+        if redis is None:
+            print("redis library not available; realtime fan-out limited to this worker")
+        else:
+            try:
+                return RedisBackend(REDIS_URL)
+            except Exception as e:
+                print("Could not connect realtime backend to Redis:", e)
+    return LocalBackend()
+
+
+backend = _make_backend()
+
+
+# ---------------------------------------------------------------
+# transactional queueing
+
+def queue_event(db: Session, user_ids, payload: dict):
+    """Publish `payload` to `user_ids` once `db` commits."""
+    if user_ids:
+        db.info.setdefault(_PENDING_KEY, deque()).append((list(user_ids), payload))
+
+
+def notification_event(notification_id, owner_id, message, link, created_at, read=False) -> dict:
+    return {
+        "type": "notification",
+        "id": notification_id,
+        "owner_id": owner_id,
+        "message": message,
+        "link": link,
+        "created_at": created_at.isoformat() if created_at else None,
+        "read": bool(read),
+    }
+
+
+@event.listens_for(models.Notification, "after_insert")
+def _notification_inserted(mapper, connection, target):
+    db = object_session(target)
+    if db is not None:
+        queue_event(db, [target.owner_id], notification_event(
+            target.id, target.owner_id, target.message, target.link, target.created_at, target.read))
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_pending(db):
+    pending = db.info.pop(_PENDING_KEY, None)
+    while pending:
+        user_ids, payload = pending.popleft()
+        try:
+            backend.publish(user_ids, payload)
+        except Exception as e:
+            print("Realtime publish failed:", e)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_pending(db):
+    db.info.pop(_PENDING_KEY, None)
+
+
+# ---------------------------------------------------------------
+# stream tickets
+
+def _hash_ticket(ticket: str) -> str:
+    return hashlib.sha256(ticket.encode()).hexdigest()
+
+
+def issue_ticket(db: Session, user_id: int, now: datetime.datetime = None) -> str:
+    """Create a ticket for `user_id`, dropping expired ones (commits)."""
+    now = now or datetime.datetime.utcnow()
+    table = models.StreamTicket.__table__
+    db.execute(delete(table).where(table.c.expires_at <= now))
+    ticket = secrets.token_urlsafe(32)
+    db.execute(table.insert().values(ticket_hash=_hash_ticket(ticket), user_id=user_id,
+                                     expires_at=now + datetime.timedelta(seconds=TICKET_SECONDS)))
+    db.commit()
+    return ticket
+
+
+def redeem_ticket(db: Session, ticket: str, now: datetime.datetime = None):
+    """User id for a valid ticket, consuming it; None when unknown, used or expired (commits)."""
+    if not ticket:
+        return None
+    now = now or datetime.datetime.utcnow()
+    table = models.StreamTicket.__table__
+    row = db.execute(delete(table).where(
+        table.c.ticket_hash == _hash_ticket(ticket),
+        table.c.expires_at > now
+    ).returning(table.c.user_id)).first()
+    db.commit()
+    return row[0] if row else None
+
+
+# ---------------------------------------------------------------
+# SSE
+
+def format_sse(payload: dict) -> str:
+    return f"event: {payload.get('type', 'message')}\ndata: {json.dumps(payload, default=str)}\n\n"
+
+
+async def event_stream(request, user_id: int):
+    """Async generator of SSE frames for one connection."""
+    queue = hub.subscribe(user_id)
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                payload = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                # comment frame keeps proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+                continue
+            yield format_sse(payload)
+    finally:
+        hub.unsubscribe(user_id, queue)
@@ -0,0 +1,239 @@
+# asthma-backend/refill_forecast.py
+"""
+Medication run-out and refill forecasting.
+
+`run_forecast` takes every active medication (course not yet finished) in one
+pass: medications and their recent take counts (from the adherence rollups)
+are read with two queries, rates and run-out dates are computed with
+pandas/NumPy, and the results are upserted into `medication_forecasts`.
+
+Consumption rate per medication:
+    * the observed rate (doses taken per day over the last OBSERVATION_DAYS,
+      or since the start date when that is more recent) once at least
+      MIN_OBSERVED_DAYS of history exist and some dose was taken, otherwise
+    * the rate implied by the schedule text ("twice daily", "BD", "1-0-1",
+      "every 8 hours", ...).
+
+A medication is due for a refill when its supply (`doses_remaining`) runs
+out within REFILL_LEAD_DAYS and before the course ends. The patient and the
+prescribing (or linked) doctor are notified once per refill cycle, with one
+notification insert and one multicast per audience. A cycle ends when the
+stored supply goes up (the medication was refilled), so a forecast run-out
+date that drifts with the patient's intake does not notify again.
+"""
+import datetime
+import os
+import re
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import case, func, select, delete
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from app import models, notifications
+
+OBSERVATION_DAYS = int(os.getenv("REFILL_OBSERVATION_DAYS", "14"))
+MIN_OBSERVED_DAYS = int(os.getenv("REFILL_MIN_OBSERVED_DAYS", "3"))
+REFILL_LEAD_DAYS = int(os.getenv("REFILL_LEAD_DAYS", "5"))
+
+_WORD_RATES = [
+    (re.compile(r"\b(qid|qds|four times|4 ?x|4 times)\b"), 4.0),
+    (re.compile(r"\b(tid|tds|thrice|three times|3 ?x|3 times)\b"), 3.0),
+    (re.compile(r"\b(bid|bd|twice|two times|2 ?x|2 times)\b"), 2.0),
+    (re.compile(r"\b(weekly|once a week|every week)\b"), 1.0 / 7),
+    (re.compile(r"\b(od|qd|once|daily|every day|morning|night|bedtime|1 ?x)\b"), 1.0),
+]
+_EVERY_HOURS = re.compile(r"every\s+(\d+(?:\.\d+)?)\s*(?:h|hr|hrs|hour|hours)\b")
+_SLOTS = re.compile(r"^\s*(\d+(?:\.\d+)?)(?:\s*-\s*(\d+(?:\.\d+)?)){1,3}\s*$")
+
+
+def doses_per_day(schedule: str):
+    """Doses per day implied by a free-text schedule, or NaN when unknown / as needed."""
+    text = (schedule or "").strip().lower()
+    if not text or "as needed" in text or "prn" in text or "sos" in text:
+        return np.nan
+    # "1-0-1" style (morning-afternoon-night)
+    if _SLOTS.match(text):
+        return float(sum(float(part) for part in text.split("-")))
+    match = _EVERY_HOURS.search(text)
+    if match and float(match.group(1)) > 0:
+        return 24.0 / float(match.group(1))
+    for pattern, rate in _WORD_RATES:
+        if pattern.search(text):
+            return rate
+    return np.nan
+
+
+def load_frame(db: Session, today: datetime.date) -> pd.DataFrame:
+    """Active medications joined with their recent take counts."""
+    med = models.Medication
+    frame = pd.read_sql(
+        select(med.id.label("medication_id"), med.owner_id, med.name, med.schedule, med.start_date, med.days,
+               med.doses_remaining, med.prescribed_by)
+        .where(med.owner_id.isnot(None)),
+        db.connection(),
+    )
+    if frame.empty:
+        return frame
+
+    since = today - datetime.timedelta(days=OBSERVATION_DAYS - 1)
+    daily = models.MedicationAdherenceDaily
+    taken = pd.read_sql(
+        select(daily.medication_id, func.sum(daily.taken_count).label("taken_recent"))
+        .where(daily.day >= since).group_by(daily.medication_id),
+        db.connection(),
+    )
+    frame = frame.merge(taken, on="medication_id", how="left")
+    frame["taken_recent"] = frame["taken_recent"].fillna(0).astype("float64")
+    frame["start_date"] = pd.to_datetime(frame["start_date"])
+    return frame
+
+
+def forecast(frame: pd.DataFrame, today: datetime.date) -> pd.DataFrame:
+    """Vectorized forecast over a frame from load_frame()."""
+    today_ts = pd.Timestamp(today)
+    start = frame["start_date"].dt.normalize()
+    days = pd.to_numeric(frame["days"], errors="coerce")
+    remaining = pd.to_numeric(frame["doses_remaining"], errors="coerce").to_numpy(dtype=np.float64)
+
+    course_end = start + pd.to_timedelta(days, unit="D")
+    active = (course_end.isna() | (course_end > today_ts)).to_numpy()
+
+    # parse each distinct schedule once
+    schedules = frame["schedule"].fillna("")
+    scheduled = schedules.map({s: doses_per_day(s) for s in schedules.unique()}).to_numpy(dtype=np.float64)
+
+    since_start = (today_ts - start).dt.days.to_numpy(dtype=np.float64) + 1
+    window = np.where(np.isnan(since_start), OBSERVATION_DAYS, np.clip(since_start, 0, OBSERVATION_DAYS))
+    taken = frame["taken_recent"].to_numpy(dtype=np.float64)
+    observed = np.divide(taken, window, out=np.full_like(taken, np.nan), where=window > 0)
+    use_observed = (window >= MIN_OBSERVED_DAYS) & (taken > 0)
+    rate = np.where(use_observed, observed, scheduled)
+
+    # days of supply left at the current rate
+    supply_days = np.divide(remaining, rate, out=np.full_like(remaining, np.nan),
+                            where=np.isfinite(remaining) & np.isfinite(rate) & (rate > 0))
+    supply_days = np.where(remaining <= 0, 0.0, supply_days)
+    run_out = today_ts + pd.to_timedelta(np.floor(supply_days), unit="D")
+
+    ends_first = course_end.isna().to_numpy() | (run_out < course_end).to_numpy()
+    refill_due = active & np.isfinite(supply_days) & (supply_days <= REFILL_LEAD_DAYS) & ends_first
+
+    result = pd.DataFrame({
+        "medication_id": frame["medication_id"].to_numpy(),
+        "owner_id": frame["owner_id"].to_numpy(),
+        "name": frame["name"].to_numpy(),
+        "prescribed_by": frame["prescribed_by"].to_numpy(),
+        "scheduled_doses_per_day": scheduled,
+        "observed_doses_per_day": np.where(window >= MIN_OBSERVED_DAYS, observed, np.nan),
+        "doses_per_day": rate,
+        "run_out_date": pd.Series(run_out).dt.date.to_numpy(),
+        "course_end_date": course_end.dt.date.to_numpy(),
+        "refill_due": refill_due,
+        "doses_remaining": remaining,
+    })
+    return result[active]
+
+
+def _none_if_nan(value):
+    """Plain Python value for binding: NaN/NaT become None, NumPy scalars are unwrapped."""
+    if value is None or value is pd.NaT:
+        return None
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+
+def store(db: Session, result: pd.DataFrame, now: datetime.datetime):
+    """Upsert forecasts in one executemany (does not commit)."""
+    if result.empty:
+        return
+    table = models.MedicationForecast.__table__
+    columns = ["medication_id", "owner_id", "scheduled_doses_per_day", "observed_doses_per_day",
+               "doses_per_day", "run_out_date", "course_end_date", "refill_due", "doses_remaining"]
+    rows = [
+        {**{c: _none_if_nan(v) for c, v in zip(columns, values)}, "computed_at": now}
+        for values in result[columns].itertuples(index=False, name=None)
+    ]
+    for row in rows:
+        row["refill_due"] = bool(row["refill_due"])
+    stmt = insert(table)
+    refilled = stmt.excluded.doses_remaining > table.c.doses_remaining
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["medication_id"],
+        set_={**{c: stmt.excluded[c] for c in columns[1:] + ["computed_at"]},
+              "refill_cycle": case((refilled, table.c.refill_cycle + 1), else_=table.c.refill_cycle)},
+    ), rows)
+
+
+def notify(db: Session, result: pd.DataFrame, now: datetime.datetime) -> int:
+    """Notify patients and doctors about refills not yet announced in the current refill cycle."""
+    due = result[result["refill_due"]]
+    if due.empty:
+        return 0
+    forecast_table = models.MedicationForecast
+    already = {row[0] for row in db.query(forecast_table.medication_id).filter(
+        forecast_table.medication_id.in_([int(m) for m in due["medication_id"]]),
+        forecast_table.notified_refill_cycle == forecast_table.refill_cycle
+    ).all()}
+    due = due[~due["medication_id"].isin(already)]
+    if due.empty:
+        return 0
+
+    # doctor per medication: prescriber, else any linked doctor
+    owners = [int(o) for o in due["owner_id"].unique()]
+    linked = dict(db.query(models.DoctorPatient.patient_id, func.min(models.DoctorPatient.doctor_id)).filter(
+        models.DoctorPatient.patient_id.in_(owners)
+    ).group_by(models.DoctorPatient.patient_id).all())
+    names = dict(db.query(models.User.id, models.User.name).filter(models.User.id.in_(owners)).all())
+
+    rows, doctors = [], set()
+    for med_id, owner_id, name, prescribed_by, run_out in due[
+        ["medication_id", "owner_id", "name", "prescribed_by", "run_out_date"]
+    ].itertuples(index=False, name=None):
+        owner_id = int(owner_id)
+        link = f"/medications/{int(med_id)}"
+        rows.append({"owner_id": owner_id, "link": link, "created_at": now,
+                     "message": f"Refill needed: {name} is expected to run out on {run_out.isoformat()}."})
+        doctor_id = _none_if_nan(prescribed_by) or linked.get(owner_id)
+        if doctor_id and int(doctor_id) != owner_id:
+            doctors.add(int(doctor_id))
+            rows.append({"owner_id": int(doctor_id), "link": link, "created_at": now,
+                         "message": f"Patient {names.get(owner_id, owner_id)} needs a refill of {name} by {run_out.isoformat()}."})
+    notifications.add_notifications(db, rows)
+
+    table = forecast_table.__table__
+    db.execute(table.update().where(table.c.medication_id.in_([int(m) for m in due["medication_id"]]))
+               .values(notified_refill_cycle=table.c.refill_cycle))
+    db.commit()
+
+    notifications.push_to_owners(db, owners, "Medication Refill Due",
+                                 "One of your medications is running low. Please arrange a refill.",
+                                 {"link": "/medications"})
+    if doctors:
+        notifications.push_to_owners(db, doctors, "Patient Refills Due",
+                                     "Some of your patients need a medication refill soon.",
+                                     {"link": "/notifications"})
+    return len(due)
+
+
+def run_forecast(db: Session, today: datetime.date = None, send_notifications: bool = True):
+    """Forecast every active medication; returns (forecasts stored, refills notified)."""
+    now = datetime.datetime.utcnow()
+    today = today or now.date()
+    frame = load_frame(db, today)
+    if frame.empty:
+        return 0, 0
+    result = forecast(frame, today)
+    # forecasts of finished courses and deleted medications
+    table = models.MedicationForecast.__table__
+    db.execute(delete(table).where(
+        (table.c.course_end_date <= today) | table.c.medication_id.notin_(select(models.Medication.id))
+    ))
+    store(db, result, now)
+    db.commit()
+    notified = notify(db, result, now) if send_notifications else 0
+    return len(result), notified
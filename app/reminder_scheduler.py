@@ -0,0 +1,452 @@
+# asthma-backend/reminder_scheduler.py
+"""
+In-process scheduler that fires Reminder rows.
+
+All reminders are loaded once into a min-heap keyed on their next fire time
+(UTC), computed from the reminder's local `time` in its owner's time zone
+(`users.timezone`, UTC when unset). Loaded reminders resume from their last
+firing (or their last edit), so weekly ones keep their day of the week. A single daemon thread sleeps until the
+head of the heap is due, pops every due entry, and dispatches them as one
+batch per minute: one notification insert, one device lookup and one FCM
+multicast per message text. CPU use is O(log n) per firing plus an idle
+wake-up every RELOAD_SECONDS, independent of how many reminders are loaded.
+
+Changes are applied incrementally: `upsert` / `remove` push a new heap entry
+and bump the reminder's generation, so superseded entries are skipped when
+popped (lazy deletion). Reminders created or edited by other workers
+(including an owner's time zone change) are picked up by polling
+`reminders.updated_at`.
+
+Compliance: a firing is complied with when the patient acknowledges it
+(POST /reminders/{id}/ack) before the next firing; otherwise the next firing
+counts it as missed.
+
+Every worker may run the scheduler: a firing is claimed with a conditional
+UPDATE of `last_fired_at` to the scheduled minute, so only the worker whose
+UPDATE lands dispatches it and counts the previous firing as missed. Set
+REMINDER_SCHEDULER_ENABLED=0 on nodes that should not do the work at all.
+"""
+import datetime
+import heapq
+import os
+import re
+import threading
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from sqlalchemy import and_, case, or_, func, update
+from sqlalchemy.orm import Session
+
+from app import models, notifications
+from app.database import SessionLocal
+
+SCHEDULER_ENABLED = os.getenv("REMINDER_SCHEDULER_ENABLED", "1").lower() in ("1", "true", "yes")
+# how often to look for reminders created or edited by other workers
+RELOAD_SECONDS = int(os.getenv("REMINDER_RELOAD_SECONDS", "60"))
+DISPATCH_CHUNK_SIZE = 500  # reminder ids per IN (...)
+
+FREQUENCY_DAYS = {
+    "daily": 1,
+    "once a day": 1,
+    "every day": 1,
+    "weekly": 7,
+    "once a week": 7,
+    "every week": 7,
+}
+
+_TIME_RE = re.compile(r"^\s*(\d{1,2})[:.](\d{2})(?::(\d{2}))?\s*([AaPp][Mm])?\s*$")
+
+
+def parse_time(value: str):
+    """Parse "HH:MM", "HH:MM:SS" or "h:MM AM/PM" into a datetime.time, or None."""
+    match = _TIME_RE.match(value or "")
+    if not match:
+        return None
+    hour, minute = int(match.group(1)), int(match.group(2))
+    meridiem = (match.group(4) or "").lower()
+    if meridiem:
+        if not 1 <= hour <= 12:
+            return None
+        hour = hour % 12 + (12 if meridiem == "pm" else 0)
+    if hour > 23 or minute > 59:
+        return None
+    return datetime.time(hour, minute)
+
+
+def interval_days(frequency: str) -> int:
+    """Days between firings; unknown frequencies fire daily."""
+    return FREQUENCY_DAYS.get((frequency or "").strip().lower(), 1)
+
+
+def get_zone(name: str):
+    if not name:
+        return datetime.timezone.utc
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return datetime.timezone.utc
+
+
+def is_valid_timezone(name: str) -> bool:
+    try:
+        ZoneInfo(name)
+        return True
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+
+
+def next_fire(time_of_day: datetime.time, zone, after: datetime.datetime, not_before: datetime.date = None):
+    """First UTC (naive) instant strictly after `after` whose local time is `time_of_day`.
+
+    `not_before` is a local date the firing may not precede (weekly spacing).
+    """
+    local_now = after.replace(tzinfo=datetime.timezone.utc).astimezone(zone)
+    day = local_now.date()
+    if not_before is not None and not_before > day:
+        day = not_before
+    while True:
+        candidate = datetime.datetime.combine(day, time_of_day, tzinfo=zone)
+        # nonexistent local times (DST gap) resolve through the UTC round-trip
+        fire_at = candidate.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        if fire_at > after:
+            return fire_at, day
+        day += datetime.timedelta(days=1)
+
+
+class _Entry:
+    __slots__ = ("reminder_id", "owner_id", "reminder_type", "time_of_day", "interval", "zone",
+                 "generation", "local_day", "updated_at")
+
+    def __init__(self, reminder_id, owner_id, reminder_type, time_of_day, interval, zone, updated_at=None):
+        self.reminder_id = reminder_id
+        self.owner_id = owner_id
+        self.reminder_type = reminder_type
+        self.time_of_day = time_of_day
+        self.interval = interval
+        self.zone = zone
+        self.generation = 0
+        self.local_day = None
+        self.updated_at = updated_at
+
+
+class ReminderScheduler:
+    def __init__(self, session_factory=SessionLocal):
+        self.session_factory = session_factory
+        self._heap = []  # (fire_at, reminder_id, generation)
+        self._entries = {}
+        self._generation = 0
+        self._max_id = 0
+        self._seen_at = None  # newest reminders.updated_at loaded
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.fired = 0
+
+    # ---------------------------------------------------------------
+    # heap maintenance
+
+    def _schedule(self, entry: _Entry, after: datetime.datetime, not_before: datetime.date = None):
+        fire_at, entry.local_day = next_fire(entry.time_of_day, entry.zone, after, not_before)
+        self._generation += 1
+        entry.generation = self._generation
+        heapq.heappush(self._heap, (fire_at, entry.reminder_id, entry.generation))
+        return fire_at
+
+    def _compact(self):
+        # drop superseded entries once they outnumber live ones
+        if len(self._heap) > 2 * len(self._entries) + 1024:
+            self._heap = [item for item in self._heap
+                          if item[1] in self._entries and self._entries[item[1]].generation == item[2]]
+            heapq.heapify(self._heap)
+
+    def _make_entry(self, reminder_id, owner_id, reminder_type, time_value, frequency, timezone, updated_at=None):
+        time_of_day = parse_time(time_value)
+        if time_of_day is None:
+            print(f"Reminder {reminder_id}: unrecognised time {time_value!r}; not scheduled")
+            return None
+        return _Entry(reminder_id, owner_id, reminder_type, time_of_day, interval_days(frequency), get_zone(timezone),
+                      updated_at)
+
+    @staticmethod
+    def _resume(entry: _Entry, now: datetime.datetime, last_fired_at=None, since=None):
+        """First firing after `now` on the reminder's own cadence.
+
+        Counts `interval` days on from the local day of the last firing, or
+        from the first firing after `since` (creation / last edit) when it
+        has never fired, so a weekly reminder keeps its weekday across reloads.
+        """
+        if last_fired_at is not None:
+            fired_day = last_fired_at.replace(tzinfo=datetime.timezone.utc).astimezone(entry.zone).date()
+            fire_at, day = next_fire(entry.time_of_day, entry.zone, last_fired_at,
+                                     fired_day + datetime.timedelta(days=entry.interval))
+        else:
+            fire_at, day = next_fire(entry.time_of_day, entry.zone, since or now)
+        if fire_at <= now:
+            # skip whole intervals missed while no scheduler was running
+            today = now.replace(tzinfo=datetime.timezone.utc).astimezone(entry.zone).date()
+            day += datetime.timedelta(days=(today - day).days // entry.interval * entry.interval)
+            fire_at, day = next_fire(entry.time_of_day, entry.zone, fire_at - datetime.timedelta(seconds=1), day)
+            while fire_at <= now:
+                fire_at, day = next_fire(entry.time_of_day, entry.zone, fire_at, day + datetime.timedelta(days=entry.interval))
+        entry.local_day = day
+        return fire_at
+
+    def _load_rows(self, rows, now: datetime.datetime):
+        for (reminder_id, owner_id, reminder_type, time_value, frequency, last_fired_at, updated_at,
+             timezone) in rows:
+            self._max_id = max(self._max_id, reminder_id)
+            if updated_at is not None and (self._seen_at is None or updated_at > self._seen_at):
+                self._seen_at = updated_at
+            entry = self._make_entry(reminder_id, owner_id, reminder_type, time_value, frequency, timezone,
+                                     updated_at)
+            if entry is None:
+                self._entries.pop(reminder_id, None)
+                continue
+            self._entries[reminder_id] = entry
+            fire_at = self._resume(entry, now, last_fired_at, updated_at)
+            self._generation += 1
+            entry.generation = self._generation
+            self._heap.append((fire_at, reminder_id, entry.generation))
+
+    def _query(self, db: Session):
+        return db.query(
+            models.Reminder.id, models.Reminder.owner_id, models.Reminder.reminder_type,
+            models.Reminder.time, models.Reminder.frequency, models.Reminder.last_fired_at,
+            models.Reminder.updated_at, models.User.timezone
+        ).outerjoin(models.User, models.User.id == models.Reminder.owner_id)
+
+    def load(self, db: Session, now: datetime.datetime = None) -> int:
+        """(Re)build the heap from every reminder in the database."""
+        now = now or datetime.datetime.utcnow()
+        rows = self._query(db).all()
+        with self._lock:
+            self._heap, self._entries, self._max_id, self._seen_at = [], {}, 0, None
+            self._load_rows(rows, now)
+            heapq.heapify(self._heap)
+        self._wake.set()
+        return len(self._entries)
+
+    def load_new(self, db: Session, now: datetime.datetime = None) -> int:
+        """Pick up reminders created or edited since the last load (e.g. by another worker)."""
+        now = now or datetime.datetime.utcnow()
+        changed = models.Reminder.id > self._max_id
+        if self._seen_at is not None:
+            # look back one period: a row stamped just before another commit may land after it
+            since = self._seen_at - datetime.timedelta(seconds=RELOAD_SECONDS)
+            changed = or_(changed, models.Reminder.updated_at > since)
+        rows = self._query(db).filter(changed).all()
+        if not rows:
+            return 0
+        with self._lock:
+            fresh = []
+            for row in rows:
+                entry = self._entries.get(row[0])
+                # already scheduled from this version (e.g. upserted by this worker)
+                if entry is not None and (row[6] is None or entry.updated_at == row[6]):
+                    continue
+                fresh.append(row)
+            self._load_rows(fresh, now)
+            heapq.heapify(self._heap)
+        self._wake.set()
+        return len(fresh)
+
+    def upsert(self, reminder: models.Reminder, timezone: str = None, now: datetime.datetime = None):
+        """Schedule a new or changed reminder."""
+        now = now or datetime.datetime.utcnow()
+        entry = self._make_entry(reminder.id, reminder.owner_id, reminder.reminder_type,
+                                 reminder.time, reminder.frequency, timezone, reminder.updated_at)
+        with self._lock:
+            self._max_id = max(self._max_id, reminder.id)
+            if entry is None:
+                self._entries.pop(reminder.id, None)
+                return None
+            self._entries[reminder.id] = entry
+            fire_at = self._resume(entry, now, reminder.last_fired_at, reminder.updated_at)
+            self._generation += 1
+            entry.generation = self._generation
+            heapq.heappush(self._heap, (fire_at, entry.reminder_id, entry.generation))
+            self._compact()
+            earliest = self._heap[0][0] == fire_at
+        if earliest:
+            self._wake.set()
+        return fire_at
+
+    def remove(self, reminder_id: int):
+        with self._lock:
+            self._entries.pop(reminder_id, None)
+            self._compact()
+
+    def remove_owner(self, owner_id: int):
+        with self._lock:
+            for reminder_id in [k for k, e in self._entries.items() if e.owner_id == owner_id]:
+                del self._entries[reminder_id]
+            self._compact()
+
+    def set_timezone(self, owner_id: int, timezone: str, now: datetime.datetime = None, updated_at=None):
+        """Reschedule an owner's reminders after their time zone changed, keeping each one's next local day."""
+        now = now or datetime.datetime.utcnow()
+        zone = get_zone(timezone)
+        with self._lock:
+            for entry in self._entries.values():
+                if entry.owner_id == owner_id:
+                    entry.zone = zone
+                    entry.updated_at = updated_at
+                    self._schedule(entry, now, not_before=entry.local_day)
+            self._compact()
+        self._wake.set()
+
+    def next_due(self):
+        with self._lock:
+            while self._heap:
+                fire_at, reminder_id, generation = self._heap[0]
+                entry = self._entries.get(reminder_id)
+                if entry is not None and entry.generation == generation:
+                    return fire_at
+                heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self, now: datetime.datetime):
+        """Pop every entry due at `now` and schedule its next firing."""
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                fire_at, reminder_id, generation = heapq.heappop(self._heap)
+                entry = self._entries.get(reminder_id)
+                if entry is None or entry.generation != generation:
+                    continue
+                due.append((fire_at, entry))
+                self._schedule(entry, max(now, fire_at),
+                               not_before=entry.local_day + datetime.timedelta(days=entry.interval))
+        return due
+
+    # ---------------------------------------------------------------
+    # dispatch
+
+    def run_pending(self, now: datetime.datetime = None) -> int:
+        now = now or datetime.datetime.utcnow()
+        due = self.pop_due(now)
+        if not due:
+            return 0
+        batches = {}
+        for fire_at, entry in due:
+            batches.setdefault(fire_at.replace(second=0, microsecond=0), []).append(entry)
+        for minute in sorted(batches):
+            self.dispatch(batches[minute], now, minute)
+        return len(due)
+
+    def dispatch(self, entries, now: datetime.datetime, slot: datetime.datetime = None):
+        """Fire one minute's worth of reminders scheduled for `slot`."""
+        slot = slot or now.replace(second=0, microsecond=0)
+        db = self.session_factory()
+        try:
+            table = models.Reminder.__table__
+            unacknowledged = and_(
+                table.c.last_fired_at.isnot(None),
+                or_(table.c.last_acknowledged_at.is_(None), table.c.last_acknowledged_at < table.c.last_fired_at)
+            )
+            live = []
+            for i in range(0, len(entries), DISPATCH_CHUNK_SIZE):
+                chunk = entries[i:i + DISPATCH_CHUNK_SIZE]
+                ids = [e.reminder_id for e in chunk]
+                # claim the slot; rows another worker already fired for it are not returned
+                claimed = {row[0] for row in db.execute(update(table).where(
+                    table.c.id.in_(ids),
+                    or_(table.c.last_fired_at.is_(None), table.c.last_fired_at < slot)
+                ).values(
+                    # the previous firing was never acknowledged
+                    missed_count=func.coalesce(table.c.missed_count, 0) + case((unacknowledged, 1), else_=0),
+                    last_fired_at=slot,
+                ).returning(table.c.id))}
+                unclaimed = set(ids) - claimed
+                if unclaimed:
+                    # reminders deleted by another worker since they were loaded
+                    existing = {row[0] for row in db.query(models.Reminder.id).filter(models.Reminder.id.in_(unclaimed)).all()}
+                    for reminder_id in unclaimed - existing:
+                        self.remove(reminder_id)
+                live.extend(e for e in chunk if e.reminder_id in claimed)
+            if not live:
+                db.commit()
+                return
+
+            messages = {e.reminder_id: f"Reminder: {e.reminder_type} ({e.time_of_day.strftime('%H:%M')})" for e in live}
+            notifications.add_notifications(db, [
+                {"owner_id": e.owner_id, "message": messages[e.reminder_id], "link": "/reminders", "created_at": now}
+                for e in live
+            ])
+            db.commit()
+            self.fired += len(live)
+
+            # one multicast per distinct message text
+            owners_by_message = {}
+            for e in live:
+                owners_by_message.setdefault(messages[e.reminder_id], set()).add(e.owner_id)
+            for message, owners in owners_by_message.items():
+                notifications.push_to_owners(db, owners, "Reminder", message, {"link": "/reminders"})
+        except Exception as e:
+            db.rollback()
+            print("Reminder dispatch failed:", e)
+        finally:
+            db.close()
+
+    # ---------------------------------------------------------------
+    # thread
+
+    def _run(self):
+        db = self.session_factory()
+        try:
+            count = self.load(db)
+            print(f"Reminder scheduler loaded {count} reminders")
+        except Exception as e:
+            print("Reminder scheduler load failed:", e)
+        finally:
+            db.close()
+
+        last_reload = datetime.datetime.utcnow()
+        while not self._stop.is_set():
+            now = datetime.datetime.utcnow()
+            if (now - last_reload).total_seconds() >= RELOAD_SECONDS:
+                db = self.session_factory()
+                try:
+                    self.load_new(db, now)
+                except Exception as e:
+                    print("Reminder scheduler reload failed:", e)
+                finally:
+                    db.close()
+                last_reload = now
+            self.run_pending(now)
+
+            due = self.next_due()
+            timeout = RELOAD_SECONDS
+            if due is not None:
+                timeout = min(timeout, max(0.0, (due - datetime.datetime.utcnow()).total_seconds()))
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="reminder-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+def acknowledge(db: Session, reminder: models.Reminder, now: datetime.datetime = None) -> bool:
+    """Count the latest firing as complied with, once (does not commit)."""
+    now = now or datetime.datetime.utcnow()
+    table = models.Reminder.__table__
+    result = db.execute(update(table).where(
+        table.c.id == reminder.id,
+        table.c.last_fired_at.isnot(None),
+        or_(table.c.last_acknowledged_at.is_(None), table.c.last_acknowledged_at < table.c.last_fired_at)
+    ).values(compliance_count=func.coalesce(table.c.compliance_count, 0) + 1, last_acknowledged_at=now))
+    return result.rowcount == 1
+
+
+scheduler = ReminderScheduler()
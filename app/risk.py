@@ -0,0 +1,115 @@
+# asthma-backend/risk.py
+"""
+Per doctor-patient risk score for the "who needs attention first" list.
+
+The score is stored on every `doctor_patient_map` row of a patient so the
+dashboard reads a top-k straight from the (doctor_id, risk_score) index
+instead of recomputing every patient. Writes that can change it (PEFR
+readings, alerts, medication status updates, new links) only stamp
+`risk_stale_since`; the at-risk endpoint recomputes a doctor's stale rows
+before reading, and scripts/refresh_risk_scores.py sweeps the rest.
+
+Components (higher is worse, max 120):
+    latest zone              Red 50, Yellow 25, no baseline 10, Green 0
+    PEFR variability         coefficient of variation in %, capped at 20
+    unresolved alerts        10 each, capped at 30
+    missed doses (14 days)   5 each, capped at 20
+"""
+import datetime
+
+from sqlalchemy import case, func, update
+from sqlalchemy.orm import Session
+
+from app import models, pefr_state, adherence
+
+ZONE_POINTS = {"Red": 50.0, "Yellow": 25.0, "Unknown": 10.0, "Green": 0.0}
+MAX_VARIABILITY_POINTS = 20.0
+ALERT_POINTS, MAX_ALERT_POINTS = 10.0, 30.0
+MISSED_DOSE_POINTS, MAX_MISSED_DOSE_POINTS = 5.0, 20.0
+MISSED_DOSE_WINDOW = datetime.timedelta(days=14)
+
+
+def latest_zone(db: Session, patient_id: int):
+    return db.query(models.PEFRRecord.zone).filter(
+        models.PEFRRecord.owner_id == patient_id
+    ).order_by(models.PEFRRecord.recorded_at.desc()).limit(1).scalar()
+
+
+def count_unresolved_alerts(db: Session, patient_id: int) -> int:
+    return db.query(func.count(models.AlertLog.id)).filter(
+        models.AlertLog.user_id == patient_id,
+        models.AlertLog.resolved == False
+    ).scalar() or 0
+
+
+def count_missed_doses(db: Session, patient_id: int) -> int:
+    since = (datetime.datetime.utcnow() - MISSED_DOSE_WINDOW).date()
+    return adherence.count_missed(db, patient_id, since)
+
+
+def compute_score(zone, variability_pct: float, unresolved_alerts: int, missed_doses: int) -> float:
+    score = ZONE_POINTS.get(zone, 0.0) if zone else 0.0
+    score += min(MAX_VARIABILITY_POINTS, max(0.0, variability_pct))
+    score += min(MAX_ALERT_POINTS, ALERT_POINTS * unresolved_alerts)
+    score += min(MAX_MISSED_DOSE_POINTS, MISSED_DOSE_POINTS * missed_doses)
+    return round(score, 2)
+
+
+def mark_stale(db: Session, patient_id: int):
+    """Flag a patient's score for recomputation on the next read (does not commit)."""
+    table = models.DoctorPatient.__table__
+    db.execute(
+        update(table)
+        .where(table.c.patient_id == patient_id)
+        .values(risk_stale_since=datetime.datetime.utcnow())
+    )
+
+
+def refresh_patient_risk(db: Session, patient_id: int, zone: str = None) -> float:
+    """Recompute one patient's score and store it on all of their doctor links (does not commit).
+
+    Pass `zone` when the caller already knows the latest reading's zone. The
+    stale flag is cleared only if no write marked the patient again meanwhile.
+    """
+    started = datetime.datetime.utcnow()
+    # pending alerts / history rows must be visible to the counts below
+    db.flush()
+    if zone is None:
+        zone = latest_zone(db, patient_id)
+
+    state = pefr_state.stored_state(db, patient_id)
+    variability = (state.std_value / state.mean_value * 100) if state is not None and state.mean_value else 0.0
+
+    score = compute_score(zone, variability, count_unresolved_alerts(db, patient_id), count_missed_doses(db, patient_id))
+    table = models.DoctorPatient.__table__
+    db.execute(
+        update(table)
+        .where(table.c.patient_id == patient_id)
+        .values(risk_score=score, risk_updated_at=started,
+                risk_stale_since=case((table.c.risk_stale_since > started, table.c.risk_stale_since), else_=None))
+    )
+    return score
+
+
+def refresh_stale(db: Session, doctor_id: int = None) -> int:
+    """Recompute every flagged score, or only one doctor's patients (does not commit)."""
+    query = db.query(models.DoctorPatient.patient_id).filter(models.DoctorPatient.risk_stale_since.isnot(None))
+    if doctor_id is not None:
+        query = query.filter(models.DoctorPatient.doctor_id == doctor_id)
+    patient_ids = [row[0] for row in query.distinct().all()]
+    for patient_id in patient_ids:
+        refresh_patient_risk(db, patient_id)
+    return len(patient_ids)
+
+
+def refresh_all(db: Session, chunk_size: int = 200, stale_only: bool = False) -> int:
+    """Recompute every linked patient's score (or just the flagged ones), committing once per chunk."""
+    query = db.query(models.DoctorPatient.patient_id)
+    if stale_only:
+        query = query.filter(models.DoctorPatient.risk_stale_since.isnot(None))
+    patient_ids = [row[0] for row in query.distinct().all()]
+    for i in range(0, len(patient_ids), chunk_size):
+        for patient_id in patient_ids[i:i + chunk_size]:
+            refresh_patient_risk(db, patient_id)
+        db.commit()
+    return len(patient_ids)
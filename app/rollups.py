@@ -0,0 +1,334 @@
+# asthma-backend/rollups.py
+"""
+Daily PEFR and symptom rollups.
+
+`record_pefr` / `record_symptom` fold each new row into its (patient, day)
+rollup with a single SQLite upsert, so month-long range queries read one row
+per day. `backfill` rebuilds the rollups from the raw tables, a chunk of
+patients at a time, for history recorded before the tables existed.
+
+Until that has run, `query_pefr_buckets` and `query_symptom_buckets`
+backfill a patient lazily: the first time a worker serves a patient it
+compares the rollup row count with the raw table and rebuilds that
+patient's rollups if they differ.
+"""
+import datetime
+import threading
+
+from sqlalchemy import case, func, select, delete
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from app import models
+from app.timeseries import bucket_expression
+
+BACKFILL_CHUNK_SIZE = 200  # patients per transaction
+
+ZONE_COLUMNS = {
+    "Green": "green_count",
+    "Yellow": "yellow_count",
+    "Red": "red_count",
+}
+
+
+# (rollup model, patient) pairs this process has checked against the raw rows
+_checked_owners = set()
+_checked_lock = threading.Lock()
+
+
+def _zone_column(zone: str) -> str:
+    return ZONE_COLUMNS.get(zone, "unknown_count")
+
+
+def apply_pefr_reading(db: Session, owner_id: int, recorded_at: datetime.datetime, pefr_value: int, zone: str):
+    """Fold one PEFR reading into its daily rollup (does not commit)."""
+    table = models.PEFRDailyRollup.__table__
+    values = {
+        "owner_id": owner_id,
+        "day": recorded_at.date(),
+        "reading_count": 1,
+        "min_pefr": pefr_value,
+        "max_pefr": pefr_value,
+        "sum_pefr": pefr_value,
+        "mean_pefr": float(pefr_value),
+        "green_count": 0,
+        "yellow_count": 0,
+        "red_count": 0,
+        "unknown_count": 0,
+    }
+    values[_zone_column(zone)] = 1
+
+    stmt = insert(table).values(**values)
+    zone_col = _zone_column(zone)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["owner_id", "day"],
+        set_={
+            "reading_count": table.c.reading_count + 1,
+            # two-argument min()/max() are scalar functions in SQLite
+            "min_pefr": func.min(func.coalesce(table.c.min_pefr, pefr_value), pefr_value),
+            "max_pefr": func.max(func.coalesce(table.c.max_pefr, pefr_value), pefr_value),
+            "sum_pefr": table.c.sum_pefr + pefr_value,
+            "mean_pefr": (table.c.sum_pefr + pefr_value) * 1.0 / (table.c.reading_count + 1),
+            zone_col: table.c[zone_col] + 1,
+        },
+    )
+    db.execute(stmt)
+
+
+def _max_of(column, value):
+    if value is None:
+        return column
+    return func.max(func.coalesce(column, value), value)
+
+
+def _min_of(column, value):
+    if value is None:
+        return column
+    return func.min(func.coalesce(column, value), value)
+
+
+def _add_rating(column, value):
+    return column if value is None else column + value
+
+
+def _count_rating(column, value):
+    return column if value is None else column + 1
+
+
+def apply_symptom(db: Session, symptom: models.Symptom):
+    """Fold one symptom entry into its daily rollup (does not commit)."""
+    table = models.SymptomDailyRollup.__table__
+    recorded_at = symptom.recorded_at or datetime.datetime.utcnow()
+    stmt = insert(table).values(
+        owner_id=symptom.owner_id,
+        day=recorded_at.date(),
+        symptom_count=1,
+        min_wheeze=symptom.wheeze_rating,
+        max_wheeze=symptom.wheeze_rating,
+        sum_wheeze=symptom.wheeze_rating or 0,
+        wheeze_count=int(symptom.wheeze_rating is not None),
+        min_cough=symptom.cough_rating,
+        max_cough=symptom.cough_rating,
+        sum_cough=symptom.cough_rating or 0,
+        cough_count=int(symptom.cough_rating is not None),
+        max_dyspnea=symptom.dyspnea_rating,
+        max_night_symptoms=symptom.night_symptoms_rating,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["owner_id", "day"],
+        set_={
+            "symptom_count": table.c.symptom_count + 1,
+            "min_wheeze": _min_of(table.c.min_wheeze, symptom.wheeze_rating),
+            "max_wheeze": _max_of(table.c.max_wheeze, symptom.wheeze_rating),
+            "sum_wheeze": _add_rating(table.c.sum_wheeze, symptom.wheeze_rating),
+            "wheeze_count": _count_rating(table.c.wheeze_count, symptom.wheeze_rating),
+            "min_cough": _min_of(table.c.min_cough, symptom.cough_rating),
+            "max_cough": _max_of(table.c.max_cough, symptom.cough_rating),
+            "sum_cough": _add_rating(table.c.sum_cough, symptom.cough_rating),
+            "cough_count": _count_rating(table.c.cough_count, symptom.cough_rating),
+            "max_dyspnea": _max_of(table.c.max_dyspnea, symptom.dyspnea_rating),
+            "max_night_symptoms": _max_of(table.c.max_night_symptoms, symptom.night_symptoms_rating),
+        },
+    )
+    db.execute(stmt)
+
+
+def _rebuild_pefr(db: Session, owner_ids):
+    pefr = models.PEFRRecord
+    day = func.date(pefr.recorded_at)
+    zone_counts = [
+        func.sum(case((pefr.zone == zone, 1), else_=0)) for zone in ZONE_COLUMNS
+    ]
+    unknown = func.sum(case((pefr.zone.in_(list(ZONE_COLUMNS)), 0), else_=1))
+    source = select(
+        pefr.owner_id,
+        day,
+        func.count(pefr.id),
+        func.min(pefr.pefr_value),
+        func.max(pefr.pefr_value),
+        func.sum(pefr.pefr_value),
+        func.avg(pefr.pefr_value),
+        *zone_counts,
+        unknown,
+    ).where(pefr.owner_id.in_(owner_ids)).group_by(pefr.owner_id, day)
+
+    db.execute(delete(models.PEFRDailyRollup).where(models.PEFRDailyRollup.owner_id.in_(owner_ids)))
+    db.execute(models.PEFRDailyRollup.__table__.insert().from_select(
+        ["owner_id", "day", "reading_count", "min_pefr", "max_pefr", "sum_pefr", "mean_pefr",
+         "green_count", "yellow_count", "red_count", "unknown_count"],
+        source,
+    ))
+
+
+def _rebuild_symptoms(db: Session, owner_ids):
+    sym = models.Symptom
+    day = func.date(sym.recorded_at)
+    source = select(
+        sym.owner_id,
+        day,
+        func.count(sym.id),
+        func.min(sym.wheeze_rating),
+        func.max(sym.wheeze_rating),
+        func.coalesce(func.sum(sym.wheeze_rating), 0),
+        func.count(sym.wheeze_rating),
+        func.min(sym.cough_rating),
+        func.max(sym.cough_rating),
+        func.coalesce(func.sum(sym.cough_rating), 0),
+        func.count(sym.cough_rating),
+        func.max(sym.dyspnea_rating),
+        func.max(sym.night_symptoms_rating),
+    ).where(sym.owner_id.in_(owner_ids)).group_by(sym.owner_id, day)
+
+    db.execute(delete(models.SymptomDailyRollup).where(models.SymptomDailyRollup.owner_id.in_(owner_ids)))
+    db.execute(models.SymptomDailyRollup.__table__.insert().from_select(
+        ["owner_id", "day", "symptom_count",
+         "min_wheeze", "max_wheeze", "sum_wheeze", "wheeze_count",
+         "min_cough", "max_cough", "sum_cough", "cough_count",
+         "max_dyspnea", "max_night_symptoms"],
+        source,
+    ))
+
+
+def backfill(db: Session, owner_ids=None, chunk_size: int = BACKFILL_CHUNK_SIZE) -> int:
+    """Rebuild rollups from raw readings, committing once per chunk of patients.
+
+    Rebuilding (delete + INSERT ... SELECT) rather than adding keeps the job
+    idempotent, so it can be re-run safely. Returns the number of patients processed.
+    """
+    if owner_ids is None:
+        owner_ids = [row[0] for row in db.query(models.User.id).filter(
+            models.User.role == models.UserRole.PATIENT
+        ).order_by(models.User.id).all()]
+    else:
+        owner_ids = list(owner_ids)
+
+    for i in range(0, len(owner_ids), chunk_size):
+        chunk = owner_ids[i:i + chunk_size]
+        _rebuild_pefr(db, chunk)
+        _rebuild_symptoms(db, chunk)
+        db.commit()
+    return len(owner_ids)
+
+
+def _ensure_rollups(db: Session, owner_id: int, raw_model, rollup_model, count_column) -> bool:
+    if (rollup_model, owner_id) in _checked_owners:
+        return False
+    raw = db.query(func.count(raw_model.id)).filter(raw_model.owner_id == owner_id).scalar()
+    rolled = db.query(func.coalesce(func.sum(count_column), 0)).filter(rollup_model.owner_id == owner_id).scalar()
+    rebuilt = raw != rolled
+    if rebuilt:
+        backfill(db, [owner_id])
+    with _checked_lock:
+        _checked_owners.add((rollup_model, owner_id))
+    return rebuilt
+
+
+def ensure_pefr_rollups(db: Session, owner_id: int) -> bool:
+    """Rebuild one patient's rollups if they don't cover all raw readings; returns True if rebuilt.
+
+    Checked once per patient per process; later readings are folded in by
+    `apply_pefr_reading` on the write path.
+    """
+    return _ensure_rollups(db, owner_id, models.PEFRRecord, models.PEFRDailyRollup,
+                           models.PEFRDailyRollup.reading_count)
+
+
+def ensure_symptom_rollups(db: Session, owner_id: int) -> bool:
+    """Same as `ensure_pefr_rollups`, for symptom entries (folded in by `apply_symptom`)."""
+    return _ensure_rollups(db, owner_id, models.Symptom, models.SymptomDailyRollup,
+                           models.SymptomDailyRollup.symptom_count)
+
+
+def day_bounds(start: datetime.datetime = None, end: datetime.datetime = None):
+    """Map a [start, end) timestamp window onto inclusive rollup days."""
+    first = start.date() if start else None
+    last = None
+    if end:
+        last = end.date()
+        if end.time() == datetime.time.min:
+            last -= datetime.timedelta(days=1)
+    return first, last
+
+
+def query_pefr_buckets(db: Session, owner_id: int, first_day=None, last_day=None, group: str = "day", descending: bool = False, limit: int = None):
+    """Day or week PEFR buckets for one patient, read from the daily rollups."""
+    ensure_pefr_rollups(db, owner_id)
+    roll = models.PEFRDailyRollup
+    if group == "day":
+        bucket = roll.day
+        columns = [
+            roll.day.label("bucket_start"),
+            roll.reading_count.label("count"),
+            roll.min_pefr.label("min_pefr"),
+            roll.mean_pefr.label("mean_pefr"),
+            roll.max_pefr.label("max_pefr"),
+            roll.green_count.label("green_count"),
+            roll.yellow_count.label("yellow_count"),
+            roll.red_count.label("red_count"),
+        ]
+    else:
+        bucket = bucket_expression(roll.day, group)
+        columns = [
+            bucket.label("bucket_start"),
+            func.sum(roll.reading_count).label("count"),
+            func.min(roll.min_pefr).label("min_pefr"),
+            (func.sum(roll.sum_pefr) * 1.0 / func.sum(roll.reading_count)).label("mean_pefr"),
+            func.max(roll.max_pefr).label("max_pefr"),
+            func.sum(roll.green_count).label("green_count"),
+            func.sum(roll.yellow_count).label("yellow_count"),
+            func.sum(roll.red_count).label("red_count"),
+        ]
+
+    query = db.query(*columns).filter(roll.owner_id == owner_id)
+    if first_day:
+        query = query.filter(roll.day >= first_day)
+    if last_day:
+        query = query.filter(roll.day <= last_day)
+    if group != "day":
+        query = query.group_by(bucket)
+    query = query.order_by(bucket.desc() if descending else bucket.asc())
+    if limit:
+        query = query.limit(limit)
+    return [row._asdict() for row in query.all()]
+
+
+def query_symptom_buckets(db: Session, owner_id: int, first_day=None, last_day=None, group: str = "day", descending: bool = False, limit: int = None):
+    """Day or week symptom buckets for one patient, read from the daily rollups."""
+    ensure_symptom_rollups(db, owner_id)
+    roll = models.SymptomDailyRollup
+    if group == "day":
+        bucket = roll.day
+        columns = [
+            roll.day.label("bucket_start"),
+            roll.symptom_count.label("count"),
+            roll.min_wheeze.label("min_wheeze"),
+            (roll.sum_wheeze * 1.0 / func.nullif(roll.wheeze_count, 0)).label("mean_wheeze"),
+            roll.max_wheeze.label("max_wheeze"),
+            roll.min_cough.label("min_cough"),
+            (roll.sum_cough * 1.0 / func.nullif(roll.cough_count, 0)).label("mean_cough"),
+            roll.max_cough.label("max_cough"),
+        ]
+    else:
+        bucket = bucket_expression(roll.day, group)
+        columns = [
+            bucket.label("bucket_start"),
+            func.sum(roll.symptom_count).label("count"),
+            func.min(roll.min_wheeze).label("min_wheeze"),
+            (func.sum(roll.sum_wheeze) * 1.0 / func.nullif(func.sum(roll.wheeze_count), 0)).label("mean_wheeze"),
+            func.max(roll.max_wheeze).label("max_wheeze"),
+            func.min(roll.min_cough).label("min_cough"),
+            (func.sum(roll.sum_cough) * 1.0 / func.nullif(func.sum(roll.cough_count), 0)).label("mean_cough"),
+            func.max(roll.max_cough).label("max_cough"),
+        ]
+
+    query = db.query(*columns).filter(roll.owner_id == owner_id)
+    if first_day:
+        query = query.filter(roll.day >= first_day)
+    if last_day:
+        query = query.filter(roll.day <= last_day)
+    if group != "day":
+        query = query.group_by(bucket)
+    query = query.order_by(bucket.desc() if descending else bucket.asc())
+    if limit:
+        query = query.limit(limit)
+    return [row._asdict() for row in query.all()]
@@ -2,7 +2,7 @@
 
 from pydantic import BaseModel, EmailStr
 from typing import Optional, List
-from datetime import datetime
+from datetime import datetime, date
 from app.models import UserRole
 
 # --- Config for all schemas ---
@@ -120,6 +120,8 @@ class Reminder(ReminderBase):
     compliance_count: int
     missed_count: int
     owner_id: int
+    last_fired_at: Optional[datetime] = None
+    last_acknowledged_at: Optional[datetime] = None
 
     class Config(ConfigBase):
         pass
@@ -143,11 +145,31 @@ class Notification(NotificationBase):
     owner_id: int
     created_at: datetime
     read: bool
+    event_count: Optional[int] = 1
+    updated_at: Optional[datetime] = None
 
     class Config(ConfigBase):
         pass
 
 
+class StreamTicket(BaseModel):
+    ticket: str
+    expires_in: int
+
+
+class NotificationReadRequest(BaseModel):
+    ids: List[int]
+
+
+class NotificationReadResult(BaseModel):
+    updated: int
+    unread: int
+
+
+class UnreadCount(BaseModel):
+    unread: int
+
+
 class EmailLog(BaseModel):
     id: int
     recipient: str
@@ -200,6 +222,53 @@ class PEFRRecord(BaseModel):
         pass
 
 
+class PEFRChartPoint(BaseModel):
+    recorded_at: datetime
+    pefr_value: int
+    zone: Optional[str] = None
+    percentage: Optional[float] = None
+
+
+class PEFRChartSeries(BaseModel):
+    points: List[PEFRChartPoint] = []
+    total_points: int
+    downsampled: bool
+
+
+class PEFRBucket(BaseModel):
+    bucket_start: date
+    count: int
+    min_pefr: int
+    mean_pefr: float
+    max_pefr: int
+    green_count: Optional[int] = None
+    yellow_count: Optional[int] = None
+    red_count: Optional[int] = None
+
+
+class PEFRAnalyticsDay(BaseModel):
+    date: date
+    readings: int
+    min_pefr: Optional[float] = None
+    max_pefr: Optional[float] = None
+    mean_pefr: Optional[float] = None
+    diurnal_variability: Optional[float] = None
+    rolling_mean_7d: Optional[float] = None
+    percent_of_best: Optional[float] = None
+
+
+class PEFRAnalytics(BaseModel):
+    patient_id: int
+    days: int
+    personal_best: Optional[int] = None
+    baseline: Optional[int] = None
+    latest_pefr: Optional[int] = None
+    latest_percent_of_best: Optional[float] = None
+    mean_diurnal_variability_7d: Optional[float] = None
+    rolling_mean_7d: Optional[float] = None
+    daily: List[PEFRAnalyticsDay] = []
+
+
 class PEFRRecordResponse(BaseModel):
     zone: str
     guidance: str
@@ -234,6 +303,17 @@ class Symptom(SymptomCreate):
         pass
 
 
+class SymptomBucket(BaseModel):
+    bucket_start: date
+    count: int
+    min_wheeze: Optional[int] = None
+    mean_wheeze: Optional[float] = None
+    max_wheeze: Optional[int] = None
+    min_cough: Optional[int] = None
+    mean_cough: Optional[float] = None
+    max_cough: Optional[int] = None
+
+
 # ------------------------------------------------------------
 # USER & AUTH SCHEMAS
 # ------------------------------------------------------------
@@ -251,6 +331,8 @@ class UserCreate(UserBase):
     gender: Optional[str] = None
     contact_number: Optional[str] = None
     address: Optional[str] = None
+    timezone: Optional[str] = None
+    notification_digest: Optional[bool] = None
 
 
 class User(UserBase):
@@ -260,6 +342,8 @@ class User(UserBase):
     gender: Optional[str] = None
     contact_number: Optional[str] = None
     address: Optional[str] = None
+    timezone: Optional[str] = None
+    notification_digest: Optional[bool] = None
 
     medications: List[Medication] = []
     emergency_contacts: List[EmergencyContact] = []
@@ -305,6 +389,68 @@ class DoctorPatientLink(BaseModel):
         pass
 
 
+class AlertLog(BaseModel):
+    id: int
+    user_id: int
+    alert_type: str
+    timestamp: datetime
+    resolved: bool
+    occurrences: Optional[int] = 1
+    last_seen_at: Optional[datetime] = None
+    escalation_tier: Optional[int] = 0
+    last_escalated_at: Optional[datetime] = None
+    resolved_at: Optional[datetime] = None
+
+    class Config(ConfigBase):
+        pass
+
+
+class PatientRisk(BaseModel):
+    patient_id: int
+    name: str
+    email: EmailStr
+    risk_score: float
+    risk_updated_at: Optional[datetime] = None
+
+
+class MedicationAdherence(BaseModel):
+    medication_id: int
+    owner_id: int
+    taken_count: int
+    missed_count: int
+    current_streak: int
+    longest_streak: int
+    last_taken_at: Optional[datetime] = None
+
+    class Config(ConfigBase):
+        pass
+
+
+class MedicationForecast(BaseModel):
+    medication_id: int
+    owner_id: int
+    scheduled_doses_per_day: Optional[float] = None
+    observed_doses_per_day: Optional[float] = None
+    doses_per_day: Optional[float] = None
+    run_out_date: Optional[date] = None
+    course_end_date: Optional[date] = None
+    refill_due: bool = False
+    computed_at: Optional[datetime] = None
+
+    class Config(ConfigBase):
+        pass
+
+
+class PatientAdherence(BaseModel):
+    patient_id: int
+    name: str
+    taken_count: int
+    missed_count: int
+    active_days: int
+    # taken / (taken + missed); None when nothing was recorded
+    adherence_rate: Optional[float] = None
+
+
 # ------------------------------------------------------------
 # AUTH / OTP REQUEST SCHEMAS
 # ------------------------------------------------------------
@@ -341,6 +487,81 @@ class MLPrediction(BaseModel):
     recommended_medicine: str
     recommended_days: int
     predicted_cure_probability: float
+    model_version: Optional[str] = None
+    # only with ?intervals=true: central interval of the trees' outputs at interval_level coverage
+    recommended_days_low: Optional[int] = None
+    recommended_days_high: Optional[int] = None
+    cure_probability_low: Optional[float] = None
+    cure_probability_high: Optional[float] = None
+    interval_level: Optional[float] = None
 
     class Config(ConfigBase):
         pass
+
+
+class MLBatchInput(BaseModel):
+    rows: List[MLInput]
+
+
+class MLBatchPrediction(BaseModel):
+    model_version: Optional[str] = None
+    predictions: List[MLPrediction]
+
+
+class MLModelVersion(BaseModel):
+    version: str
+    created_at: Optional[str] = None
+    env: dict = {}
+
+
+class MLModelRegistry(BaseModel):
+    active: Optional[str] = None
+    serving: Optional[str] = None
+    versions: List[MLModelVersion]
+
+
+class MLReloadRequest(BaseModel):
+    version: Optional[str] = None
+
+
+class MLReadiness(BaseModel):
+    ready: bool
+    status: str
+    model_version: Optional[str] = None
+    backend: Optional[str] = None
+    error: Optional[str] = None
+    warm_seconds: Optional[float] = None
+
+
+class MLCacheStats(BaseModel):
+    size: int
+    maxsize: int
+    hits: int
+    misses: int
+    evictions: int
+    warmed: int
+    hit_rate: float
+
+
+class MLTimingSummary(BaseModel):
+    mean: float
+    p50: float
+    p99: float
+    max: float
+
+
+class MLInferenceStats(BaseModel):
+    submitted: int
+    cache_hits: int
+    rejected: int
+    completed: int
+    failed: int
+    batches: int
+    mean_batch_size: float
+    max_batch_size: int
+    queue_ms: MLTimingSummary
+    compute_ms: MLTimingSummary
+    queue_depth: int
+    workers: int
+    batch_window_ms: float
+    max_batch: int
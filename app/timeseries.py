@@ -0,0 +1,127 @@
+# asthma-backend/timeseries.py
+"""
+Helpers for serving PEFR time series to charts.
+
+`lttb` downsamples a series to a fixed number of points while keeping its
+visual shape (Largest-Triangle-Three-Buckets). Results for closed historical
+windows are kept in a small in-process cache, tagged with the patient's PEFR
+state version so a zone recompute done by any worker makes them stale.
+"""
+import datetime
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from sqlalchemy import func
+
+# Number of (owner, window, points) entries kept in the chart cache
+CHART_CACHE_SIZE = 512
+
+# Hard cap on raw rows returned by the per-patient range endpoints
+MAX_RANGE_ROWS = 5000
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Return the indices of the points selected by LTTB.
+
+    `x` must be sorted ascending. The first and last points are always kept.
+    If the series already has `n_out` points or fewer every index is returned.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # bucket edges for the n - 2 interior points
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # average of the next bucket (the last bucket is just the final point)
+        if i + 2 < len(edges):
+            nxt_start, nxt_end = edges[i + 1], edges[i + 2]
+        else:
+            nxt_start, nxt_end = n - 1, n
+        avg_x = x[nxt_start:nxt_end].mean()
+        avg_y = y[nxt_start:nxt_end].mean()
+
+        # triangle area for every candidate in the bucket, vectorized
+        bx = x[start:end]
+        by = y[start:end]
+        area = np.abs((x[a] - avg_x) * (by - y[a]) - (x[a] - bx) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+
+    return selected
+
+
+class ChartCache:
+    """Bounded LRU cache for downsampled chart windows."""
+
+    def __init__(self, maxsize: int = CHART_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version=None):
+        """Cached value for `key` if it was stored under the same `version`."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value, version=None):
+        with self._lock:
+            self._data[key] = (version, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, owner_id: int):
+        """Drop every cached window for one patient (e.g. after zones are recomputed)."""
+        with self._lock:
+            for key in [k for k in self._data if k[0] == owner_id]:
+                del self._data[key]
+
+
+chart_cache = ChartCache()
+
+
+def to_naive_utc(value: datetime.datetime):
+    """Convert an aware datetime to naive UTC, matching how `recorded_at` is stored."""
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def utc_timestamp(value: datetime.datetime) -> float:
+    """POSIX timestamp of a naive UTC `recorded_at` (plain .timestamp() would read it as local time)."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value.timestamp()
+
+
+def is_closed_window(end: datetime.datetime) -> bool:
+    """A window is closed once its end lies in the past; new readings can't land in it."""
+    return end is not None and end <= datetime.datetime.utcnow()
+
+
+def bucket_expression(column, group: str):
+    """SQL expression truncating `column` to the start of its day or ISO week (Monday).
+
+    Uses SQLite date functions, matching the database configured in `database.py`.
+    """
+    if group == "day":
+        return func.date(column)
+    if group == "week":
+        # move forward to Sunday, then back six days to that week's Monday
+        return func.date(column, "weekday 0", "-6 days")
+    raise ValueError(f"Unsupported group: {group}")
@@ -0,0 +1,238 @@
+# asthma-backend/zone_recompute.py
+"""
+Batch recomputation of stored PEFR zones and percentages.
+
+`PEFRRecord.zone` / `percentage` are computed against whatever baseline was
+current at write time. When the baseline definition changes (for example
+switching PEFR_BASELINE_WINDOW_WEEKS) this job replays every patient's series
+with the new definition: baselines are rolling maxima computed with pandas,
+zones are assigned with NumPy, and only rows whose zone or percentage changed
+are written back, as one executemany UPDATE per chunk of patients.
+
+The replay starts from the patient's manually entered baseline (from the
+time it was entered), exactly as record_pefr does, and never stores a
+baseline below it. Patients whose zones were already computed with the
+requested window (`PatientPEFRState.zones_window_weeks`) are skipped unless
+`force` is set. Instead of dropping cached state, the job bumps each
+patient's state version, so every worker's caches see the change.
+"""
+import datetime
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.orm import Session
+
+from app import models, rollups, timeseries, pefr_analytics, pefr_state
+
+RECOMPUTE_CHUNK_SIZE = 200  # patients per transaction
+
+# Thresholds used by calculate_zone in main.py
+GREEN_PERCENT = 80
+YELLOW_PERCENT = 50
+
+
+def assign_zones(values: np.ndarray, baselines: np.ndarray):
+    """Vectorized calculate_zone: returns (zones, percentages)."""
+    values = np.asarray(values, dtype=np.float64)
+    baselines = np.asarray(baselines, dtype=np.float64)
+    known = np.isfinite(baselines) & (baselines > 0)
+    percentage = np.zeros_like(values)
+    np.divide(values, baselines, out=percentage, where=known)
+    percentage = np.where(known, percentage * 100, 0.0)
+    zones = np.select(
+        [~known, percentage >= GREEN_PERCENT, percentage >= YELLOW_PERCENT],
+        ["Unknown", "Green", "Yellow"],
+        default="Red",
+    )
+    return zones, percentage
+
+
+def replay_baselines(series: pd.DataFrame, window_weeks: int, manual: pd.DataFrame = None) -> pd.DataFrame:
+    """Add `zone_baseline` (baseline each reading is zoned against) and `baseline_after`.
+
+    `series` must hold owner_id, recorded_at and pefr_value sorted by owner then time.
+    `manual` (indexed by owner_id, columns manual_value and manual_set_at) seeds
+    and floors the baseline of readings taken after a manual baseline was
+    entered; a missing time means it applies from the first reading.
+    """
+    series = series.reset_index(drop=True)
+    owner = series["owner_id"]
+    if manual is None or manual.empty:
+        seed = pd.Series(np.nan, index=series.index)
+        seed_from = pd.Series(pd.NaT, index=series.index, dtype="datetime64[ns]")
+    else:
+        seed = owner.map(manual["manual_value"]).astype("float64")
+        seed_from = pd.to_datetime(owner.map(manual["manual_set_at"]))
+    seeded = seed.notna() & (seed_from.isna() | (series["recorded_at"] >= seed_from))
+
+    if window_weeks > 0:
+        grouped = series.groupby("owner_id", sort=False)
+        span = f"{7 * window_weeks}D"
+        # groups come back in input order, so results line up with `series` row by row
+        before = grouped.rolling(span, on="recorded_at", closed="left")["pefr_value"].max().to_numpy()
+        after = grouped.rolling(span, on="recorded_at", closed="both")["pefr_value"].max().to_numpy()
+        after = pd.Series(after, index=series.index)
+        # the rolling best never drops below a manual baseline in effect
+        after = after.where(~seeded, np.fmax(after, seed))
+        # an empty window falls back to the baseline left by the previous reading,
+        # or to the manual baseline if it was entered since
+        previous_at = grouped["recorded_at"].shift(1)
+        fresh_seed = seeded & (previous_at.isna() | (previous_at < seed_from))
+        fallback = after.groupby(owner).shift(1).where(~fresh_seed, seed)
+        before = pd.Series(before, index=series.index).fillna(fallback)
+        before = before.where(~seeded, np.fmax(before, seed))
+    else:
+        # a manual baseline replaces the running best from the time it was entered
+        key = [owner, seeded]
+        best = series.groupby(key, sort=False)["pefr_value"].cummax()
+        after = best.where(~seeded, np.fmax(best, seed))
+        before = after.groupby(key).shift(1)
+        before = before.where(~seeded, before.fillna(seed))
+
+    series["zone_baseline"] = before
+    series["baseline_after"] = after
+    return series
+
+
+def _manual_baselines(db: Session, owner_ids) -> pd.DataFrame:
+    rows = db.query(
+        models.BaselinePEFR.owner_id, models.BaselinePEFR.manual_value, models.BaselinePEFR.manual_set_at
+    ).filter(models.BaselinePEFR.owner_id.in_(owner_ids), models.BaselinePEFR.manual_value.isnot(None)).all()
+    manual = pd.DataFrame(rows, columns=["owner_id", "manual_value", "manual_set_at"]).set_index("owner_id")
+    manual["manual_set_at"] = pd.to_datetime(manual["manual_set_at"])
+    return manual
+
+
+def _stale_owners(db: Session, owner_ids, window_weeks: int):
+    """Patients whose stored zones were not all computed with `window_weeks`."""
+    definitions = dict(db.query(models.PatientPEFRState.owner_id, models.PatientPEFRState.zones_window_weeks).filter(
+        models.PatientPEFRState.owner_id.in_(owner_ids)
+    ).all())
+    # no row / NULL: recorded before the definition was tracked, i.e. with the all-time best
+    return [owner_id for owner_id in owner_ids if (definitions.get(owner_id) or 0) != window_weeks]
+
+
+def _recompute_chunk(db: Session, owner_ids, window_weeks: int) -> int:
+    pefr = models.PEFRRecord
+    query = select(pefr.id, pefr.owner_id, pefr.recorded_at, pefr.pefr_value, pefr.zone, pefr.percentage).where(
+        pefr.owner_id.in_(owner_ids)
+    ).order_by(pefr.owner_id, pefr.recorded_at, pefr.id)
+    series = pd.read_sql(query, db.connection())
+    if series.empty:
+        return 0
+    series["recorded_at"] = pd.to_datetime(series["recorded_at"])
+    series["pefr_value"] = series["pefr_value"].astype("float64")
+
+    manual = _manual_baselines(db, owner_ids)
+    series = replay_baselines(series, window_weeks, manual)
+    zones, percentage = assign_zones(series["pefr_value"].to_numpy(), series["zone_baseline"].to_numpy())
+
+    old_pct = series["percentage"].to_numpy(dtype=np.float64, na_value=np.nan)
+    changed = (zones != series["zone"].to_numpy()) | ~(old_pct == percentage)
+    if changed.any():
+        table = pefr.__table__
+        stmt = update(table).where(table.c.id == bindparam("b_id")).values(
+            zone=bindparam("b_zone"), percentage=bindparam("b_percentage")
+        )
+        db.execute(stmt, [
+            {"b_id": int(i), "b_zone": str(z), "b_percentage": float(p)}
+            for i, z, p in zip(series["id"].to_numpy()[changed], zones[changed], percentage[changed])
+        ])
+
+    # current baseline per patient: the best reading still inside the window,
+    # or the baseline left by the last reading once the window has emptied
+    last = series.groupby("owner_id").tail(1)
+    current = pd.Series(last["baseline_after"].to_numpy(), index=last["owner_id"].to_numpy())
+    span = pefr_state.baseline_window(window_weeks)
+    if span is not None:
+        recent = series[series["recorded_at"] >= pd.Timestamp(datetime.datetime.utcnow() - span)]
+        current = recent.groupby("owner_id")["pefr_value"].max().reindex(current.index).fillna(current)
+    if not manual.empty:
+        # a manual baseline entered after the last reading is the current one, and is never lowered
+        last_at = pd.Series(last["recorded_at"].to_numpy(), index=current.index)
+        entered = manual.reindex(current.index)
+        later = entered["manual_set_at"] > last_at
+        current = current.where(~later, entered["manual_value"])
+        current = np.fmax(current, entered["manual_value"])
+    _store_baselines(db, {int(k): int(v) for k, v in current.items()})
+
+    return int(changed.sum())
+
+
+def _store_baselines(db: Session, baselines: dict):
+    existing = dict(db.query(models.BaselinePEFR.owner_id, models.BaselinePEFR.baseline_value).filter(
+        models.BaselinePEFR.owner_id.in_(list(baselines))
+    ).all())
+    table = models.BaselinePEFR.__table__
+    updates = [{"b_owner": k, "b_value": v} for k, v in baselines.items() if k in existing and existing[k] != v]
+    if updates:
+        db.execute(
+            update(table).where(table.c.owner_id == bindparam("b_owner")).values(baseline_value=bindparam("b_value")),
+            updates,
+        )
+    inserts = [{"owner_id": k, "baseline_value": v} for k, v in baselines.items() if k not in existing]
+    if inserts:
+        db.execute(table.insert(), inserts)
+
+
+def _publish(db: Session, owner_ids, window_weeks: int):
+    """Point each patient's state row at the new baseline and bump its version (does not commit).
+
+    Rows are kept rather than deleted: a deleted row would restart at
+    version 0, letting a worker holding an old cached version pass the
+    optimistic version check against the wrong state.
+    """
+    existing = {row[0] for row in db.query(models.PatientPEFRState.owner_id).filter(
+        models.PatientPEFRState.owner_id.in_(owner_ids)
+    ).all()}
+    for owner_id in owner_ids:
+        if owner_id not in existing:
+            pefr_state.state_cache.load(db, owner_id)
+
+    baselines = dict(db.query(models.BaselinePEFR.owner_id, models.BaselinePEFR.baseline_value).filter(
+        models.BaselinePEFR.owner_id.in_(owner_ids)
+    ).all())
+    table = models.PatientPEFRState.__table__
+    db.execute(
+        update(table).where(table.c.owner_id == bindparam("b_owner")).values(
+            version=table.c.version + 1,
+            baseline_value=bindparam("b_baseline"),
+            zones_window_weeks=window_weeks,
+            updated_at=datetime.datetime.utcnow(),
+        ),
+        [{"b_owner": owner_id, "b_baseline": baselines.get(owner_id)} for owner_id in owner_ids],
+    )
+
+
+def recompute_zones(db: Session, window_weeks: int = None, owner_ids=None, chunk_size: int = RECOMPUTE_CHUNK_SIZE,
+                    force: bool = False) -> int:
+    """Recompute zones/percentages for every patient; returns the number of rows changed.
+
+    Patients whose zones already follow `window_weeks` are skipped unless `force` is set.
+    """
+    window_weeks = pefr_state.BASELINE_WINDOW_WEEKS if window_weeks is None else window_weeks
+    if owner_ids is None:
+        owner_ids = [row[0] for row in db.query(models.User.id).filter(
+            models.User.role == models.UserRole.PATIENT
+        ).order_by(models.User.id).all()]
+    else:
+        owner_ids = list(owner_ids)
+
+    changed = 0
+    for i in range(0, len(owner_ids), chunk_size):
+        chunk = owner_ids[i:i + chunk_size]
+        if not force:
+            chunk = _stale_owners(db, chunk, window_weeks)
+            if not chunk:
+                continue
+        changed += _recompute_chunk(db, chunk, window_weeks)
+        # other workers notice the version bump and drop their cached state, charts and analytics
+        _publish(db, chunk, window_weeks)
+        # zone counts in the daily rollups follow the new zones; commits the chunk
+        rollups.backfill(db, owner_ids=chunk, chunk_size=len(chunk))
+        for owner_id in chunk:
+            pefr_state.state_cache.evict(owner_id)
+            timeseries.chart_cache.invalidate(owner_id)
+            pefr_analytics.invalidate(owner_id)
+    return changed
@@ -0,0 +1,92 @@
+"""
+Concurrency benchmark for the inference executor.
+
+Simulates --clients concurrent callers each issuing single-row predictions
+back to back, once calling `predict` directly from their own threads (what
+a sync endpoint does in the request threadpool) and once through
+ml.inference_executor with micro-batching. Checks the results match and
+reports throughput, latency percentiles and the mean micro-batch size.
+
+Run after training models:
+    python -m ml.bench_executor
+    python -m ml.bench_executor --clients 32 --requests 200 --window-ms 1
+"""
+import argparse
+import threading
+import time
+
+import numpy as np
+
+from ml.bench_predict import random_rows
+from ml.inference_executor import InferenceExecutor
+from ml.predictor import get_predictor, FEATURES
+
+
+def run_clients(n_clients, features, call):
+    """Each client calls `call(f)` for its share of `features`; returns (results, latencies_ms, seconds)."""
+    results = [None] * len(features)
+    latencies = np.empty(len(features))
+    start = threading.Barrier(n_clients + 1)
+
+    def client(indices):
+        start.wait()
+        for i in indices:
+            started = time.perf_counter()
+            results[i] = call(features[i])
+            latencies[i] = (time.perf_counter() - started) * 1000
+
+    threads = [threading.Thread(target=client, args=(range(c, len(features), n_clients),))
+               for c in range(n_clients)]
+    for t in threads:
+        t.start()
+    start.wait()
+    started = time.perf_counter()
+    for t in threads:
+        t.join()
+    return results, latencies, time.perf_counter() - started
+
+
+def report(name, latencies, seconds):
+    p50, p99 = np.percentile(latencies, [50, 99])
+    print(f"{name:9s} {len(latencies) / seconds:9.0f} req/s  p50 {p50:7.3f} ms  p99 {p99:7.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=100, help="Requests per client")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--window-ms", type=float, default=2.0)
+    parser.add_argument("--max-batch", type=int, default=64)
+    args = parser.parse_args()
+
+    p = get_predictor()
+    p.cache = None  # time the model, not the memo
+    rows = random_rows(args.clients * args.requests)
+    features = [dict(zip(FEATURES, row)) for row in rows.tolist()]
+    for f in features[:50]:
+        p.predict(f)
+
+    executor = InferenceExecutor(workers=args.workers, queue_size=args.clients * 2,
+                                 batch_window_ms=args.window_ms, max_batch=args.max_batch)
+    executor.start()
+    try:
+        direct, direct_lat, direct_s = run_clients(args.clients, features, p.predict)
+        queued, queued_lat, queued_s = run_clients(
+            args.clients, features, lambda f: executor.submit(p, f).result())
+    finally:
+        executor.stop()
+
+    stats = executor.stats()
+    mismatches = sum(1 for a, b in zip(direct, queued) if a != b)
+    print(f"backend:  {p.backend}   clients: {args.clients}   requests: {len(features)}")
+    report("direct", direct_lat, direct_s)
+    report("executor", queued_lat, queued_s)
+    print(f"micro-batches: {stats['batches']}  mean size {stats['mean_batch_size']:.1f}  "
+          f"max {stats['max_batch_size']}  queue p99 {stats['queue_ms']['p99']:.3f} ms")
+    print(f"mismatches: {mismatches}")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,76 @@
+"""
+Overhead benchmark for prediction intervals.
+
+Checks that `intervals=True` leaves the point estimates unchanged and that
+no interval is inverted, then reports single-row latency and batch time
+with and without intervals. Exits non-zero when the single-row p50
+overhead exceeds --max-overhead-ms.
+
+Run after training models:
+    python -m ml.bench_intervals
+    ML_PREDICTOR_BACKEND=compiled python -m ml.bench_intervals --rows 2000
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from ml.bench_predict import random_rows, latencies_ms
+from ml.predictor import get_predictor, FEATURES, INTERVAL_LEVEL
+
+POINT_KEYS = ("recommended_medicine", "recommended_days", "predicted_cure_probability")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--max-overhead-ms", type=float, default=1.0)
+    args = parser.parse_args()
+
+    p = get_predictor()
+    p.cache = None  # time the model, not the memo
+    rows = random_rows(args.rows)
+    features = [dict(zip(FEATURES, row)) for row in rows.tolist()]
+    for f in features[:50]:
+        p.predict(f)
+        p.predict(f, intervals=True)
+
+    point = latencies_ms(p.predict, features)
+    interval = latencies_ms(lambda f: p.predict(f, intervals=True), features)
+
+    started = time.perf_counter()
+    batch_point = p.predict_batch(rows)
+    point_batch_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    batch_interval = p.predict_batch(rows, intervals=True)
+    interval_batch_ms = (time.perf_counter() - started) * 1000
+
+    changed = sum(1 for a, b in zip(batch_point, batch_interval) if any(a[k] != b[k] for k in POINT_KEYS))
+    changed += sum(1 for f, b in zip(features[:100], batch_interval) if p.predict(f, intervals=True) != b)
+    inverted = sum(1 for r in batch_interval
+                   if r["recommended_days_low"] > r["recommended_days_high"]
+                   or r["cure_probability_low"] > r["cure_probability_high"])
+    days_width = np.mean([r["recommended_days_high"] - r["recommended_days_low"] for r in batch_interval])
+    prob_width = np.mean([r["cure_probability_high"] - r["cure_probability_low"] for r in batch_interval])
+
+    print(f"backend:   {p.backend} ({p.layout} layout)   rows: {args.rows}   level: {INTERVAL_LEVEL}")
+    for name, lat in (("point", point), ("intervals", interval)):
+        p50, p99 = np.percentile(lat, [50, 99])
+        print(f"{name:10s} p50 {p50:7.3f} ms  p99 {p99:7.3f} ms")
+    print(f"batch:     point {point_batch_ms:.1f} ms, intervals {interval_batch_ms:.1f} ms")
+    print(f"mean width: days {days_width:.2f}, cure probability {prob_width:.3f}")
+    print(f"changed point estimates: {changed}   inverted intervals: {inverted}")
+
+    overhead = np.percentile(interval, 50) - np.percentile(point, 50)
+    if changed or inverted:
+        print("❌ intervals changed the predictions")
+        sys.exit(1)
+    if overhead > args.max_overhead_ms:
+        print(f"❌ interval overhead {overhead:.3f} ms exceeds {args.max_overhead_ms} ms")
+        sys.exit(1)
+    print(f"✅ interval overhead {overhead:.3f} ms per row")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Resident memory per worker for each way of loading the models.
+
+Starts --workers processes per mode, each loading the predictor and running
+one prediction, and reports RSS and PSS (proportional set size: shared
+pages are split between the processes mapping them) while all of them are
+alive. Linux only (reads /proc/self/smaps_rollup).
+
+    sklearn          joblib.load of the pickles (every worker has a private copy)
+    sklearn-mmap     joblib.load(mmap_mode="r"); the tree arrays are still copied when unpickled
+    compiled-mmap    compiled .npy artifacts mapped read-only (run ml.export_compiled first)
+
+Usage:
+    python -m ml.bench_memory --workers 4
+"""
+import argparse
+import multiprocessing as mp
+import os
+
+MODES = ("sklearn", "sklearn-mmap", "compiled-mmap")
+SAMPLE = {"age": 30, "pefr_value": 200, "wheeze_rating": 2, "cough_rating": 1, "dust_exposure": True}
+
+
+def memory_mb():
+    values = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ("Rss:", "Pss:"):
+                values[parts[0][:-1].lower()] = int(parts[1]) / 1024
+    return values
+
+
+def worker(mode, model_dir, ready, done, results):
+    import joblib
+    import ml.predictor as predictor_module
+
+    baseline = memory_mb()
+    if mode == "compiled-mmap":
+        from ml.compiled_forest import CompiledPredictor
+        p = CompiledPredictor(model_dir)
+    else:
+        if mode == "sklearn-mmap":
+            original = joblib.load
+            predictor_module.joblib.load = lambda path: original(path, mmap_mode="r")
+        p = predictor_module.Predictor(model_dir)
+    p.predict(SAMPLE)
+    ready.wait()
+    loaded = memory_mb()
+    results.put((mode, os.getpid(), baseline, loaded))
+    done.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--model-dir", default=None)
+    args = parser.parse_args()
+
+    from ml.predictor import MODEL_DIR
+    model_dir = args.model_dir or str(MODEL_DIR)
+    ctx = mp.get_context("spawn")
+
+    for mode in MODES:
+        ready, done, results = ctx.Barrier(args.workers + 1), ctx.Barrier(args.workers + 1), ctx.Queue()
+        procs = [ctx.Process(target=worker, args=(mode, model_dir, ready, done, results)) for _ in range(args.workers)]
+        for proc in procs:
+            proc.start()
+        try:
+            ready.wait(timeout=300)
+        except Exception:
+            print(f"{mode:14s} failed to load (see worker output)")
+            for proc in procs:
+                proc.terminate()
+            continue
+        rows = [results.get() for _ in procs]
+        done.wait()
+        for proc in procs:
+            proc.join()
+        rss = sum(r[3]["rss"] - r[2]["rss"] for r in rows) / len(rows)
+        pss = sum(r[3]["pss"] - r[2]["pss"] for r in rows) / len(rows)
+        print(f"{mode:14s} per worker: +{rss:7.1f} MB RSS, +{pss:7.1f} MB PSS  ({args.workers} workers)")
+
+
+if __name__ == "__main__":
+    main()
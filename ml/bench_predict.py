@@ -0,0 +1,115 @@
+"""
+Benchmark for the predictor.
+
+Checks that `predict` and `predict_batch` return the same results as the
+pandas + sklearn reference path, reports single-row latency percentiles
+and batch throughput, and exits non-zero when the single-row p99 latency
+regresses past --max-p99-ms. Latency is timed --repeats times after a
+warm-up, with the garbage collector paused as timeit does, and the gate
+uses the median run so one noisy run doesn't decide it. The 1 ms latency target is gated on the
+compiled backend; the sklearn default (10 ms, a few times its measured
+p99) only guards against regressions.
+
+Run after training models:
+    python -m ml.bench_predict
+    python -m ml.bench_predict --rows 5000 --max-p99-ms 3.0
+    ML_PREDICTOR_BACKEND=compiled python -m ml.bench_predict
+"""
+import argparse
+import gc
+import sys
+import time
+
+import numpy as np
+
+from ml.predictor import get_predictor, Predictor, FEATURES
+
+# default single-row p99 gate per backend, in ms; the sklearn one is a regression guard only
+MAX_P99_MS = {"sklearn": 10.0, "compiled": 1.0}
+
+
+def random_rows(n, seed=0):
+    rng = np.random.RandomState(seed)
+    return np.column_stack([
+        rng.randint(5, 80, size=n),
+        rng.randint(50, 600, size=n),
+        rng.randint(0, 11, size=n),
+        rng.randint(0, 11, size=n),
+        rng.randint(0, 2, size=n),
+        rng.randint(0, 2, size=n),
+    ]).astype(np.float64)
+
+
+def latencies_ms(fn, features):
+    out = np.empty(len(features))
+    gc.disable()
+    try:
+        for i, f in enumerate(features):
+            started = time.perf_counter()
+            fn(f)
+            out[i] = (time.perf_counter() - started) * 1000
+    finally:
+        gc.enable()
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeats", type=int, default=5, help="Timed runs over the rows; the median run is reported")
+    parser.add_argument("--reference-rows", type=int, default=100,
+                        help="Rows timed through the (slow) reference path")
+    parser.add_argument("--max-p99-ms", type=float, help="Defaults to the backend's entry in MAX_P99_MS")
+    args = parser.parse_args()
+
+    p = get_predictor()
+    p.cache = None  # time the model, not the memo
+    max_p99_ms = args.max_p99_ms if args.max_p99_ms is not None else MAX_P99_MS.get(p.backend, 10.0)
+    # the compiled backend drops the sklearn models, so compare against a separate Predictor
+    ref = p if p.backend == "sklearn" else Predictor(p.model_dir)
+    print(f"backend:       {p.backend}")
+    rows = random_rows(args.rows)
+    features = [dict(zip(FEATURES, row)) for row in rows.tolist()]
+
+    # warm up
+    for f in features[:500]:
+        p.predict(f)
+
+    reference = latencies_ms(ref.predict_reference, features[:args.reference_rows])
+    runs = [latencies_ms(p.predict, features) for _ in range(max(1, args.repeats))]
+    p99s = [float(np.percentile(run, 99)) for run in runs]
+    fast = runs[int(np.argsort(p99s)[len(p99s) // 2])]  # the median run by p99
+
+    started = time.perf_counter()
+    batched = p.predict_batch(rows)
+    batch_s = time.perf_counter() - started
+
+    expected = [ref.predict_reference(f) for f in features[:args.reference_rows]]
+    mismatches = sum(1 for f, e in zip(features, expected) if p.predict(f) != e)
+    mismatches += sum(1 for f, b in zip(features, batched) if p.predict(f) != b)
+    if ref is not p:
+        mismatches += sum(1 for f, b in zip(features, batched) if ref.predict(f) != b)
+
+    print(f"rows:          {args.rows} x {len(runs)} runs")
+    for name, lat in (("reference", reference), ("predict", fast)):
+        p50, p99 = np.percentile(lat, [50, 99])
+        print(f"{name:10s} p50 {p50:8.3f} ms  p99 {p99:8.3f} ms  ({1000 / lat.mean():8.0f} rows/s)")
+    print(f"predict_batch: {args.rows / batch_s:10.0f} rows/s ({batch_s * 1000:.1f} ms)")
+
+    ok = True
+    if mismatches:
+        print(f"❌ {mismatches} results differ from the reference path")
+        ok = False
+    else:
+        print("✅ predict and predict_batch match the reference path")
+    p99 = float(np.median(p99s))
+    if p99 > max_p99_ms:
+        print(f"❌ predict p99 {p99:.3f} ms (median of {len(runs)} runs) exceeds {max_p99_ms} ms")
+        ok = False
+    else:
+        print(f"✅ predict p99 {p99:.3f} ms (median of {len(runs)} runs) within {max_p99_ms} ms")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
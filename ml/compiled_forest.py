@@ -0,0 +1,244 @@
+"""
+Compiled random-forest evaluator.
+
+Flattens fitted sklearn forests into a few compact NumPy arrays shared by
+every tree of every model:
+
+    feature    int16    split feature per node (0 for leaves)
+    threshold  float32  split threshold, rounded down to float32
+    children   int32    (left, right) pairs, flattened; leaves point to themselves
+    roots      int32    root node of each tree
+    values     float64  per-forest node outputs (classes or regression outputs;
+                        a multi-output regressor has one column per output)
+
+Evaluation walks all trees of all models at once: one vectorized step per
+tree level, so a prediction costs ~max_depth NumPy calls instead of one
+sklearn call per tree. That wins for single rows and small batches; for
+batches of thousands of rows sklearn's per-tree C loops are faster.
+
+Outputs are bit-identical to sklearn. The trees compare float32 inputs
+against float64 thresholds; rounding each threshold down to the largest
+float32 not above it keeps every comparison the same. Leaf outputs are
+summed in estimator order and divided by the tree count, exactly as the
+forest accumulates them (`python -m ml.verify_compiled` checks this).
+
+Select it with ML_PREDICTOR_BACKEND=compiled.
+
+Artifacts: `python -m ml.export_compiled` saves the arrays as .npy files
+under <model dir>/compiled/ with a meta.json. The compiled predictor loads
+them with np.load(mmap_mode="r") instead of unpickling the forests, so
+every uvicorn worker maps the same read-only pages from the OS page cache
+rather than holding a private copy. (joblib's mmap_mode does not help for
+sklearn forests: unpickling a tree copies its node arrays.)
+"""
+import json
+import threading
+from pathlib import Path
+
+import numpy as np
+import sklearn
+
+from ml.predictor import Predictor, FEATURES, model_version, model_files
+
+COMPILED_DIR = "compiled"
+_ARRAYS = ("feature", "threshold", "children", "roots", "depths")
+
+
+def _floor_float32(values):
+    """Largest float32 <= each float64 value."""
+    out = values.astype(np.float32)
+    over = out.astype(np.float64) > values
+    out[over] = np.nextafter(out[over], np.float32(-np.inf))
+    return out
+
+
+class CompiledForest:
+    def __init__(self, feature, threshold, children, roots, depths, segments):
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.roots = roots
+        self.depths = depths
+        # one (first_tree, last_tree, node_offset, values) per forest
+        self.segments = segments
+
+        # Walk trees deepest first, so level d only has to step the leading
+        # trees that are deeper than d (a slice, not a mask).
+        self._order = np.argsort(-depths, kind="stable")
+        self._walk_roots = roots[self._order]
+        sorted_depths = depths[self._order]
+        self._active = [int((sorted_depths > d).sum()) for d in range(int(depths.max(initial=0)))]
+
+    @property
+    def max_depth(self) -> int:
+        return len(self._active)
+
+    @classmethod
+    def from_forests(cls, forests):
+        features, thresholds, children, roots, depths, segments = [], [], [], [], [], []
+        offset, tree_index = 0, 0
+        for forest in forests:
+            first_tree, node_offset, values = tree_index, offset, []
+            for estimator in forest.estimators_:
+                tree = estimator.tree_
+                n = tree.node_count
+                leaf = tree.children_left == -1
+                own = np.arange(offset, offset + n, dtype=np.int32)
+                pairs = np.empty((n, 2), dtype=np.int32)
+                pairs[:, 0] = np.where(leaf, own, tree.children_left + offset)
+                pairs[:, 1] = np.where(leaf, own, tree.children_right + offset)
+                features.append(np.where(leaf, 0, tree.feature).astype(np.int16))
+                thresholds.append(np.where(leaf, 0.0, tree.threshold))
+                children.append(pairs.ravel())
+                values.append(tree.value.reshape(n, -1))
+                roots.append(offset)
+                depths.append(tree.max_depth)
+                offset += n
+                tree_index += 1
+            segments.append((first_tree, tree_index, node_offset, np.concatenate(values)))
+        return cls(
+            feature=np.concatenate(features),
+            threshold=_floor_float32(np.concatenate(thresholds)),
+            children=np.concatenate(children),
+            roots=np.asarray(roots, dtype=np.int32),
+            depths=np.asarray(depths, dtype=np.int32),
+            segments=segments,
+        )
+
+    def save(self, directory, meta: dict):
+        """Write the arrays as .npy files plus meta.json (segment bounds and `meta`) to `directory`."""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        for name in _ARRAYS:
+            np.save(directory / f"{name}.npy", getattr(self, name))
+        for i, (_, _, _, values) in enumerate(self.segments):
+            np.save(directory / f"values_{i}.npy", values)
+        meta = dict(meta, segments=[[first, last, offset] for first, last, offset, _ in self.segments])
+        # meta.json last: its presence marks a complete export
+        (directory / "meta.json").write_text(json.dumps(meta, indent=2))
+
+    @classmethod
+    def load(cls, directory, mmap_mode="r"):
+        """Load arrays saved by `save`; returns (forest, meta)."""
+        directory = Path(directory)
+        meta = json.loads((directory / "meta.json").read_text())
+
+        def array(name):
+            # plain ndarray views: np.memmap's Python-level indexing is slow
+            return np.asarray(np.load(directory / f"{name}.npy", mmap_mode=mmap_mode))
+
+        segments = [(first, last, offset, array(f"values_{i}"))
+                    for i, (first, last, offset) in enumerate(meta["segments"])]
+        forest = cls(segments=segments, **{name: array(name) for name in _ARRAYS})
+        return forest, meta
+
+    @property
+    def nbytes(self) -> int:
+        arrays = [self.feature, self.threshold, self.children, self.roots, self.depths] + [s[3] for s in self.segments]
+        return sum(a.nbytes for a in arrays)
+
+    def _leaves_by_tree(self, X) -> np.ndarray:
+        """Leaf node of every tree for every row, shape (n_trees, n_rows)."""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n_rows, n_features = X.shape
+        flat = X.ravel()
+        # ndarray.take skips fancy indexing's generic index handling, which
+        # dominates at a few hundred nodes per level
+        if n_rows == 1:
+            # single row: no row offsets to add
+            node = self._walk_roots.copy()
+            for active in self._active:
+                walking = node[:active]
+                right = flat.take(self.feature.take(walking)) > self.threshold.take(walking)
+                walking[:] = self.children.take(2 * walking + right)
+            node = node[:, None]
+        else:
+            row_base = (np.arange(n_rows, dtype=np.intp) * n_features)[None, :]
+            node = np.repeat(self._walk_roots[:, None], n_rows, axis=1)
+            for active in self._active:
+                walking = node[:active]
+                x = flat.take(row_base + self.feature.take(walking))
+                walking[:] = self.children.take(2 * walking + (x > self.threshold.take(walking)))
+        leaves = np.empty_like(node)
+        leaves[self._order] = node
+        return leaves
+
+    def leaves(self, X) -> np.ndarray:
+        """Leaf node of every tree for every row, shape (n_rows, n_trees)."""
+        return self._leaves_by_tree(X).T
+
+    def tree_outputs(self, X):
+        """Per-tree outputs of each forest, as a list of (n_trees, n_rows, n_outputs) arrays."""
+        node = self._leaves_by_tree(X)
+        return [values[node[first_tree:last_tree] - node_offset]
+                for first_tree, last_tree, node_offset, values in self.segments]
+
+    def predict(self, X):
+        """Mean output of each forest, as a list of (n_rows, n_outputs) arrays."""
+        # cumsum adds strictly in tree order, matching the forest's accumulation
+        return [np.cumsum(leaf_values, axis=0)[-1] / len(leaf_values) for leaf_values in self.tree_outputs(X)]
+
+
+def export(predictor: Predictor, directory=None) -> Path:
+    """Compile a sklearn-backed predictor's models into .npy artifacts; returns the directory."""
+    directory = Path(directory) if directory else predictor.model_dir / COMPILED_DIR
+    forest = CompiledForest.from_forests([predictor.clf] + predictor.regressors())
+    forest.save(directory, {
+        "features": FEATURES,
+        "layout": predictor.layout,
+        "labels": predictor._labels.tolist(),
+        "source_version": predictor.version,
+        "scikit_learn": sklearn.__version__,
+    })
+    return directory
+
+
+class CompiledPredictor(Predictor):
+    """Predictor backed by a CompiledForest.
+
+    Loads memory-mapped artifacts from <model dir>/compiled/ when they were
+    exported from the current joblib files; otherwise compiles the joblib
+    models at load and drops the sklearn estimators.
+    """
+
+    backend = "compiled"
+
+    def _load_models(self):
+        self.forest = None
+        artifacts = self.model_dir / COMPILED_DIR
+        if (artifacts / "meta.json").exists():
+            forest, meta = CompiledForest.load(artifacts)
+            sources = model_files(self.model_dir)
+            current = model_version(sources) if all(p.exists() for p in sources) else meta["source_version"]
+            if meta["source_version"] == current and meta["features"] == FEATURES:
+                self.forest, self._meta = forest, meta
+                self.version = current
+                self.layout = meta.get("layout", "separate")
+                self._loaded = True
+                return
+            print("Compiled model artifacts are stale; compiling from the joblib models")
+        super()._load_models()
+
+    def _prepare_fast_path(self):
+        if self.forest is None:
+            super()._prepare_fast_path()
+            self.forest = CompiledForest.from_forests([self.clf] + self.regressors())
+        else:
+            self._labels = np.asarray(self._meta["labels"], dtype=object)
+            self._n_classes = len(self._labels)
+            self._local = threading.local()
+        self.clf = self.days_reg = self.prob_reg = self.outcome_reg = self.le = None
+        self._clf_trees = self._reg_trees = None
+
+    def _predict_raw(self, X, proba, outputs):
+        proba[:], *regressors = self.forest.predict(X)
+        outputs[:] = np.hstack(regressors)
+        return proba.argmax(axis=1), outputs[:, 0], outputs[:, 1]
+
+    def _tree_outputs(self, X, proba):
+        classifier, *matrices = self.forest.tree_outputs(X)
+        proba[:] = np.cumsum(classifier, axis=0)[-1] / len(classifier)
+        return proba.argmax(axis=1), matrices
+
+    def predict_reference(self, features: dict):
+        raise RuntimeError("The compiled backend does not keep the sklearn models; use Predictor for reference predictions.")
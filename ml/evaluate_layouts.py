@@ -0,0 +1,94 @@
+"""
+Compare the "separate" and "combined" model layouts.
+
+Trains both layouts (see train.py --layout) on the same training split,
+then reports held-out accuracy of the served outputs (rounded and clamped
+as the API returns them), model size on disk and compiled in memory, and
+single-row / batch prediction latency for the sklearn and compiled
+backends. Prints a Markdown table. The models in ml/models are not touched.
+
+Usage:
+    python -m ml.evaluate_layouts
+    python -m ml.evaluate_layouts --data mydata.csv --test-fraction 0.25
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from ml.bench_predict import latencies_ms
+from ml.compiled_forest import CompiledPredictor
+from ml.predictor import Predictor, FEATURES, model_files
+from ml.train import generate_synthetic, fit_models, save_models
+
+LAYOUTS = ("separate", "combined")
+
+
+def split(df, test_fraction, seed=0):
+    order = np.random.RandomState(seed).permutation(len(df))
+    n_test = int(len(df) * test_fraction)
+    return df.iloc[order[n_test:]].reset_index(drop=True), df.iloc[order[:n_test]].reset_index(drop=True)
+
+
+def evaluate(model_dir, test, latency_rows):
+    X = test[FEATURES].fillna(0).to_numpy(dtype=np.float64)
+    features = [dict(zip(FEATURES, row)) for row in X[:latency_rows].tolist()]
+    report = {"disk MB": sum(p.stat().st_size for p in model_files(model_dir)) / 1e6}
+
+    for p in (Predictor(model_dir), CompiledPredictor(model_dir)):
+        for f in features[:50]:
+            p.predict(f)
+        p50, p99 = np.percentile(latencies_ms(p.predict, features), [50, 99])
+        started = time.perf_counter()
+        results = p.predict_batch(X)
+        batch_ms = (time.perf_counter() - started) * 1000
+        report[f"{p.backend} p50 ms"] = p50
+        report[f"{p.backend} p99 ms"] = p99
+        report[f"{p.backend} batch ms"] = batch_ms
+        if p.backend == "sklearn":
+            report["trees"] = len(p._clf_trees) + sum(len(trees) for trees, _, _ in p._reg_trees)
+        else:
+            report["compiled MB"] = p.forest.nbytes / 1e6
+
+    meds = np.array([r["recommended_medicine"] for r in results])
+    days = np.array([r["recommended_days"] for r in results])
+    probs = np.array([r["predicted_cure_probability"] for r in results])
+    report["medicine accuracy"] = float((meds == test["medicine"].to_numpy()).mean())
+    report["days MAE"] = float(np.abs(days - test["days"].to_numpy()).mean())
+    report["days exact"] = float((days == test["days"].to_numpy()).mean())
+    report["cure prob MAE"] = float(np.abs(probs - test["cure_prob"].to_numpy()).mean())
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", help="CSV with features and targets (defaults to the synthetic set train.py uses)")
+    parser.add_argument("--test-fraction", type=float, default=0.2)
+    parser.add_argument("--latency-rows", type=int, default=500, help="Held-out rows timed one at a time")
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.data) if args.data else generate_synthetic()
+    train, test = split(df, args.test_fraction)
+    print(f"train rows: {len(train)}  test rows: {len(test)}\n")
+
+    reports = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for layout in LAYOUTS:
+            model_dir = Path(tmp) / layout
+            save_models(fit_models(train, layout), model_dir)
+            reports[layout] = evaluate(model_dir, test, args.latency_rows)
+
+    metrics = list(reports[LAYOUTS[0]])
+    print("| metric | " + " | ".join(LAYOUTS) + " |")
+    print("|---|" + "---|" * len(LAYOUTS))
+    for metric in metrics:
+        values = [reports[layout][metric] for layout in LAYOUTS]
+        cells = [str(v) if isinstance(v, int) else f"{v:.3f}" for v in values]
+        print(f"| {metric} | " + " | ".join(cells) + " |")
+
+
+if __name__ == "__main__":
+    main()
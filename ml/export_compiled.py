@@ -0,0 +1,21 @@
+"""
+Export the trained models as memory-mappable compiled artifacts.
+
+Writes <model dir>/compiled/*.npy and meta.json, which the compiled backend
+(ML_PREDICTOR_BACKEND=compiled) maps read-only and shares across workers.
+Re-run after every training run; stale artifacts are ignored.
+
+Usage:
+    python -m ml.export_compiled
+"""
+from ml.compiled_forest import export
+from ml.predictor import Predictor
+
+
+def main():
+    directory = export(Predictor())
+    print("Compiled artifacts saved to:", directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+Dedicated inference executor.
+
+Keeps forest inference off the event loop and out of the request
+threadpool that every CRUD endpoint shares. Requests are put on a bounded
+queue (ML_INFERENCE_QUEUE_SIZE); when it is full `submit` raises
+InferenceBusy at once instead of letting latency grow without bound.
+
+ML_INFERENCE_WORKERS threads serve the queue. Each takes the first waiting
+request plus whatever else is already queued (at most ML_MICRO_BATCH_MAX
+rows), so a burst of concurrent single-row requests costs one
+`predict_batch` call instead of one tree walk each. Only when other
+requests are already being served, i.e. under concurrent load, does it
+also wait up to ML_MICRO_BATCH_MS milliseconds for more to arrive; a lone
+request is never held back. ML_MICRO_BATCH_MS=0 turns the wait off.
+
+Each request is pinned to the predictor it was submitted with, so a model
+swap never changes the version a request was answered by. Requests with
+and without prediction intervals are batched separately. Memo hits are
+answered at submit time without queueing.
+"""
+import concurrent.futures
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from ml.predictor import FEATURES, sanitize_features
+
+WORKERS = int(os.getenv("ML_INFERENCE_WORKERS", "2"))
+QUEUE_SIZE = int(os.getenv("ML_INFERENCE_QUEUE_SIZE", "256"))
+MICRO_BATCH_MS = float(os.getenv("ML_MICRO_BATCH_MS", "2"))
+MICRO_BATCH_MAX = int(os.getenv("ML_MICRO_BATCH_MAX", "64"))
+
+_SAMPLES = 2048  # recent timings kept for percentiles
+
+
+class InferenceBusy(Exception):
+    pass
+
+
+class _Request:
+    __slots__ = ("predictor", "rows", "single", "intervals", "future", "enqueued_at")
+
+    def __init__(self, predictor, rows, single: bool, intervals: bool = False):
+        self.predictor = predictor
+        self.rows = rows
+        self.single = single
+        self.intervals = intervals
+        self.future = concurrent.futures.Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class InferenceMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.cache_hits = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.batches = 0
+        self.batch_rows = 0
+        self.max_batch = 0
+        self._queue_ms = deque(maxlen=_SAMPLES)
+        self._compute_ms = deque(maxlen=_SAMPLES)
+
+    def incr(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def record_batch(self, rows: int, queue_ms, compute_ms: float, failed: bool = False):
+        with self._lock:
+            self.batches += 1
+            self.batch_rows += rows
+            self.max_batch = max(self.max_batch, rows)
+            if failed:
+                self.failed += len(queue_ms)
+            else:
+                self.completed += len(queue_ms)
+            self._queue_ms.extend(queue_ms)
+            self._compute_ms.append(compute_ms)
+
+    @staticmethod
+    def _summary(samples) -> dict:
+        if not samples:
+            return {"mean": 0.0, "p50": 0.0, "p99": 0.0, "max": 0.0}
+        values = np.fromiter(samples, dtype=np.float64)
+        p50, p99 = np.percentile(values, [50, 99])
+        return {"mean": float(values.mean()), "p50": float(p50), "p99": float(p99), "max": float(values.max())}
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "submitted": self.submitted,
+                "cache_hits": self.cache_hits,
+                "rejected": self.rejected,
+                "completed": self.completed,
+                "failed": self.failed,
+                "batches": self.batches,
+                "mean_batch_size": self.batch_rows / self.batches if self.batches else 0.0,
+                "max_batch_size": self.max_batch,
+                "queue_ms": self._summary(self._queue_ms),
+                "compute_ms": self._summary(self._compute_ms),
+            }
+
+
+class InferenceExecutor:
+    def __init__(self, workers: int = WORKERS, queue_size: int = QUEUE_SIZE,
+                 batch_window_ms: float = MICRO_BATCH_MS, max_batch: int = MICRO_BATCH_MAX):
+        self.workers = max(1, workers)
+        self.batch_window = max(0.0, batch_window_ms) / 1000.0
+        self.max_batch = max(1, max_batch)
+        self.metrics = InferenceMetrics()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._in_flight = 0  # requests being executed by workers
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def submit(self, predictor, features: dict, intervals: bool = False) -> concurrent.futures.Future:
+        """Queue one prediction; returns a Future of the result dict. Raises InferenceBusy when full."""
+        row = sanitize_features(features)
+        key = tuple(row[k] for k in FEATURES)
+        self.metrics.incr("submitted")
+
+        if predictor.cache is not None:
+            cached = predictor.cache.get(predictor.memo_version(intervals), key)
+            if cached is not None:
+                self.metrics.incr("cache_hits")
+                future = concurrent.futures.Future()
+                future.set_result(cached)
+                return future
+
+        return self._enqueue(_Request(predictor, [key], single=True, intervals=intervals))
+
+    def submit_batch(self, predictor, rows, intervals: bool = False) -> concurrent.futures.Future:
+        """Queue an (N, 6) array of feature rows; returns a Future of the list of result dicts."""
+        self.metrics.incr("submitted")
+        return self._enqueue(_Request(predictor, [tuple(r) for r in np.asarray(rows, dtype=np.float64).tolist()],
+                                      single=False, intervals=intervals))
+
+    def _enqueue(self, request: _Request) -> concurrent.futures.Future:
+        self.start()
+        try:
+            self._queue.put_nowait(request)
+        except queue.Full:
+            self.metrics.incr("rejected")
+            raise InferenceBusy("Inference queue is full; try again shortly.")
+        return request.future
+
+    def _collect(self, first: _Request):
+        batch, rows = [first], len(first.rows)
+        deadline = None
+        while rows < self.max_batch:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                # only wait for company when other requests are in flight
+                if self.batch_window <= 0 or self._in_flight == 0:
+                    break
+                if deadline is None:
+                    deadline = time.perf_counter() + self.batch_window
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if request is None:
+                # stop sentinel: leave it for this worker's next get
+                self._queue.put(None)
+                break
+            batch.append(request)
+            rows += len(request.rows)
+        return batch
+
+    def _execute(self, batch):
+        started = time.perf_counter()
+        groups = {}
+        for request in batch:
+            groups.setdefault((id(request.predictor), request.intervals), []).append(request)
+        for requests in groups.values():
+            predictor, intervals = requests[0].predictor, requests[0].intervals
+            queue_ms = [(started - r.enqueued_at) * 1000 for r in requests]
+            rows = [row for r in requests for row in r.rows]
+            compute_started = time.perf_counter()
+            try:
+                results = predictor.predict_batch(np.array(rows, dtype=np.float64), intervals=intervals)
+            except Exception as e:
+                self.metrics.record_batch(len(rows), queue_ms, (time.perf_counter() - compute_started) * 1000, failed=True)
+                for r in requests:
+                    r.future.set_exception(e)
+                continue
+            self.metrics.record_batch(len(rows), queue_ms, (time.perf_counter() - compute_started) * 1000)
+            offset = 0
+            for r in requests:
+                mine = results[offset:offset + len(r.rows)]
+                offset += len(r.rows)
+                if r.single:
+                    if predictor.cache is not None:
+                        predictor.cache.put(predictor.memo_version(intervals), r.rows[0], mine[0])
+                    r.future.set_result(mine[0])
+                else:
+                    r.future.set_result(mine)
+
+    def _run(self):
+        while True:
+            request = self._queue.get()
+            if request is None:
+                return
+            batch = self._collect(request)
+            with self._lock:
+                self._in_flight += len(batch)
+            try:
+                self._execute(batch)
+            finally:
+                with self._lock:
+                    self._in_flight -= len(batch)
+
+    def start(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"ml-inference-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join(timeout=5)
+
+    def stats(self) -> dict:
+        return dict(self.metrics.snapshot(), queue_depth=self.queue_depth, workers=self.workers,
+                    batch_window_ms=self.batch_window * 1000, max_batch=self.max_batch)
+
+
+executor = InferenceExecutor()
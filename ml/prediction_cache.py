@@ -0,0 +1,80 @@
+"""
+Bounded LRU memo for predictions.
+
+Sanitized inputs are small integers (ratings clamped to 0-10, exposures
+0/1, whole ages) plus a PEFR reading, so real traffic repeats the same
+feature tuples a lot. Entries are keyed on (model version, sanitized row),
+so a newly loaded model never serves results computed by an older one;
+old-version entries simply age out.
+
+`warm` precomputes a list of common rows (e.g. the most frequent inputs in
+the audit log) with one `predict_batch` call.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+CACHE_SIZE = int(os.getenv("ML_CACHE_SIZE", "4096"))
+
+
+class PredictionCache:
+    def __init__(self, maxsize: int = CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.warmed = 0
+
+    def get(self, version, row: tuple):
+        key = (version, row)
+        with self._lock:
+            result = self._entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return dict(result)
+
+    def put(self, version, row: tuple, result: dict):
+        if self.maxsize <= 0:
+            return
+        key = (version, row)
+        with self._lock:
+            self._entries[key] = dict(result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def warm(self, predictor, rows) -> int:
+        """Precompute predictions for sanitized rows (tuples in FEATURES order); returns entries added."""
+        rows = [tuple(r) for r in rows][:self.maxsize]
+        if not rows:
+            return 0
+        for row, result in zip(rows, predictor.predict_batch(rows)):
+            self.put(predictor.version, row, result)
+        self.warmed += len(rows)
+        return len(rows)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "warmed": self.warmed,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+cache = PredictionCache()
@@ -3,63 +3,271 @@ Model loader and predictor helpers.
 
 This module loads the models produced by `train.py` and exposes a
 `predict` function that accepts a dictionary of features and returns
-the recommended medicine, days, and cure probability.
+the recommended medicine, days, and cure probability. `predict_batch`
+does the same for an (N, 6) array of feature rows, running each model
+once over the whole batch.
+
+Two model layouts are supported (see `train.py --layout`): "separate"
+(days_reg + prob_reg) and "combined", where one multi-output regressor
+(outcome_reg) predicts [days, cure_prob] together. The layout is picked
+from the files present in the model directory.
+
+With `intervals=True` the predictions also carry a central interval
+(ML_INTERVAL_LEVEL, default 0.8: the 10th-90th percentile) for days and
+cure probability, taken from the spread of the individual trees' outputs
+of the same forests; no extra model is needed.
 
 Comment: // this for deep learning - placeholder for model code
 """
+import hashlib
+import os
 from pathlib import Path
 import joblib
 import numpy as np
 import pandas as pd
 import sklearn
+import threading
 import time
 
-MODEL_DIR = Path(__file__).parent / "models"
+from ml import prediction_cache
+
+MODEL_DIR = Path(os.getenv("ML_MODEL_DIR") or Path(__file__).parent / "models")
+
+# "sklearn" (evaluate the fitted trees) or "compiled" (ml.compiled_forest)
+PREDICTOR_BACKEND = os.getenv("ML_PREDICTOR_BACKEND", "sklearn").lower()
+
+# Largest batch accepted by the /ml/predict/batch endpoint
+MAX_BATCH_ROWS = int(os.getenv("ML_MAX_BATCH_ROWS", "1000"))
+
+# Coverage of the optional prediction intervals (0.8 = 10th to 90th percentile of the trees)
+INTERVAL_LEVEL = float(os.getenv("ML_INTERVAL_LEVEL", "0.8"))
+
+# Feature order used for training and for predict_batch rows
+FEATURES = ["age", "pefr_value", "wheeze_rating", "cough_rating", "dust_exposure", "smoke_exposure"]
+
+# Model files of each layout; regressor outputs are always [days, cure_prob]
+SEPARATE_FILES = ("medicine_clf.joblib", "label_encoder.joblib", "days_reg.joblib", "prob_reg.joblib")
+COMBINED_FILES = ("medicine_clf.joblib", "label_encoder.joblib", "outcome_reg.joblib")
+
+
+def model_layout(model_dir) -> str:
+    """The layout of the models in `model_dir`: "combined" if it holds outcome_reg, else "separate"."""
+    return "combined" if (Path(model_dir) / "outcome_reg.joblib").exists() else "separate"
+
+
+def model_files(model_dir):
+    """Paths of the model files for the layout found in `model_dir`."""
+    model_dir = Path(model_dir)
+    names = COMBINED_FILES if model_layout(model_dir) == "combined" else SEPARATE_FILES
+    return [model_dir / name for name in names]
+
+
+def features_to_rows(features_list):
+    """Stack feature dicts (as accepted by `predict`) into an (N, 6) float64 array."""
+    rows = np.zeros((len(features_list), len(FEATURES)), dtype=np.float64)
+    for i, features in enumerate(features_list):
+        rows[i] = [float(features.get(k) or 0) for k in FEATURES]
+    return rows
+
+
+def sanitize_rows(rows) -> np.ndarray:
+    """Vectorized version of the per-row sanitizing in `predict`."""
+    X = np.array(rows, dtype=np.float64, copy=True).reshape(-1, len(FEATURES))
+    X[np.isnan(X)] = 0.0
+    X[:, 0] = np.maximum(np.trunc(X[:, 0]), 0)               # age
+    X[:, 1] = np.clip(X[:, 1], 0.0, 1000.0)                  # pefr_value
+    X[:, 2:4] = np.clip(np.trunc(X[:, 2:4]), 0, 10)          # wheeze / cough ratings
+    X[:, 4:6] = (X[:, 4:6] != 0).astype(np.float64)          # exposures
+    return X
+
+
+def model_version(paths) -> str:
+    """Short fingerprint of the model files (name, size, modification time)."""
+    digest = hashlib.sha1()
+    for path in paths:
+        stat = Path(path).stat()
+        digest.update(f"{Path(path).name}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()[:12]
+
+
+def sanitize_features(features: dict) -> dict:
+    """Build and sanitize one input row (as `predict` expects) with explicit types."""
+    # Expected keys: age, pefr_value, wheeze_rating, cough_rating, dust_exposure, smoke_exposure
+    row = {
+        "age": int(features.get("age") or 0),
+        "pefr_value": float(features.get("pefr_value") or 0.0),
+        "wheeze_rating": int(features.get("wheeze_rating") or 0),
+        "cough_rating": int(features.get("cough_rating") or 0),
+        "dust_exposure": 1 if features.get("dust_exposure") else 0,
+        "smoke_exposure": 1 if features.get("smoke_exposure") else 0,
+    }
+
+    # Basic sanity/clamping for inputs (helps ensure consistent preprocessing)
+    if row["age"] < 0:
+        row["age"] = 0
+    # reasonable PEFR range: 0 - 1000 (clamp unexpected readings)
+    row["pefr_value"] = float(max(0.0, min(1000.0, row["pefr_value"])))
+    for k in ("wheeze_rating", "cough_rating"):
+        row[k] = int(max(0, min(10, row[k])))
+    return row
 
 
 class Predictor:
-    def __init__(self):
+    """Loads the trained models and predicts without going through pandas.
+
+    sklearn forests re-validate their input and dispatch every tree through
+    joblib on each call, which costs far more than walking the trees for a
+    single row. Here the feature names are checked once at load, inputs are
+    written into a per-thread float32 buffer (the dtype the trees split on)
+    and each tree is evaluated directly, accumulating in estimator order just
+    like the forest does, so results are identical to `predict_reference`.
+    """
+
+    backend = "sklearn"
+
+    def __init__(self, model_dir=None):
+        self.model_dir = Path(model_dir) if model_dir else MODEL_DIR
         self._loaded = False
+        # optional ml.prediction_cache.PredictionCache (set by get_predictor)
+        self.cache = None
         self._load_models()
+        self._prepare_fast_path()
 
     def _load_models(self):
-        clf_path = MODEL_DIR / "medicine_clf.joblib"
-        le_path = MODEL_DIR / "label_encoder.joblib"
-        days_path = MODEL_DIR / "days_reg.joblib"
-        prob_path = MODEL_DIR / "prob_reg.joblib"
-
-        if not clf_path.exists() or not le_path.exists() or not days_path.exists() or not prob_path.exists():
+        paths = model_files(self.model_dir)
+        if not all(p.exists() for p in paths):
             raise FileNotFoundError("Models not found. Please run ml/train.py to generate models.")
 
-        self.clf = joblib.load(clf_path)
-        self.le = joblib.load(le_path)
-        self.days_reg = joblib.load(days_path)
-        self.prob_reg = joblib.load(prob_path)
+        self.layout = model_layout(self.model_dir)
+        self.clf = joblib.load(paths[0])
+        self.le = joblib.load(paths[1])
+        if self.layout == "combined":
+            self.outcome_reg = joblib.load(paths[2])
+            self.days_reg = self.prob_reg = None
+        else:
+            self.outcome_reg = None
+            self.days_reg = joblib.load(paths[2])
+            self.prob_reg = joblib.load(paths[3])
+        self.version = model_version(paths)
         self._loaded = True
 
-    def predict(self, features: dict):
-        # Expected keys: age, pefr_value, wheeze_rating, cough_rating, dust_exposure, smoke_exposure
-        # Build a DataFrame with the same column names used during training
-        cols = ["age", "pefr_value", "wheeze_rating", "cough_rating", "dust_exposure", "smoke_exposure"]
-        # Build and sanitize input row with explicit dtypes
-        row = {
-            "age": int(features.get("age") or 0),
-            "pefr_value": float(features.get("pefr_value") or 0.0),
-            "wheeze_rating": int(features.get("wheeze_rating") or 0),
-            "cough_rating": int(features.get("cough_rating") or 0),
-            "dust_exposure": 1 if features.get("dust_exposure") else 0,
-            "smoke_exposure": 1 if features.get("smoke_exposure") else 0,
-        }
+    def regressors(self):
+        """The fitted regressors, whose outputs concatenate to [days, cure_prob]."""
+        if self.layout == "combined":
+            return [self.outcome_reg]
+        return [self.days_reg, self.prob_reg]
+
+    def _prepare_fast_path(self):
+        regressors = self.regressors()
+        for model in [self.clf] + regressors:
+            names = getattr(model, "feature_names_in_", None)
+            if names is not None and list(names) != FEATURES:
+                raise ValueError(f"Model was trained on features {list(names)}, expected {FEATURES}")
+            if model.n_features_in_ != len(FEATURES):
+                raise ValueError(f"Model expects {model.n_features_in_} features, expected {len(FEATURES)}")
+        if sum(model.n_outputs_ for model in regressors) != 2:
+            raise ValueError("Regressors must predict exactly [days, cure_prob]")
+
+        self._clf_trees = [e.tree_ for e in self.clf.estimators_]
+        # (trees, first output column, last output column) per regressor
+        self._reg_trees, column = [], 0
+        for model in regressors:
+            self._reg_trees.append(([e.tree_ for e in model.estimators_], column, column + model.n_outputs_))
+            column += model.n_outputs_
+        self._n_classes = int(self.clf.n_classes_)
+        # classifier output index -> medicine name, instead of inverse_transform per call
+        self._labels = np.asarray(self.le.inverse_transform(self.clf.classes_.astype(np.int64)).tolist(), dtype=object)
+        self._local = threading.local()
+
+    def _buffers(self):
+        local = self._local
+        if not hasattr(local, "row"):
+            local.row = np.zeros((1, len(FEATURES)), dtype=np.float32)
+            local.proba = np.zeros((1, self._n_classes), dtype=np.float64)
+            local.outputs = np.zeros((1, 2), dtype=np.float64)
+        return local
+
+    @staticmethod
+    def _forest_mean(trees, X, out):
+        """Same arithmetic as the sklearn forest: sum tree outputs in order, then divide."""
+        out.fill(0.0)
+        for tree in trees:
+            # multi-output regression trees return (n, n_outputs, 1)
+            out += tree.predict(X).reshape(out.shape)
+        out /= len(trees)
+        return out
 
-        # Basic sanity/clamping for inputs (helps ensure consistent preprocessing)
-        if row["age"] < 0:
-            row["age"] = 0
-        # reasonable PEFR range: 0 - 1000 (clamp unexpected readings)
-        row["pefr_value"] = float(max(0.0, min(1000.0, row["pefr_value"])))
-        for k in ("wheeze_rating", "cough_rating"):
-            row[k] = int(max(0, min(10, row[k])))
+    def _predict_raw(self, X, proba, outputs):
+        """Class indices and raw days / cure probability for a C-contiguous float32 matrix."""
+        self._forest_mean(self._clf_trees, X, proba)
+        for trees, first, last in self._reg_trees:
+            self._forest_mean(trees, X, outputs[:, first:last])
+        return proba.argmax(axis=1), outputs[:, 0], outputs[:, 1]
 
-        arr = pd.DataFrame([row], columns=cols)
+    def _tree_outputs(self, X, proba):
+        """Class indices plus every regressor's per-tree outputs, as (n_trees, n_rows, n_outputs) arrays."""
+        self._forest_mean(self._clf_trees, X, proba)
+        n = len(X)
+        matrices = []
+        for trees, first, last in self._reg_trees:
+            matrix = np.empty((len(trees), n, last - first), dtype=np.float64)
+            for i, tree in enumerate(trees):
+                matrix[i] = tree.predict(X).reshape(n, -1)
+            matrices.append(matrix)
+        return proba.argmax(axis=1), matrices
+
+    def _predict_intervals(self, X, proba, level: float = INTERVAL_LEVEL):
+        """Like `_predict_raw`, plus (2, n_rows, 2) low/high quantiles of [days, cure_prob] over the trees."""
+        med_idx, matrices = self._tree_outputs(X, proba)
+        quantiles = ((1 - level) / 2, (1 + level) / 2)
+        # cumsum adds in tree order, so the means match `_predict_raw` bit for bit
+        outputs = np.concatenate([np.cumsum(m, axis=0)[-1] / len(m) for m in matrices], axis=1)
+        bounds = np.concatenate([np.quantile(m, quantiles, axis=0) for m in matrices], axis=2)
+        return med_idx, outputs[:, 0], outputs[:, 1], bounds
+
+    def memo_version(self, intervals: bool = False):
+        """Prediction memo key for this model; interval results are memoized separately."""
+        return (self.version, INTERVAL_LEVEL) if intervals else self.version
+
+    def predict(self, features: dict, intervals: bool = False):
+        row = sanitize_features(features)
+        key = tuple(row[k] for k in FEATURES)
+        if self.cache is not None:
+            cached = self.cache.get(self.memo_version(intervals), key)
+            if cached is not None:
+                return cached
+
+        if intervals:
+            result = self.predict_batch(np.array([key], dtype=np.float64), intervals=True)[0]
+            if self.cache is not None:
+                self.cache.put(self.memo_version(True), key, result)
+            return result
+
+        buffers = self._buffers()
+        buffers.row[0] = key
+
+        med_idx, days_raw, prob_raw = self._predict_raw(buffers.row, buffers.proba, buffers.outputs)
+        med = self._labels[med_idx[0]]
+        days = int(round(float(days_raw[0])))
+        prob = float(prob_raw[0])
+
+        # clamp values
+        days = max(1, min(30, days))
+        prob = max(0.0, min(1.0, prob))
+
+        result = {
+            "recommended_medicine": med,
+            "recommended_days": days,
+            "predicted_cure_probability": prob,
+        }
+        if self.cache is not None:
+            self.cache.put(self.version, key, result)
+        return result
+
+    def predict_reference(self, features: dict):
+        """The original pandas + sklearn path; kept to check `predict` against."""
+        row = sanitize_features(features)
+        arr = pd.DataFrame([row], columns=FEATURES)
 
         # enforce dtypes to avoid differences between pandas/numpy versions
         arr = arr.astype({
@@ -74,8 +282,12 @@ class Predictor:
         # Predict (sklearn models should be deterministic if trained/saved consistently)
         med_idx = int(self.clf.predict(arr)[0])
         med = self.le.inverse_transform([med_idx])[0]
-        days = int(round(float(self.days_reg.predict(arr)[0])))
-        prob = float(self.prob_reg.predict(arr)[0])
+        if self.layout == "combined":
+            days_raw, prob_raw = self.outcome_reg.predict(arr)[0]
+        else:
+            days_raw, prob_raw = self.days_reg.predict(arr)[0], self.prob_reg.predict(arr)[0]
+        days = int(round(float(days_raw)))
+        prob = float(prob_raw)
 
         # clamp values
         days = max(1, min(30, days))
@@ -87,19 +299,106 @@ class Predictor:
             "predicted_cure_probability": prob,
         }
 
+    def predict_batch(self, rows, intervals: bool = False):
+        """Predict for an (N, 6) array of feature rows in FEATURES order; returns a list of dicts."""
+        X = np.ascontiguousarray(sanitize_rows(rows), dtype=np.float32)
+        n = len(X)
+        if n == 0:
+            return []
+
+        proba = np.zeros((n, self._n_classes), dtype=np.float64)
+        if intervals:
+            med_idx, days_raw, prob_raw, bounds = self._predict_intervals(X, proba)
+        else:
+            med_idx, days_raw, prob_raw = self._predict_raw(X, proba, np.zeros((n, 2), dtype=np.float64))
+        meds = self._labels[med_idx]
+        days = np.clip(np.round(days_raw), 1, 30).astype(np.int64)
+        probs = np.clip(prob_raw, 0.0, 1.0)
+
+        results = [
+            {
+                "recommended_medicine": med,
+                "recommended_days": int(d),
+                "predicted_cure_probability": float(p),
+            }
+            for med, d, p in zip(meds.tolist(), days.tolist(), probs.tolist())
+        ]
+        if intervals:
+            # same rounding and clamping as the point estimates
+            days_low, days_high = np.clip(np.round(bounds[:, :, 0]), 1, 30).astype(np.int64).tolist()
+            prob_low, prob_high = np.clip(bounds[:, :, 1], 0.0, 1.0).tolist()
+            for result, dl, dh, pl, ph in zip(results, days_low, days_high, prob_low, prob_high):
+                result.update({
+                    "recommended_days_low": dl,
+                    "recommended_days_high": dh,
+                    "cure_probability_low": pl,
+                    "cure_probability_high": ph,
+                    "interval_level": INTERVAL_LEVEL,
+                })
+        return results
+
+
+def warm_up(p, rows: int = 200, seed: int = 0) -> float:
+    """Run synthetic predictions through `p` (bypassing the memo); returns seconds taken."""
+    started = time.perf_counter()
+    rng = np.random.RandomState(seed)
+    X = np.column_stack([
+        rng.randint(5, 80, size=rows),
+        rng.randint(50, 600, size=rows),
+        rng.randint(0, 11, size=rows),
+        rng.randint(0, 11, size=rows),
+        rng.randint(0, 2, size=rows),
+        rng.randint(0, 2, size=rows),
+    ]).astype(np.float64)
+    for i in range(rows):
+        p.predict_batch(X[i:i + 1])
+    p.predict_batch(X)
+    return time.perf_counter() - started
+
 
 # Singleton predictor instance (will raise if models missing)
 _PREDICTOR = None
+_PREDICTOR_LOCK = threading.Lock()
+
+
+def load_predictor(model_dir=None):
+    """A new predictor for the configured backend, sharing the prediction memo."""
+    if PREDICTOR_BACKEND == "compiled":
+        from ml.compiled_forest import CompiledPredictor
+        p = CompiledPredictor(model_dir)
+    else:
+        p = Predictor(model_dir)
+    p.cache = prediction_cache.cache
+    return p
 
 
 def get_predictor():
+    """The served predictor: the registry's active version if there is one, else ml/models."""
     global _PREDICTOR
     if _PREDICTOR is None:
-        _PREDICTOR = Predictor()
+        with _PREDICTOR_LOCK:
+            if _PREDICTOR is None:
+                from ml import registry
+                version = registry.active_version()
+                if version is not None:
+                    _PREDICTOR = registry.load(version)
+                else:
+                    _PREDICTOR = load_predictor()
+    return _PREDICTOR
+
+
+def current_predictor():
+    """The served predictor, or None if nothing is loaded yet (never loads)."""
     return _PREDICTOR
 
 
-def model_and_env_info():
+def set_predictor(p):
+    """Swap the served predictor; callers already holding the old one keep using it."""
+    global _PREDICTOR
+    _PREDICTOR = p
+
+
+def model_and_env_info(model_dir=None):
     """Return versions and model file timestamps useful for reproducibility checks.
 
     Useful to return in API responses when debugging inconsistent outputs across
@@ -109,10 +408,13 @@ def model_and_env_info():
         "pandas": pd.__version__,
         "scikit_learn": sklearn.__version__,
         "joblib": joblib.__version__ if hasattr(joblib, "__version__") else "unknown",
+        "model_version": _PREDICTOR.version if _PREDICTOR is not None else None,
         "model_files": {},
     }
-    for fname in ("medicine_clf.joblib", "label_encoder.joblib", "days_reg.joblib", "prob_reg.joblib"):
-        p = MODEL_DIR / fname
+    model_dir = Path(model_dir) if model_dir else MODEL_DIR
+    info["model_layout"] = model_layout(model_dir)
+    for p in model_files(model_dir):
+        fname = p.name
         if p.exists():
             info["model_files"][fname] = {
                 "path": str(p),
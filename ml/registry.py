@@ -0,0 +1,221 @@
+"""
+Versioned model registry with hot reload.
+
+Layout (ML_REGISTRY_DIR, default ml/models/registry):
+
+    registry/
+        ACTIVE                      name of the active version
+        20261019-101500-3f2a9c1e/
+            medicine_clf.joblib  label_encoder.joblib  days_reg.joblib  prob_reg.joblib
+                                    (or outcome_reg.joblib for the combined layout)
+            compiled/               optional, from ml.export_compiled
+            manifest.json           sha256 + size per file (compiled/ included), env info, created_at
+
+`register` copies a trained model set into a new version directory (staged
+under a temporary name and renamed into place) and `activate` rewrites
+ACTIVE with an atomic os.replace. `reload` loads and checksums the active
+version off to the side and then swaps the served predictor in one
+assignment: requests already holding the old predictor finish on it, and
+every response reports the version that produced it.
+
+Reloads are triggered by the admin endpoint (POST /ml/models/reload) or
+by `RegistryWatcher`, which polls ACTIVE every ML_REGISTRY_POLL_SECONDS
+(default 5, 0 = off). The endpoint only swaps the worker that served it;
+the watcher is what brings every other worker onto the new version.
+Without a registry the predictor keeps loading ml/models/.
+
+    python -m ml.train --register --activate
+"""
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+
+from ml import predictor as predictor_module
+
+REGISTRY_DIR = Path(os.getenv("ML_REGISTRY_DIR") or Path(__file__).parent / "models" / "registry")
+POLL_SECONDS = float(os.getenv("ML_REGISTRY_POLL_SECONDS", "5"))
+
+ACTIVE_FILE = "ACTIVE"
+MANIFEST_FILE = "manifest.json"
+
+_reload_lock = threading.Lock()
+
+
+class RegistryError(Exception):
+    pass
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_atomic(path: Path, content: str):
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(content)
+    os.replace(tmp, path)
+
+
+def active_version(registry_dir: Path = None):
+    path = Path(registry_dir or REGISTRY_DIR) / ACTIVE_FILE
+    if not path.exists():
+        return None
+    return path.read_text().strip() or None
+
+
+def list_versions(registry_dir: Path = None):
+    """Manifests of every registered version, oldest first."""
+    registry_dir = Path(registry_dir or REGISTRY_DIR)
+    if not registry_dir.exists():
+        return []
+    manifests = []
+    for path in sorted(registry_dir.iterdir()):
+        if (path / MANIFEST_FILE).exists() and not path.name.startswith("."):
+            manifests.append(json.loads((path / MANIFEST_FILE).read_text()))
+    return manifests
+
+
+def register(source_dir: Path = None, registry_dir: Path = None, version: str = None) -> str:
+    """Copy a trained model set into a new registry version; returns the version name."""
+    source_dir = Path(source_dir or predictor_module.MODEL_DIR)
+    registry_dir = Path(registry_dir or REGISTRY_DIR)
+    names = [path.name for path in predictor_module.model_files(source_dir)]
+    missing = [name for name in names if not (source_dir / name).exists()]
+    if missing:
+        raise RegistryError(f"Missing model files in {source_dir}: {', '.join(missing)}")
+
+    compiled = source_dir / "compiled"
+    if (compiled / "meta.json").exists():
+        names += [f"compiled/{path.name}" for path in sorted(compiled.iterdir()) if path.is_file()]
+    files = {name: {"sha256": _sha256(source_dir / name), "size": (source_dir / name).stat().st_size}
+             for name in names}
+    if version is None:
+        combined = hashlib.sha256("".join(files[n]["sha256"] for n in names).encode()).hexdigest()
+        version = f"{datetime.datetime.utcnow():%Y%m%d-%H%M%S}-{combined[:8]}"
+    target = registry_dir / version
+    if target.exists():
+        raise RegistryError(f"Version {version} already exists")
+
+    staging = registry_dir / f".{version}.staging"
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+    for name in names:
+        # copy2 keeps mtimes, so compiled artifacts stay matched to their source files
+        (staging / name).parent.mkdir(exist_ok=True)
+        shutil.copy2(source_dir / name, staging / name)
+
+    env = predictor_module.model_and_env_info(source_dir)
+    env.pop("model_files", None)
+    env.pop("model_version", None)
+    manifest = {
+        "version": version,
+        "created_at": datetime.datetime.utcnow().isoformat(),
+        "files": files,
+        "env": env,
+    }
+    (staging / MANIFEST_FILE).write_text(json.dumps(manifest, indent=2))
+    os.rename(staging, target)
+    return version
+
+
+def activate(version: str, registry_dir: Path = None):
+    registry_dir = Path(registry_dir or REGISTRY_DIR)
+    if not (registry_dir / version / MANIFEST_FILE).exists():
+        raise RegistryError(f"Unknown model version {version}")
+    _write_atomic(registry_dir / ACTIVE_FILE, version + "\n")
+
+
+def verify(version: str, registry_dir: Path = None) -> dict:
+    """Check a version's files against its manifest; returns the manifest."""
+    version_dir = Path(registry_dir or REGISTRY_DIR) / version
+    manifest_path = version_dir / MANIFEST_FILE
+    if not manifest_path.exists():
+        raise RegistryError(f"Unknown model version {version}")
+    manifest = json.loads(manifest_path.read_text())
+    for name, expected in manifest["files"].items():
+        path = version_dir / name
+        if not path.exists() or _sha256(path) != expected["sha256"]:
+            raise RegistryError(f"Checksum mismatch for {name} in version {version}")
+    return manifest
+
+
+def load(version: str, registry_dir: Path = None):
+    """Build a predictor for a registered version (not yet served)."""
+    manifest = verify(version, registry_dir)
+    try:
+        p = predictor_module.load_predictor(Path(registry_dir or REGISTRY_DIR) / version)
+    except Exception as e:
+        # e.g. a pickle from an incompatible sklearn version
+        raise RegistryError(f"Could not load model version {version}: {e}") from e
+    p.version = manifest["version"]
+    return p
+
+
+def reload(version: str = None, registry_dir: Path = None):
+    """Activate `version` (or re-read ACTIVE) and swap the served predictor; returns it."""
+    with _reload_lock:
+        target = version or active_version(registry_dir)
+        if target is None:
+            raise RegistryError("No active model version in the registry")
+        current = predictor_module.current_predictor()
+        if current is not None and current.version == target:
+            new = current
+        else:
+            # load, verify and warm before touching ACTIVE, so a bad version is never left active
+            new = load(target, registry_dir)
+            try:
+                predictor_module.warm_up(new)
+            except Exception as e:
+                raise RegistryError(f"Model version {target} failed its warm-up prediction: {e}") from e
+        if version is not None:
+            activate(version, registry_dir)
+        if new is not current:
+            predictor_module.set_predictor(new)
+            print(f"Model version {target} is now serving")
+        return new
+
+
+class RegistryWatcher:
+    """Polls the ACTIVE file and reloads when it names a different version."""
+
+    def __init__(self, registry_dir: Path = None, poll_seconds: float = POLL_SECONDS):
+        self.registry_dir = registry_dir
+        self.poll_seconds = poll_seconds
+        self._stop = threading.Event()
+        self._thread = None
+
+    def check(self):
+        version = active_version(self.registry_dir)
+        current = predictor_module.current_predictor()
+        if version and (current is None or current.version != version):
+            try:
+                reload(registry_dir=self.registry_dir)
+            except Exception as e:
+                print(f"Model reload to {version} failed: {e}")
+
+    def _run(self):
+        while not self._stop.wait(self.poll_seconds):
+            self.check()
+
+    def start(self):
+        if self.poll_seconds <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="model-registry-watch", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+watcher = RegistryWatcher()
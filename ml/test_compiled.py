@@ -0,0 +1,60 @@
+"""
+Tests for the compiled forest backend.
+
+Trains small forests on synthetic data and requires the compiled arrays to
+reproduce sklearn's outputs exactly (np.array_equal, no tolerance), both
+for the raw forests and through CompiledPredictor for each model layout.
+Needs no trained models on disk.
+
+    python -m ml.test_compiled
+    python -m pytest ml/test_compiled.py
+"""
+import tempfile
+
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
+
+from ml.bench_predict import random_rows
+from ml.compiled_forest import CompiledForest, CompiledPredictor
+from ml.predictor import Predictor, FEATURES
+from ml.train import generate_synthetic, fit_models, save_models
+
+
+def test_forest_outputs_bit_identical():
+    df = generate_synthetic(n=400, seed=1)
+    X = df[FEATURES].fillna(0).to_numpy(dtype=np.float64)
+    clf = RandomForestClassifier(n_estimators=15, random_state=0).fit(X, df["medicine"])
+    days = RandomForestRegressor(n_estimators=10, random_state=0).fit(X, df["days"])
+    outcome = RandomForestRegressor(n_estimators=10, max_depth=6, random_state=0).fit(X, df[["days", "cure_prob"]].values)
+    forests = [clf, days, outcome]
+
+    # training rows plus unseen ones, including values outside the training range
+    X_test = np.vstack([X, random_rows(500, seed=3)])
+    got = CompiledForest.from_forests(forests).predict(X_test.astype(np.float32))
+    expected = [clf.predict_proba(X_test), days.predict(X_test), outcome.predict(X_test)]
+    for e, g in zip(expected, got):
+        assert np.array_equal(e, np.asarray(g).reshape(e.shape))
+
+
+def test_compiled_predictor_matches_sklearn():
+    df = generate_synthetic(n=300, seed=2)
+    rows = random_rows(200, seed=4)
+    for layout in ("separate", "combined"):
+        with tempfile.TemporaryDirectory() as model_dir:
+            save_models(fit_models(df, layout), model_dir)
+            reference, compiled = Predictor(model_dir), CompiledPredictor(model_dir)
+            reference.cache = compiled.cache = None
+            assert compiled.predict_batch(rows) == reference.predict_batch(rows)
+            features = [dict(zip(FEATURES, row)) for row in rows[:20].tolist()]
+            assert [compiled.predict(f) for f in features] == [reference.predict(f) for f in features]
+
+
+def main():
+    test_forest_outputs_bit_identical()
+    print("✅ compiled forest outputs are bit-identical to sklearn")
+    test_compiled_predictor_matches_sklearn()
+    print("✅ CompiledPredictor matches Predictor for both layouts")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Check the compiled forest against sklearn on the training set.
+
+Compiles the saved models, evaluates every training row both ways and
+requires the class probabilities and regression outputs to be
+bit-identical. Also reports the in-memory size of both representations.
+
+Run after training models:
+    python -m ml.verify_compiled
+    python -m ml.verify_compiled --data mydata.csv
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from ml.compiled_forest import CompiledForest
+from ml.predictor import Predictor, FEATURES
+from ml.train import generate_synthetic
+
+
+def sklearn_tree_nbytes(forest):
+    total = 0
+    for estimator in forest.estimators_:
+        state = estimator.tree_.__getstate__()
+        total += state["nodes"].nbytes + state["values"].nbytes
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", help="Training CSV (defaults to the synthetic set train.py uses)")
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.data) if args.data else generate_synthetic()
+    X = df[FEATURES].fillna(0)
+
+    p = Predictor()
+    forests = [p.clf] + p.regressors()
+    compiled = CompiledForest.from_forests(forests)
+
+    started = time.perf_counter()
+    expected = [p.clf.predict_proba(X)] + [reg.predict(X) for reg in p.regressors()]
+    sklearn_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    got = compiled.predict(X.to_numpy(dtype=np.float32))
+    compiled_s = time.perf_counter() - started
+
+    ok = True
+    names = ["medicine_clf"] + (["outcome_reg"] if p.layout == "combined" else ["days_reg", "prob_reg"])
+    for name, e, g in zip(names, expected, got):
+        g = g.reshape(e.shape)
+        if np.array_equal(e, g):
+            print(f"✅ {name}: {len(X)} rows bit-identical")
+        else:
+            ok = False
+            print(f"❌ {name}: {int((e != g).any(axis=-1).sum()) if e.ndim > 1 else int((e != g).sum())} rows differ "
+                  f"(max abs diff {np.abs(e - g).max():.3g})")
+
+    sklearn_bytes = sum(sklearn_tree_nbytes(f) for f in forests)
+    print(f"trees:  {len(compiled.roots)}  nodes: {len(compiled.feature)}  max depth: {compiled.max_depth}")
+    print(f"memory: sklearn {sklearn_bytes / 1e6:.1f} MB, compiled {compiled.nbytes / 1e6:.1f} MB")
+    print(f"time:   sklearn {sklearn_s * 1000:.1f} ms, compiled {compiled_s * 1000:.1f} ms for {len(X)} rows")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
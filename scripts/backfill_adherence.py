@@ -0,0 +1,37 @@
+# Script to (re)build the medication adherence tables from MedicationStatusHistory.
+#
+# Usage:
+#     python -m scripts.backfill_adherence                 # all patients
+#     python -m scripts.backfill_adherence --chunk-size 50
+#     python -m scripts.backfill_adherence --owner 3 --owner 7
+
+import argparse
+import time
+
+from app.database import engine, Base, SessionLocal
+from app import models, adherence
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunk-size", type=int, default=adherence.BACKFILL_CHUNK_SIZE, help="Patients per transaction")
+    parser.add_argument("--owner", type=int, action="append", help="Only rebuild these patient ids")
+    args = parser.parse_args()
+
+    # Create tables if they don't exist
+    Base.metadata.create_all(bind=engine)
+
+    session = SessionLocal()
+    try:
+        started = time.perf_counter()
+        count = adherence.backfill(session, owner_ids=args.owner, chunk_size=args.chunk_size)
+        print(f"✅ Rebuilt adherence for {count} patients in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        session.rollback()
+        print(f"❌ Error rebuilding adherence: {e}")
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+# Script to (re)build the daily PEFR and symptom rollups from raw readings.
+#
+# Usage:
+#     python -m scripts.backfill_rollups                 # all patients
+#     python -m scripts.backfill_rollups --chunk-size 50
+#     python -m scripts.backfill_rollups --owner 3 --owner 7
+
+import argparse
+import time
+
+from app.database import engine, Base, SessionLocal
+from app import models, rollups
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunk-size", type=int, default=rollups.BACKFILL_CHUNK_SIZE, help="Patients per transaction")
+    parser.add_argument("--owner", type=int, action="append", help="Only rebuild these patient ids")
+    args = parser.parse_args()
+
+    # Create tables if they don't exist
+    Base.metadata.create_all(bind=engine)
+
+    session = SessionLocal()
+    try:
+        started = time.perf_counter()
+        count = rollups.backfill(session, owner_ids=args.owner, chunk_size=args.chunk_size)
+        print(f"✅ Rebuilt rollups for {count} patients in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        session.rollback()
+        print(f"❌ Error rebuilding rollups: {e}")
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
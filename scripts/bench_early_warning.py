@@ -0,0 +1,110 @@
+# Replay benchmark for the PEFR early-warning detector.
+#
+# Seeds a throwaway SQLite database with synthetic patients (a stable baseline
+# with occasional deterioration episodes), then replays every patient's full
+# history through early_warning.step() exactly as record_pefr does.
+#
+# Usage:
+#     python -m scripts.bench_early_warning
+#     python -m scripts.bench_early_warning --patients 500 --days 730 --seed 7
+
+import argparse
+import datetime
+import os
+import tempfile
+import time
+
+import numpy as np
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app import models, early_warning, pefr_state, zone_recompute
+
+
+def seed(session, patients: int, days: int, seed_value: int):
+    rng = np.random.RandomState(seed_value)
+    start = datetime.datetime(2024, 1, 1)
+    session.execute(models.User.__table__.insert(), [
+        {"id": i + 1, "email": f"patient{i + 1}@bench.local", "name": f"Patient {i + 1}",
+         "hashed_password": "x", "role": models.UserRole.PATIENT.name}
+        for i in range(patients)
+    ])
+
+    rows = []
+    for owner_id in range(1, patients + 1):
+        best = rng.randint(350, 600)
+        n = days * 2  # morning and evening readings
+        level = np.full(n, 0.92)
+        # a few multi-day deterioration episodes per year
+        for _ in range(rng.poisson(days / 120)):
+            at = rng.randint(0, n)
+            length = rng.randint(6, 30)
+            depth = rng.uniform(0.15, 0.5)
+            episode = level[at:at + length]
+            episode -= np.linspace(0, depth, length)[:len(episode)]
+        values = np.clip(best * level + rng.normal(0, best * 0.05, n), 50, 900).astype(int)
+        times = [start + datetime.timedelta(hours=12 * k + rng.randint(0, 90) / 60) for k in range(n)]
+        baselines = np.concatenate([[np.nan], np.maximum.accumulate(values)[:-1]])
+        zones, percentage = zone_recompute.assign_zones(values, baselines)
+        rows.extend(
+            {"owner_id": owner_id, "pefr_value": int(v), "zone": str(z), "percentage": float(p), "recorded_at": t}
+            for v, z, p, t in zip(values, zones, percentage, times)
+        )
+    session.execute(models.PEFRRecord.__table__.insert(), rows)
+    session.commit()
+    return len(rows)
+
+
+def replay(session):
+    """Run the detector over every reading, patient by patient, in time order."""
+    pefr = models.PEFRRecord
+    query = select(pefr.owner_id, pefr.recorded_at, pefr.zone, pefr.percentage).order_by(pefr.owner_id, pefr.recorded_at)
+
+    alerts = {}
+    readings = 0
+    state = None
+    started = time.perf_counter()
+    for owner_id, recorded_at, zone, percentage in session.execute(query):
+        if state is None or state.owner_id != owner_id:
+            state = pefr_state.PatientState(owner_id)
+        new = pefr_state.PatientState(owner_id, state.version + 1)
+        if early_warning.step(state, new, percentage if zone != "Unknown" else None, recorded_at):
+            alerts[owner_id] = alerts.get(owner_id, 0) + 1
+        state = new
+        readings += 1
+    return readings, alerts, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--patients", type=int, default=200)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    engine = create_engine(f"sqlite:///{path}")
+    try:
+        Base.metadata.create_all(bind=engine)
+        session = sessionmaker(bind=engine)()
+
+        started = time.perf_counter()
+        total = seed(session, args.patients, args.days, args.seed)
+        print(f"Seeded {total} readings for {args.patients} patients in {time.perf_counter() - started:.2f}s")
+
+        readings, alerts, elapsed = replay(session)
+        print(f"Replayed {readings} readings in {elapsed:.2f}s ({readings / elapsed:,.0f} readings/s, "
+              f"{elapsed / readings * 1e6:.1f} us/reading incl. row fetch)")
+        print(f"{sum(alerts.values())} {early_warning.ALERT_TYPE} alerts across {len(alerts)} patients "
+              f"(CUSUM h={early_warning.CUSUM_THRESHOLD}, EWMA < {early_warning.EWMA_THRESHOLD}%, "
+              f"debounce {early_warning.DEBOUNCE})")
+        session.close()
+    finally:
+        engine.dispose()
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
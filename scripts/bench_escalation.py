@@ -0,0 +1,80 @@
+# Latency benchmark for the alert escalation worker.
+#
+# Seeds a throwaway SQLite database with many open Red-zone alerts (most of
+# them already escalated to the doctor and waiting for the next tier) plus a
+# burst of fresh ones, then times a single EscalationWorker.run_pending()
+# pass, i.e. how long a new alert waits once the worker wakes up.
+#
+# Usage:
+#     python -m scripts.bench_escalation
+#     python -m scripts.bench_escalation --open 20000 --fresh 500
+
+import argparse
+import datetime
+import os
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app import models, escalation
+
+
+def seed(session, open_alerts: int, fresh: int, now: datetime.datetime):
+    patients = open_alerts + fresh
+    session.execute(models.User.__table__.insert(), [
+        {"id": i + 1, "email": f"user{i + 1}@bench.local", "name": f"User {i + 1}",
+         "hashed_password": "x", "role": models.UserRole.PATIENT.name}
+        for i in range(patients + 1)
+    ])
+    doctor_id = patients + 1
+    session.execute(models.DoctorPatient.__table__.insert(), [
+        {"doctor_id": doctor_id, "patient_id": i + 1, "risk_score": 0.0} for i in range(patients)
+    ])
+    waiting = now + datetime.timedelta(minutes=10)
+    session.execute(models.AlertLog.__table__.insert(), [
+        {"user_id": i + 1, "alert_type": "RED_ZONE_TRIGGERED", "timestamp": now, "resolved": False,
+         "occurrences": 1, "escalation_tier": 1 if i < open_alerts else 0,
+         "next_escalation_at": waiting if i < open_alerts else now}
+        for i in range(patients)
+    ])
+    session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--open", type=int, default=5000, help="Open alerts waiting for a later tier")
+    parser.add_argument("--fresh", type=int, default=100, help="New alerts due right now")
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    engine = create_engine(f"sqlite:///{path}")
+    try:
+        Base.metadata.create_all(bind=engine)
+        factory = sessionmaker(bind=engine)
+        session = factory()
+        now = datetime.datetime.utcnow()
+        seed(session, args.open, args.fresh, now)
+        session.close()
+
+        # doctor then contacts, matching the seeded tiers
+        worker = escalation.EscalationWorker(session_factory=factory, gateway=escalation.StubGateway(),
+                                             tiers=escalation.parse_tiers("doctor:0,contacts:15"))
+        started = time.perf_counter()
+        escalated = worker.run_pending(now)
+        elapsed = time.perf_counter() - started
+        print(f"Escalated {escalated} fresh alerts among {args.open + args.fresh} open in {elapsed * 1000:.1f} ms")
+
+        started = time.perf_counter()
+        worker.run_pending(now)
+        print(f"Idle poll over {args.open} waiting alerts: {(time.perf_counter() - started) * 1000:.2f} ms")
+    finally:
+        engine.dispose()
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -18,14 +18,20 @@ try:
     # Delete in proper dependency-safe order
     session.query(models.PushLog).delete()
     session.query(models.Device).delete()
+    session.query(models.MedicationForecast).delete()
+    session.query(models.MedicationAdherenceDaily).delete()
+    session.query(models.MedicationAdherence).delete()
     session.query(models.MedicationStatusHistory).delete()
     session.query(models.Medication).delete()
     session.query(models.Notification).delete()
     session.query(models.Reminder).delete()
     session.query(models.EmergencyContact).delete()
+    session.query(models.PEFRDailyRollup).delete()
+    session.query(models.SymptomDailyRollup).delete()
     session.query(models.PEFRRecord).delete()
     session.query(models.Symptom).delete()
     session.query(models.BaselinePEFR).delete()
+    session.query(models.PatientPEFRState).delete()
     session.query(models.DoctorPatient).delete()
     session.query(models.AuditLog).delete()
     session.query(models.AlertLog).delete()
@@ -0,0 +1,37 @@
+# Script to forecast medication run-out dates and send refill notifications.
+# Meant to run once a day (e.g. from cron).
+#
+# Usage:
+#     python -m scripts.forecast_refills
+#     python -m scripts.forecast_refills --no-notify     # only refresh forecasts
+
+import argparse
+import time
+
+from app.database import engine, Base, SessionLocal
+from app import refill_forecast
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--no-notify", action="store_true", help="Store forecasts without notifying anyone")
+    args = parser.parse_args()
+
+    # Create tables if they don't exist
+    Base.metadata.create_all(bind=engine)
+
+    session = SessionLocal()
+    try:
+        started = time.perf_counter()
+        stored, notified = refill_forecast.run_forecast(session, send_notifications=not args.no_notify)
+        print(f"✅ Forecast {stored} active medications, {notified} refill notifications "
+              f"in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        session.rollback()
+        print(f"❌ Error forecasting refills: {e}")
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+# Script to recompute stored PEFR zones/percentages after the baseline definition changes.
+#
+# Usage:
+#     PEFR_BASELINE_WINDOW_WEEKS=12 python -m scripts.recompute_zones
+#     python -m scripts.recompute_zones --weeks 0        # all-time personal best
+#     python -m scripts.recompute_zones --force          # also patients already on this definition
+#
+# Manually entered baselines seed the replay and are never lowered. Each
+# patient's PEFR state version is bumped, so running API workers drop their
+# cached state, chart windows and analytics on next use.
+
+import argparse
+import time
+
+from app.database import engine, Base, SessionLocal
+from app import pefr_state, zone_recompute
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--weeks", type=int, default=pefr_state.BASELINE_WINDOW_WEEKS,
+                        help="Rolling personal-best window in weeks (0 = all-time best)")
+    parser.add_argument("--chunk-size", type=int, default=zone_recompute.RECOMPUTE_CHUNK_SIZE, help="Patients per transaction")
+    parser.add_argument("--owner", type=int, action="append", help="Only recompute these patient ids")
+    parser.add_argument("--force", action="store_true", help="Recompute patients whose zones already use this window")
+    args = parser.parse_args()
+
+    # Create tables if they don't exist
+    Base.metadata.create_all(bind=engine)
+
+    session = SessionLocal()
+    try:
+        started = time.perf_counter()
+        changed = zone_recompute.recompute_zones(session, window_weeks=args.weeks, owner_ids=args.owner, chunk_size=args.chunk_size, force=args.force)
+        print(f"✅ Recomputed zones ({args.weeks} week window): {changed} readings changed in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        session.rollback()
+        print(f"❌ Error recomputing zones: {e}")
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
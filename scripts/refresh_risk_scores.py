@@ -0,0 +1,38 @@
+# Script to recompute doctor-patient risk scores. By default every link is
+# recomputed (e.g. after upgrading an existing database, where all links start
+# at 0); with --stale only the ones flagged by writes since the last refresh,
+# suitable for a cron sweep alongside the lazy refresh on the at-risk endpoint.
+#
+# Usage:
+#     python -m scripts.refresh_risk_scores
+#     python -m scripts.refresh_risk_scores --stale
+
+import argparse
+import time
+
+from app.database import engine, Base, SessionLocal
+from app import risk
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stale", action="store_true", help="Only recompute scores flagged since the last refresh")
+    args = parser.parse_args()
+
+    # Create tables if they don't exist
+    Base.metadata.create_all(bind=engine)
+
+    session = SessionLocal()
+    try:
+        started = time.perf_counter()
+        count = risk.refresh_all(session, stale_only=args.stale)
+        print(f"✅ Refreshed risk scores for {count} patients in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        session.rollback()
+        print(f"❌ Error refreshing risk scores: {e}")
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
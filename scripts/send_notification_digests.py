@@ -0,0 +1,34 @@
+# Script to send the summary push to doctors who opted in to notification digests.
+# Meant to run once an hour (e.g. from cron).
+#
+# Usage:
+#     python -m scripts.send_notification_digests
+#     python -m scripts.send_notification_digests --minutes 120
+
+import argparse
+
+from app.database import engine, Base, SessionLocal
+from app import notifications
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--minutes", type=float, default=60, help="Summarize updates from the last N minutes")
+    args = parser.parse_args()
+
+    # Create tables if they don't exist
+    Base.metadata.create_all(bind=engine)
+
+    session = SessionLocal()
+    try:
+        sent = notifications.send_digests(session, period_minutes=args.minutes)
+        print(f"✅ Sent {sent} notification digests")
+    except Exception as e:
+        session.rollback()
+        print(f"❌ Error sending digests: {e}")
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()